@@ -0,0 +1 @@
+""" Performance benchmarks for looper; see benchmarks/README.md """
@@ -0,0 +1,168 @@
+"""
+Resident memory per sample benchmark.
+
+Generates synthetic projects and builds the looper Project of each one in a
+fresh Python process, recording the resident set size (RSS) after importing
+looper, after building the project and after selecting samples on an
+attribute through the columnar sample view. The differences, divided by the
+number of samples, are the memory cost of a sample in the processed project
+and in the view.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_memory --sizes 1000 10000 -o memory.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .bench_submission import environment
+from .synthetic import make_project
+
+SELECTOR_ATTR = "protocol"
+SELECTOR_VALUE = "PROTO0"
+# repeated accesses to the selected samples, as made by a looper run
+SAMPLES_ACCESSES = 3
+
+
+def _rss():
+    """
+    Get the resident set size of the current process.
+
+    :return int: RSS in bytes; the peak RSS where /proc is unavailable
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        import resource
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 2 ** 10
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def measure(config, metrics_path):
+    """
+    Build the project in this process and write its memory metrics.
+
+    :param str config: path to the project config
+    :param str metrics_path: path to the JSON file to write the metrics to
+    """
+    import gc
+    from looper.project import Project, ProjectContext
+    gc.collect()
+    rss_start = _rss()
+    start = time.perf_counter()
+    prj = Project(config, dry_run=True)
+    build_s = time.perf_counter() - start
+    gc.collect()
+    rss_project = _rss()
+    start = time.perf_counter()
+    with ProjectContext(prj, selector_attribute=SELECTOR_ATTR,
+                        selector_include=[SELECTOR_VALUE]) as ctx:
+        for _ in range(SAMPLES_ACCESSES):
+            selected = len(ctx.samples)
+    select_s = time.perf_counter() - start
+    gc.collect()
+    rss_selected = _rss()
+    n_samples = len(prj.samples)
+    metrics = {
+        "project_build_s": round(build_s, 3),
+        "select_s": round(select_s, 4),
+        "selected_samples": selected,
+        "rss_start_mb": round(rss_start / 2 ** 20, 1),
+        "rss_project_mb": round(rss_project / 2 ** 20, 1),
+        "rss_selected_mb": round(rss_selected / 2 ** 20, 1),
+        "project_bytes_per_sample":
+            round((rss_project - rss_start) / n_samples)
+            if n_samples else None,
+        "columns_bytes_per_sample":
+            round((rss_selected - rss_project) / n_samples)
+            if n_samples else None}
+    with open(metrics_path, "w") as f:
+        json.dump(metrics, f)
+
+
+def bench_size(n_samples, workdir, n_pifaces, subsamples):
+    """
+    Benchmark a single project size.
+
+    :param int n_samples: number of samples in the project
+    :param str workdir: directory to generate the project in
+    :param int n_pifaces: number of sample pipeline interfaces
+    :param int subsamples: number of subsamples per sample
+    :return dict: the result for the project size
+    """
+    paths = make_project(workdir, n_samples, n_pifaces=n_pifaces,
+                         subsamples=subsamples, hooks="none")
+    metrics_path = os.path.join(workdir, "memory_metrics.json")
+    cmd = [sys.executable, "-m", "benchmarks.bench_memory", "--measure",
+           paths["config"], metrics_path]
+    with open(os.path.join(workdir, "memory.log"), "w") as log:
+        rc = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+    result = {"samples": n_samples, "returncode": rc}
+    if os.path.isfile(metrics_path):
+        with open(metrics_path) as f:
+            result.update(json.load(f))
+    print("n={samples:<7} rc={returncode} project: {project_bytes_per_sample} "
+          "B/sample, columns: {columns_bytes_per_sample} B/sample, select: "
+          "{select_s} s".format(**dict(
+              {"project_bytes_per_sample": None,
+               "columns_bytes_per_sample": None, "select_s": None},
+              **result)), file=sys.stderr)
+    return result
+
+
+def build_argparser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark looper resident memory per sample on "
+                    "synthetic projects")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="Project sizes (number of samples)")
+    parser.add_argument("--pipelines", type=int, default=1,
+                        help="Number of pipeline interfaces")
+    parser.add_argument("--subsamples", type=int, default=0,
+                        help="Number of subsamples per sample")
+    parser.add_argument("--workdir",
+                        help="Directory for the generated projects; a "
+                             "temporary one is used and removed by default")
+    parser.add_argument("-o", "--output",
+                        help="JSON file to write the results to; stdout by "
+                             "default")
+    parser.add_argument("--measure", nargs=2, metavar=("CONFIG", "METRICS"),
+                        help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = build_argparser().parse_args()
+    if args.measure:
+        return measure(*args.measure)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="looper_bench_")
+    try:
+        results = []
+        for n_samples in args.sizes:
+            size_dir = os.path.join(workdir, "n{}".format(n_samples))
+            os.makedirs(size_dir, exist_ok=True)
+            results.append(bench_size(n_samples, size_dir, args.pipelines,
+                                      args.subsamples))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = {"benchmark": "memory", "environment": environment(),
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
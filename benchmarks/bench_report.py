@@ -0,0 +1,225 @@
+"""
+Table and report generation benchmark.
+
+Generates synthetic projects with a fabricated pipeline results tree and
+measures 'looper table' and 'looper report'. Every measurement is a fresh
+Python process that runs looper in-process with file access accounting:
+files and bytes read, HTML pages written and the bytes read by the process
+according to the kernel (Linux only). Looper's own phase timings are
+included as well.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_report --sizes 100 1000 -o results.json
+"""
+
+import argparse
+import builtins
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .bench_submission import environment
+from .synthetic import make_project, make_results
+
+COMMANDS = ["table", "report"]
+RESULTS_SUBDIR = "results_pipeline"
+
+
+class FileAccounting(object):
+    """
+    Count the files opened by the current process.
+
+    Both the builtin open and pandas.read_csv are wrapped, since the pandas C
+    parser opens the files it's given paths to on its own. The number of
+    bytes read is approximated with the sizes of the opened files.
+    """
+    def __init__(self):
+        self.read_paths = {}
+        self.pages_written = 0
+        self._open = builtins.open
+        self._read_csv = None
+
+    def install(self):
+        """ Wrap the file-opening functions """
+        accounting = self
+
+        def _open(file, mode="r", *args, **kwargs):
+            handle = accounting._open(file, mode, *args, **kwargs)
+            if isinstance(file, (str, os.PathLike)):
+                accounting._record(file, mode)
+            return handle
+        builtins.open = _open
+
+        import pandas
+        self._read_csv = pandas.read_csv
+
+        def _read_csv(filepath_or_buffer, *args, **kwargs):
+            if isinstance(filepath_or_buffer, (str, os.PathLike)):
+                accounting._record(filepath_or_buffer, "r")
+            return accounting._read_csv(filepath_or_buffer, *args, **kwargs)
+        pandas.read_csv = _read_csv
+
+    def uninstall(self):
+        """ Restore the original file-opening functions """
+        builtins.open = self._open
+        if self._read_csv is not None:
+            import pandas
+            pandas.read_csv = self._read_csv
+
+    def _record(self, path, mode):
+        path = os.fspath(path)
+        if any(m in mode for m in "wax"):
+            if path.endswith(".html"):
+                self.pages_written += 1
+        elif os.path.isfile(path):
+            self.read_paths[path] = self.read_paths.get(path, 0) + 1
+
+    def summary(self):
+        """
+        :return dict: file access statistics
+        """
+        return {
+            "files_read": len(self.read_paths),
+            "file_opens": sum(self.read_paths.values()),
+            "bytes_read": sum(os.path.getsize(p) * n
+                              for p, n in self.read_paths.items()
+                              if os.path.isfile(p)),
+            "pages_written": self.pages_written}
+
+
+def _proc_io():
+    """
+    Get the I/O counters of the current process.
+
+    :return dict[str, int]: counters from /proc/self/io, empty if unavailable
+    """
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in
+                    (line.split(":") for line in f if line.strip())}
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def measure(command, config, metrics_path):
+    """
+    Run a looper command in this process and write its metrics.
+
+    :param str command: looper subcommand, 'table' or 'report'
+    :param str config: path to the project config
+    :param str metrics_path: path to the JSON file to write the metrics to
+    """
+    from looper.looper import main
+    timings_path = metrics_path + ".timings"
+    sys.argv = ["looper", command, config, "--timings", timings_path]
+    accounting = FileAccounting()
+    accounting.install()
+    io_start = _proc_io()
+    start = time.perf_counter()
+    try:
+        main()
+    finally:
+        wall = time.perf_counter() - start
+        io_end = _proc_io()
+        accounting.uninstall()
+    metrics = accounting.summary()
+    metrics["command_wall_s"] = round(wall, 3)
+    if io_start and io_end:
+        metrics["proc_bytes_read"] = io_end["rchar"] - io_start["rchar"]
+        metrics["proc_read_calls"] = io_end["syscr"] - io_start["syscr"]
+    if os.path.isfile(timings_path):
+        with open(timings_path) as f:
+            metrics["phases"] = json.load(f)
+        os.remove(timings_path)
+    with open(metrics_path, "w") as f:
+        json.dump(metrics, f)
+
+
+def bench_size(n_samples, commands, workdir):
+    """
+    Benchmark the selected commands for a single project size.
+
+    :param int n_samples: number of samples in the project
+    :param Iterable[str] commands: looper commands to measure
+    :param str workdir: directory to generate the project in
+    :return list[dict]: one result per command
+    """
+    paths = make_project(workdir, n_samples, n_pifaces=1, hooks="none")
+    make_results(os.path.join(paths["output_dir"], RESULTS_SUBDIR),
+                 n_samples)
+    results = []
+    for command in commands:
+        metrics_path = os.path.join(workdir, command + "_metrics.json")
+        log_path = os.path.join(workdir, command + ".log")
+        cmd = [sys.executable, "-m", "benchmarks.bench_report", "--measure",
+               command, paths["config"], metrics_path]
+        with open(log_path, "w") as log:
+            start = time.perf_counter()
+            rc = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+            wall = time.perf_counter() - start
+        result = {"samples": n_samples, "command": command, "returncode": rc,
+                  "wall_s": round(wall, 3)}
+        if os.path.isfile(metrics_path):
+            with open(metrics_path) as f:
+                result.update(json.load(f))
+        result["samples_per_s"] = round(n_samples / result["wall_s"], 1) \
+            if result["wall_s"] else None
+        print("{command:>6} n={samples:<7} {wall_s:>9.2f} s rc={returncode} "
+              "files read: {files_read}, bytes read: {bytes_read}, pages "
+              "written: {pages_written}".format(**dict(
+                {"files_read": None, "bytes_read": None,
+                 "pages_written": None}, **result)), file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def build_argparser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark looper table and report generation on "
+                    "synthetic projects")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000],
+                        help="Project sizes (number of samples)")
+    parser.add_argument("--commands", nargs="+", choices=COMMANDS,
+                        default=COMMANDS, help="Commands to measure")
+    parser.add_argument("--workdir",
+                        help="Directory for the generated projects; a "
+                             "temporary one is used and removed by default")
+    parser.add_argument("-o", "--output",
+                        help="JSON file to write the results to; stdout by "
+                             "default")
+    parser.add_argument("--measure", nargs=3,
+                        metavar=("COMMAND", "CONFIG", "METRICS"),
+                        help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = build_argparser().parse_args()
+    if args.measure:
+        return measure(*args.measure)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="looper_bench_")
+    try:
+        results = []
+        for n_samples in args.sizes:
+            size_dir = os.path.join(workdir, "n{}".format(n_samples))
+            os.makedirs(size_dir, exist_ok=True)
+            results.extend(bench_size(n_samples, args.commands, size_dir))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = {"benchmark": "report", "environment": environment(),
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
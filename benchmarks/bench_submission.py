@@ -0,0 +1,183 @@
+"""
+Submission throughput benchmark.
+
+Generates synthetic projects of increasing size and measures 'looper run -d',
+'looper run' with a stand-in scheduler and 'looper rerun'. Every measurement
+is a fresh looper process; wall time and peak RSS of that process are
+reported along with the sample throughput and looper's own phase timings.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_submission --sizes 1000 10000 -o results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .synthetic import HOOK_KINDS, make_project
+
+MODES = ["dry", "fake", "rerun"]
+RESULTS_SUBDIR = "results_pipeline"
+
+
+def run_looper(args, log_path=None):
+    """
+    Run looper in a subprocess and measure it.
+
+    :param list[str] args: looper command-line arguments
+    :param str log_path: path to a file to write looper output to
+    :return dict: return code, wall time in seconds and peak RSS in MiB
+    """
+    cmd = [sys.executable, "-m", "looper"] + args
+    with open(log_path or os.devnull, "w") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+    # the child was reaped by wait4, let Popen know
+    proc.returncode = os.WEXITSTATUS(status) \
+        if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+    return {"returncode": proc.returncode, "wall_s": round(wall, 3),
+            "max_rss_mb": round(rusage.ru_maxrss / scale, 1)}
+
+
+def write_flags(output_dir, n_samples, n_pifaces, flag, every=1):
+    """
+    Write run status flags, as pipelines would, for a subset of samples.
+
+    :param str output_dir: looper output directory
+    :param int n_samples: number of samples in the project
+    :param int n_pifaces: number of pipeline interfaces in the project
+    :param str flag: flag to write, e.g. 'failed'
+    :param int every: write the flags for every n-th sample
+    :return int: number of flagged samples
+    """
+    flagged = 0
+    for i in range(0, n_samples, every):
+        sample_dir = os.path.join(output_dir, RESULTS_SUBDIR,
+                                  "sample{}".format(i))
+        os.makedirs(sample_dir, exist_ok=True)
+        for p in range(n_pifaces):
+            open(os.path.join(sample_dir, "BENCH{}_{}.flag".format(p, flag)),
+                 "w").close()
+        flagged += 1
+    return flagged
+
+
+def bench_size(n_samples, modes, workdir, n_pifaces, subsamples, hooks):
+    """
+    Benchmark the selected modes for a single project size.
+
+    :param int n_samples: number of samples in the project
+    :param Iterable[str] modes: modes to measure, subset of MODES
+    :param str workdir: directory to generate the project in
+    :param int n_pifaces: number of pipeline interfaces
+    :param int subsamples: number of subsamples per sample
+    :param str hooks: kind of pre-submission hooks
+    :return list[dict]: one result per mode
+    """
+    paths = make_project(workdir, n_samples, n_pifaces=n_pifaces,
+                         subsamples=subsamples, hooks=hooks)
+    results = []
+    for mode in modes:
+        shutil.rmtree(paths["output_dir"], ignore_errors=True)
+        command = "rerun" if mode == "rerun" else "run"
+        args = [command, paths["config"], "--divvy", paths["divvy"]]
+        if mode == "dry":
+            args.append("-d")
+        if mode == "rerun":
+            # every other sample failed, so half of the jobs are resubmitted
+            write_flags(paths["output_dir"], n_samples, n_pifaces, "failed",
+                        every=2)
+        log_path = os.path.join(workdir, "{}_{}.log".format(mode, n_samples))
+        timings_path = os.path.join(workdir,
+                                    "{}_{}_timings.json".format(mode, n_samples))
+        result = run_looper(args + ["--timings", timings_path], log_path)
+        if os.path.isfile(timings_path):
+            with open(timings_path) as f:
+                result["phases"] = json.load(f)
+        result.update({"samples": n_samples, "pipelines": n_pifaces,
+                       "subsamples": subsamples, "hooks": hooks,
+                       "mode": mode})
+        result["samples_per_s"] = round(n_samples / result["wall_s"], 1) \
+            if result["wall_s"] else None
+        print("{mode:>5} n={samples:<7} {wall_s:>9.2f} s {max_rss_mb:>8.1f} "
+              "MiB {samples_per_s:>9} samples/s rc={returncode}".
+              format(**result), file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def environment():
+    """
+    Describe the benchmarking environment.
+
+    :return dict: looper version, Python version and platform
+    """
+    from looper import __version__
+    return {"looper_version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def build_argparser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark looper submission throughput on synthetic "
+                    "projects")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000],
+                        help="Project sizes (number of samples)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES,
+                        help="What to measure: 'dry' (run -d), 'fake' (run "
+                             "with a stand-in scheduler), 'rerun'")
+    parser.add_argument("--pipelines", type=int, default=3,
+                        help="Number of pipeline interfaces")
+    parser.add_argument("--subsamples", type=int, default=0,
+                        help="Number of subsamples per sample")
+    parser.add_argument("--hooks", choices=HOOK_KINDS, default="python",
+                        help="Kind of pre-submission hooks")
+    parser.add_argument("--workdir",
+                        help="Directory for the generated projects; a "
+                             "temporary one is used and removed by default")
+    parser.add_argument("-o", "--output",
+                        help="JSON file to write the results to; stdout by "
+                             "default")
+    return parser
+
+
+def main():
+    args = build_argparser().parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="looper_bench_")
+    try:
+        results = []
+        for n_samples in args.sizes:
+            size_dir = os.path.join(workdir, "n{}".format(n_samples))
+            os.makedirs(size_dir, exist_ok=True)
+            results.extend(bench_size(n_samples, args.modes, size_dir,
+                                      args.pipelines, args.subsamples,
+                                      args.hooks))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = {"benchmark": "submission", "environment": environment(),
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+""" Synthetic PEP projects for looper benchmarks """
+
+import csv
+import os
+import stat
+
+import yaml
+
+__all__ = ["HOOK_KINDS", "make_project", "make_results"]
+
+HOOK_KINDS = ["none", "python", "command", "server"]
+
+# sparse input files, spanning the rows of the resources TSV
+INPUT_SIZES = [2 ** 10, 2 ** 20, 50 * 2 ** 20, 2 ** 30, 3 * 2 ** 30]
+
+RESOURCES_TSV = """max_file_size\tcores\tmem\ttime
+0.001\t1\t8000\t00-04:00:00
+0.05\t2\t12000\t00-08:00:00
+0.5\t4\t16000\t00-12:00:00
+1\t8\t16000\t00-24:00:00
+10\t16\t32000\t02-00:00:00
+NaN\t32\t32000\t04-00:00:00
+"""
+
+SUBMISSION_TEMPLATE = """#!/bin/bash
+#SBATCH --job-name='{JOBNAME}'
+#SBATCH --output='{LOGFILE}'
+#SBATCH --mem='{MEM}'
+#SBATCH --cpus-per-task='{CORES}'
+#SBATCH --time='{TIME}'
+
+{CODE}
+"""
+
+# stand-in for a scheduler submission command; exits right away
+FAKE_SCHEDULER = """#!/bin/sh
+echo "Submitted batch job $$"
+"""
+
+COMMAND_HOOK = """#!/bin/sh
+echo '{"compute": {"partition": "standard"}}'
+"""
+
+SERVER_HOOK = """#!/bin/sh
+while read ns; do
+  echo '{"compute": {"partition": "standard"}}'
+done
+"""
+
+INPUT_SCHEMA = {
+    "description": "Synthetic benchmark input schema",
+    "properties": {
+        "samples": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "sample_name": {"type": "string"},
+                    "protocol": {"type": "string"},
+                    "read1": {"anyOf": [{"type": "string"},
+                                        {"type": "array",
+                                         "items": {"type": "string"}}]}
+                },
+                "files": ["read1"],
+                "required_files": ["read1"],
+                "required": ["sample_name", "read1"]
+            }
+        }
+    },
+    "required": ["samples"]
+}
+
+
+def make_project(root, n_samples, n_pifaces=3, subsamples=0, hooks="python"):
+    """
+    Write a synthetic PEP with looper pipeline interfaces to a directory.
+
+    Every sample is matched with every sample pipeline interface; there is
+    also a single project pipeline interface. The sample input files are
+    sparse, so they take no disk space but their sizes select different rows
+    of the pipeline resources TSV.
+
+    :param str root: directory to write the project to
+    :param int n_samples: number of samples in the sample table
+    :param int n_pifaces: number of sample pipeline interfaces
+    :param int subsamples: number of subsamples per sample, 0 for none
+    :param str hooks: kind of pre-submission hooks to use, one of HOOK_KINDS:
+        'python' (looper.write_sample_yaml plugin), 'command' (a shell
+        command per submission), 'server' (a persistent hook process)
+    :return dict[str, str]: paths to the project config ('config'), divvy
+        config ('divvy') and output directory ('output_dir')
+    """
+    if hooks not in HOOK_KINDS:
+        raise ValueError("Invalid hooks kind '{}'; choose from: {}".
+                         format(hooks, ", ".join(HOOK_KINDS)))
+    root = os.path.abspath(root)
+    inputs_dir = os.path.join(root, "inputs")
+    os.makedirs(inputs_dir, exist_ok=True)
+    inputs = []
+    for size in INPUT_SIZES:
+        path = os.path.join(inputs_dir, "input_{}.fastq.gz".format(size))
+        with open(path, "wb") as f:
+            f.truncate(size)
+        inputs.append(path)
+
+    with open(os.path.join(root, "sample_table.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["sample_name", "protocol", "genome", "read1"])
+        for i in range(n_samples):
+            writer.writerow(["sample{}".format(i), "PROTO{}".format(i % 4),
+                             "hg38" if i % 2 else "mm10",
+                             inputs[i % len(inputs)]])
+    cfg = {
+        "pep_version": "2.0.0",
+        "name": "bench{}".format(n_samples),
+        "sample_table": "sample_table.csv",
+        "looper": {"output_dir": os.path.join(root, "output"),
+                   "pipeline_interfaces": [
+                       os.path.join(root, "piface_project.yaml")]},
+        "sample_modifiers": {
+            "append": {"pipeline_interfaces": [
+                os.path.join(root, "piface{}.yaml".format(i))
+                for i in range(n_pifaces)]}
+        }
+    }
+    if subsamples:
+        with open(os.path.join(root, "subsample_table.csv"), "w",
+                  newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["sample_name", "subsample_name", "read1"])
+            for i in range(n_samples):
+                for j in range(subsamples):
+                    writer.writerow(["sample{}".format(i), str(j),
+                                     inputs[(i + j) % len(inputs)]])
+        cfg["subsample_table"] = "subsample_table.csv"
+    config_path = os.path.join(root, "project_config.yaml")
+    _write_yaml(config_path, cfg)
+
+    _write_yaml(os.path.join(root, "input_schema.yaml"), INPUT_SCHEMA)
+    _write(os.path.join(root, "resources.tsv"), RESOURCES_TSV)
+    _write(os.path.join(root, "command_hook.sh"), COMMAND_HOOK, True)
+    _write(os.path.join(root, "server_hook.sh"), SERVER_HOOK, True)
+    for i in range(n_pifaces):
+        piface = {
+            "pipeline_name": "BENCH{}".format(i),
+            "pipeline_type": "sample",
+            "input_schema": "input_schema.yaml",
+            "var_templates": {"path": "{looper.piface_dir}/pipeline.py"},
+            "compute": {"size_dependent_variables": "resources.tsv"},
+            "command_template": "{pipeline.var_templates.path} "
+                                "--sample-name {sample.sample_name} "
+                                "--genome {sample.genome} "
+                                "--input {sample.read1}"
+        }
+        if hooks == "python":
+            piface["pre_submit"] = {
+                "python_functions": ["looper.write_sample_yaml"]}
+        elif hooks == "command":
+            piface["pre_submit"] = {
+                "command_templates": ["{looper.piface_dir}/command_hook.sh"]}
+        elif hooks == "server":
+            piface["pre_submit"] = {
+                "server_command_template": "{looper.piface_dir}/server_hook.sh"}
+        _write_yaml(os.path.join(root, "piface{}.yaml".format(i)), piface)
+
+    _write_yaml(os.path.join(root, "piface_project.yaml"), {
+        "pipeline_name": "BENCH_PROJECT",
+        "pipeline_type": "project",
+        "var_templates": {"path": "{looper.piface_dir}/pipeline.py"},
+        "command_template": "{pipeline.var_templates.path} "
+                            "--project-name {project.name}"
+    })
+
+    scheduler_path = os.path.join(root, "fake_sbatch.sh")
+    _write(scheduler_path, FAKE_SCHEDULER, True)
+    _write(os.path.join(root, "fake_template.sub"), SUBMISSION_TEMPLATE)
+    divvy_path = os.path.join(root, "divvy_config.yaml")
+    _write_yaml(divvy_path, {
+        "adapters": {"CODE": "looper.command", "JOBNAME": "looper.job_name",
+                     "CORES": "compute.cores", "LOGFILE": "looper.log_file",
+                     "TIME": "compute.time", "MEM": "compute.mem"},
+        "compute_packages": {
+            "default": {"submission_template": "fake_template.sub",
+                        "submission_command": scheduler_path}}
+    })
+    return {"config": config_path, "divvy": divvy_path,
+            "output_dir": cfg["looper"]["output_dir"]}
+
+
+def make_results(results_dir, n_samples, pipeline="BENCH0", n_stats=25,
+                 n_objects=3, n_commands=12):
+    """
+    Write a pipeline results tree, as pypiper pipelines would, for every
+    sample of a synthetic project.
+
+    Each sample folder gets a stats.tsv, an objects.tsv with an image and a
+    PDF for each object, a profile, a log, a commands file and a status flag.
+    Every tenth sample is flagged as failed and every twentieth as running.
+
+    :param str results_dir: results folder of the project
+    :param int n_samples: number of samples in the project
+    :param str pipeline: name of the pipeline that produced the results
+    :param int n_stats: number of reported statistics per sample
+    :param int n_objects: number of reported objects per sample
+    :param int n_commands: number of profiled commands per sample
+    """
+    png = b"\x89PNG\r\n\x1a\n" + bytes(2048)
+    pdf = b"%PDF-1.4\n" + bytes(8192)
+    for i in range(n_samples):
+        sample_dir = os.path.join(results_dir, "sample{}".format(i))
+        os.makedirs(sample_dir, exist_ok=True)
+        stats = ["{}\t{}\t{}".format("stat{}".format(k), (i * 7 + k) % 1000,
+                                     pipeline) for k in range(n_stats)]
+        stats.append("Time\t{}:{:02d}:00\t{}".format(i % 24, i % 60, pipeline))
+        stats.append("Success\t01-01-12:00:00\t{}".format(pipeline))
+        _write(os.path.join(sample_dir, "stats.tsv"), "\n".join(stats) + "\n")
+        objects = []
+        for k in range(n_objects):
+            name = "object{}".format(k)
+            with open(os.path.join(sample_dir, name + ".pdf"), "wb") as f:
+                f.write(pdf)
+            with open(os.path.join(sample_dir, name + ".png"), "wb") as f:
+                f.write(png)
+            objects.append("\t".join([
+                "Object {}".format(k), name + ".pdf", "Object {}".format(k),
+                name + ".png", pipeline]))
+        _write(os.path.join(sample_dir, "objects.tsv"),
+               "\n".join(objects) + "\n")
+        profile = ["# Pipeline started at 01-01 12:00:00",
+                   "# pid\thash\tcid\truntime\tmem\tcmd\tlock"]
+        for k in range(n_commands):
+            profile.append("{}\t{:08x}\t{}\t0:{:02d}:{:02d}\t{:.4f}\tcmd{}\t"
+                           "lock.cmd{}".format(1000 + k, k, k + 1, k % 60,
+                                               i % 60, 0.5 + k / 10.0, k, k))
+        _write(os.path.join(sample_dir, pipeline + "_profile.tsv"),
+               "\n".join(profile) + "\n")
+        log = ["### Pipeline run code and environment:", "",
+               "* Pipeline started at:   (01-01 12:00:00) elapsed: 0.0 _TIME_",
+               ""]
+        log.extend("> `cmd{}` (pid {})".format(k, 1000 + k)
+                   for k in range(n_commands))
+        log.extend(["", "### Pipeline completed. Epilogue",
+                    "*        Elapsed time (all runs):  1:00:00",
+                    "*         Peak memory (this run):  1.7 GB"])
+        _write(os.path.join(sample_dir, pipeline + "_log.md"),
+               "\n".join(log) + "\n")
+        _write(os.path.join(sample_dir, pipeline + "_commands.sh"),
+               "\n".join("cmd{}".format(k) for k in range(n_commands)) + "\n")
+        flag = "failed" if i % 10 == 9 else \
+            "running" if i % 20 == 4 else "completed"
+        _write(os.path.join(sample_dir, "{}_{}.flag".format(pipeline, flag)),
+               "")
+
+
+def _write(path, content, executable=False):
+    with open(path, "w") as f:
+        f.write(content)
+    if executable:
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+
+def _write_yaml(path, data):
+    with open(path, "w") as f:
+        yaml.safe_dump(data, f, default_flow_style=False)
@@ -8,27 +8,61 @@ local level, but this will at least provide a foundation.
 """
 
 import argparse
+import importlib
 import os
 import logging
-from .conductor import SubmissionConductor
-from .pipeline_interface import PipelineInterface
-from .project import Project
+import sys
 from ._version import __version__
 from .parser_types import *
 from .const import *
-
-from .conductor import write_sample_yaml_cwl, write_sample_yaml, \
-    write_sample_yaml_prj, write_submission_yaml
+from .balance import BALANCE_POLICIES, package_weights
+from .jobplan import shard_spec
+from .profiling import PROFILE_MODES
 
 from ubiquerg import VersionInHelpParser
-from divvy import DEFAULT_COMPUTE_RESOURCES_NAME, NEW_COMPUTE_KEY as COMPUTE_KEY
-# Not used here, but make this the main import interface between peppy and
-# looper, so that other modules within this package need not worry about
-# the locations of some of the peppy declarations. Effectively, concentrate
-# the connection between peppy and looper here, to the extent possible.
 
 __all__ = ["Project", "PipelineInterface", "SubmissionConductor"]
 
+# The classes and plugins below pull in pandas, jinja2, eido, peppy and divvy,
+# which is most of looper's startup time. They are imported on first access,
+# so that the CLI parser (and e.g. 'looper --version') is available without
+# them. Maps the attribute name to its module and name in that module.
+_LAZY_ATTRS = {
+    "SubmissionConductor": (".conductor", "SubmissionConductor"),
+    "write_sample_yaml_cwl": (".conductor", "write_sample_yaml_cwl"),
+    "write_sample_yaml": (".conductor", "write_sample_yaml"),
+    "write_sample_yaml_prj": (".conductor", "write_sample_yaml_prj"),
+    "write_submission_yaml": (".conductor", "write_submission_yaml"),
+    "PipelineInterface": (".pipeline_interface", "PipelineInterface"),
+    "Project": (".project", "Project"),
+    "DEFAULT_COMPUTE_RESOURCES_NAME":
+        ("divvy", "DEFAULT_COMPUTE_RESOURCES_NAME"),
+}
+
+
+def __getattr__(name):
+    """
+    Import the lazily-loaded package attributes on first access.
+
+    :param str name: name of the attribute to get
+    :return object: requested attribute
+    :raise AttributeError: if the package has no such attribute
+    """
+    try:
+        module_name, attr = _LAZY_ATTRS[name]
+    except KeyError:
+        raise AttributeError("module '{}' has no attribute '{}'".
+                             format(__name__, name))
+    value = getattr(importlib.import_module(module_name, __name__), attr)
+    globals()[name] = value
+    return value
+
+
+if sys.version_info < (3, 7):
+    # Module-level __getattr__ (PEP 562) is not supported, import eagerly.
+    for _name in _LAZY_ATTRS:
+        globals()[_name] = __getattr__(_name)
+
 # Descending by severity for correspondence with logic inversion.
 # That is, greater verbosity setting corresponds to lower logging level.
 _LEVEL_BY_VERBOSITY = [logging.ERROR, logging.CRITICAL, logging.WARN,
@@ -95,11 +129,15 @@ def build_parser():
         msg_by_cmd = {
                 "run": "Run or submit sample jobs.",
                 "rerun": "Resubmit sample jobs with failed flags.",
+                "plan": "Prepare sample jobs and write a submission plan.",
+                "apply": "Submit the jobs of submission plans.",
                 "runp": "Run or submit project jobs.",
                 "table": "Write summary stats table for project samples.",
                 "report": "Create browsable HTML report of project results.",
                 "destroy": "Remove output files of the project.",
                 "check": "Check flag status of current runs.",
+                "status": "Show the status of sample jobs in the scheduler.",
+                "resources": "Show the resources predicted for sample jobs.",
                 "clean": "Run clean scripts of already processed jobs.",
                 "inspect": "Print information about a project.",
                 "init": "Initialize looper dotfile."
@@ -116,38 +154,74 @@ def build_parser():
         # Run and rerun command
         run_subparser = add_subparser("run")
         rerun_subparser = add_subparser("rerun")
+        plan_subparser = add_subparser("plan")
+        apply_subparser = add_subparser("apply")
         collate_subparser = add_subparser("runp")
         table_subparser = add_subparser("table")
         report_subparser = add_subparser("report")
         destroy_subparser = add_subparser("destroy")
         check_subparser = add_subparser("check")
+        status_subparser = add_subparser("status")
+        resources_subparser = add_subparser("resources")
         clean_subparser = add_subparser("clean")
         inspect_subparser = add_subparser("inspect")
         init_subparser = add_subparser("init")
 
         # Flag arguments
         ####################################################################
-        for subparser in [run_subparser, rerun_subparser, collate_subparser]:
+        for subparser in [run_subparser, rerun_subparser, plan_subparser,
+                          collate_subparser]:
             subparser.add_argument(
                     "-i", "--ignore-flags", default=False,
                     action=_StoreBoolActionType, type=html_checkbox(checked=False),
                     help="Ignore run status flags? Default=False")
 
         for subparser in [run_subparser, rerun_subparser, destroy_subparser,
-                          clean_subparser, collate_subparser]:
+                          clean_subparser, collate_subparser, apply_subparser]:
             subparser.add_argument(
                     "-d", "--dry-run",
                     action=_StoreBoolActionType, default=False,
                     type=html_checkbox(checked=False),
                     help="Don't actually submit the jobs.  Default=False")
 
+        for subparser in [run_subparser, rerun_subparser]:
+            subparser.add_argument(
+                    "--collate", action=_StoreBoolActionType, default=False,
+                    type=html_checkbox(checked=False),
+                    help="Submit the project pipelines too, to run once the "
+                         "submitted sample jobs finish. Default=False")
+
         # Parameter arguments
         ####################################################################
-        for subparser in [run_subparser, rerun_subparser, collate_subparser]:
+        for subparser in [run_subparser, rerun_subparser, collate_subparser,
+                          apply_subparser]:
             subparser.add_argument(
                     "-t", "--time-delay", metavar="S",
                     type=html_range(min_val=0, max_val=30, value=0), default=0,
                     help="Time delay in seconds between job submissions")
+            subparser.add_argument(
+                    "--submission-rate", metavar="R", type=float,
+                    help="Maximum job submission rate, in jobs per second. "
+                         "Default: compute package 'submission_rate', "
+                         "unlimited if not set")
+            subparser.add_argument(
+                    "--submission-burst", metavar="N", type=int,
+                    help="Number of jobs that can be submitted at once "
+                         "within the submission rate. Default: compute "
+                         "package 'submission_burst', or 1")
+            subparser.add_argument(
+                    "--max-concurrent-jobs", metavar="N", type=int,
+                    help="Maximum number of submitted jobs that are not "
+                         "finished yet. Default: compute package "
+                         "'max_concurrent_jobs', unlimited if not set")
+            subparser.add_argument(
+                    "--submission-retries", metavar="N", type=int,
+                    help="Number of retries of a job submission that failed "
+                         "transiently. Default: compute package "
+                         "'submission_retries', or 3")
+
+        for subparser in [run_subparser, rerun_subparser, plan_subparser,
+                          collate_subparser]:
             subparser.add_argument(
                     "-l", "--limit", default=None, metavar="N",
                     type=html_range(min_val=1, max_val="num_samples",
@@ -165,6 +239,8 @@ def build_parser():
                     type=html_checkbox(checked=False),
                     help="Do not perform input file checks")
 
+        for subparser in [run_subparser, rerun_subparser, plan_subparser,
+                          collate_subparser, status_subparser]:
             divvy_group = \
                 subparser.add_argument_group(
                     "divvy arguments",
@@ -183,8 +259,30 @@ def build_parser():
             divvy_group.add_argument(
                     "-c", "--compute", metavar="K", nargs="+",
                     help="List of key-value pairs (k1=v1)")
+            if subparser in [run_subparser, rerun_subparser,
+                             collate_subparser]:
+                divvy_group.add_argument(
+                        "--compute-packages", metavar="P[:W],...",
+                        type=package_weights,
+                        help="Spread the jobs across these compute packages, "
+                             "in proportion to their weights (1 by default)")
+                divvy_group.add_argument(
+                        "--compute-policy", choices=BALANCE_POLICIES,
+                        default=BALANCE_POLICIES[0],
+                        help="How jobs are spread across the compute "
+                             "packages: in proportion to the weights, or to "
+                             "the package with the most free queue slots. "
+                             "Default=%(default)s")
 
-        for subparser in [run_subparser, rerun_subparser]:
+        for subparser in [run_subparser, rerun_subparser, plan_subparser,
+                          apply_subparser, collate_subparser, table_subparser,
+                          report_subparser]:
+            subparser.add_argument(
+                    "--timings", metavar="FILE",
+                    help="Path to a JSON file to write execution phase "
+                         "timings to")
+
+        for subparser in [run_subparser, rerun_subparser, plan_subparser]:
             subparser.add_argument(
                     "-u", "--lump", default=None, metavar="X",
                     type=html_range(min_val=0, max_val=100, step=0.1, value=0),
@@ -194,6 +292,25 @@ def build_parser():
                     type=html_range(min_val=1, max_val="num_samples", value=1),
                     help="Number of commands to batch into one job")
 
+        plan_subparser.add_argument(
+            "--rerun", action=_StoreBoolActionType, default=False,
+            type=html_checkbox(checked=False),
+            help="Plan the resubmission of sample jobs with failed flags. "
+                 "Default=False")
+        plan_subparser.add_argument(
+            "--plan-file", metavar="FILE",
+            help="Path to the plan file to write. Default: looper_plan.jsonl "
+                 "in the submission folder")
+        plan_subparser.add_argument(
+            "--shard", metavar="K/N", type=shard_spec,
+            help="Plan only the K-th of N shards of the samples, so that "
+                 "the planning can be split across processes")
+        # Scripts are written, but nothing is submitted
+        plan_subparser.set_defaults(dry_run=False, time_delay=0)
+        apply_subparser.add_argument(
+            "plan_files", nargs="+", metavar="PLAN",
+            help="Plan files written by 'looper plan'")
+
         inspect_subparser.add_argument(
             "-n", "--snames", required=False, nargs="+", metavar="S",
             help="Name of the samples to inspect")
@@ -218,6 +335,12 @@ def build_parser():
                     help="Provide upfront confirmation of destruction intent, "
                          "to skip console query.  Default=False")
 
+        resources_subparser.add_argument(
+                "--explain", action=_StoreBoolActionType, default=False,
+                type=html_checkbox(checked=False),
+                help="Show the fitted resource models and the runs they are "
+                     "fitted on, too. Default=False")
+
         init_subparser.add_argument("config_file", help="Project configuration "
                                                         "file (YAML)")
 
@@ -225,9 +348,11 @@ def build_parser():
             action="store_true", default=False)
 
         # Common arguments
-        for subparser in [run_subparser, rerun_subparser, table_subparser,
-                          report_subparser, destroy_subparser, check_subparser,
-                          clean_subparser, collate_subparser, inspect_subparser]:
+        for subparser in [run_subparser, rerun_subparser, plan_subparser,
+                          table_subparser, report_subparser, destroy_subparser,
+                          check_subparser, status_subparser, clean_subparser,
+                          collate_subparser, inspect_subparser,
+                          resources_subparser]:
             subparser.add_argument("config_file", nargs="?", default=None,
                                    help="Project configuration file (YAML)")
             # help="Path to the output directory"
@@ -246,10 +371,27 @@ def build_parser():
             subparser.add_argument("--pipeline-interfaces", metavar="P",
                                    nargs="+", action="append",
                                    help=argparse.SUPPRESS)
+            subparser.add_argument("--trace", metavar="FILE",
+                                   help="Path to a Chrome trace-event JSON "
+                                        "file to record execution spans to")
+            subparser.add_argument("--profile", nargs="?", const="cpu",
+                                   choices=PROFILE_MODES,
+                                   help="Profile the command: 'cpu' (default)"
+                                        " with cProfile or 'mem' with "
+                                        "tracemalloc. Results are written to "
+                                        "the current directory")
+            subparser.add_argument("--project-cache", metavar="DIR",
+                                   help="Directory for project snapshots. "
+                                        "The processed project is loaded "
+                                        "from a snapshot unless its config, "
+                                        "sample tables or pipeline "
+                                        "interfaces changed")
 
-        for subparser in [run_subparser, rerun_subparser, table_subparser,
-                          report_subparser, destroy_subparser, check_subparser,
-                          clean_subparser, collate_subparser, inspect_subparser]:
+        for subparser in [run_subparser, rerun_subparser, plan_subparser,
+                          table_subparser, report_subparser, destroy_subparser,
+                          check_subparser, status_subparser, clean_subparser,
+                          collate_subparser, inspect_subparser,
+                          resources_subparser]:
             fetch_samples_group = \
                 subparser.add_argument_group(
                     "sample selection arguments",
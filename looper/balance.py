@@ -0,0 +1,275 @@
+""" Load balancing of the job submissions across compute packages """
+
+import argparse
+import logging
+import time
+from collections import OrderedDict, defaultdict
+
+from .const import *
+from .journal import wait_for_jobs
+from .throttle import SubmissionThrottle, throttle_settings
+
+__all__ = ["PackageBalancer", "package_weights", "BALANCE_POLICIES"]
+
+_LOGGER = logging.getLogger(__name__)
+
+# 'weighted': jobs are shared out in proportion to the package weights,
+# skipping the packages whose queue is full; 'capacity': every job goes to
+# the package with the most free queue slots
+BALANCE_POLICIES = ["weighted", "capacity"]
+# divvy's DEFAULT_COMPUTE_RESOURCES_NAME; divvy is not imported, as the
+# specification parser is used by the CLI parser
+DEFAULT_COMPUTE_PACKAGE = "default"
+
+
+class _Package(object):
+    """ A compute package jobs are spread across, and its tallies """
+    def __init__(self, name, weight, throttle):
+        """
+        :param str name: name of the compute package
+        :param float weight: share of the jobs, relative to the other
+            packages
+        :param looper.throttle.SubmissionThrottle throttle: throttle and
+            retry policy of the package submissions
+        """
+        self.name = name
+        self.weight = weight
+        self.throttle = throttle
+        self.assigned = 0
+        self.submitted = 0
+        self.first = None
+        self.last = None
+
+    def depth(self):
+        """
+        :return int | NoneType: number of jobs in the package queue, None if
+            it's not monitored or couldn't be determined
+        """
+        monitor = self.throttle.monitor
+        return None if monitor is None else monitor.depth()
+
+    def free(self):
+        """
+        :return int: number of free slots in the package queue, below the
+            high-water mark; all of them if the depth is unknown
+        """
+        depth = self.depth()
+        high = self.throttle.monitor.high
+        return high if depth is None else high - depth
+
+    def full(self):
+        """
+        :return bool: whether the package queue is at the high-water mark
+        """
+        depth = self.depth()
+        return depth is not None and depth >= self.throttle.monitor.high
+
+    def summary(self):
+        """
+        :return str: tallies of the package jobs and the submission rate
+        """
+        rate = ""
+        if self.submitted > 1 and self.last > self.first:
+            rate = "; {:.2f} jobs/s".format(
+                (self.submitted - 1) / (self.last - self.first))
+        depth = self.depth() if self.submitted else None
+        return "Compute package '{}' (weight {:g}): {} jobs assigned, {} " \
+               "submitted{}{}".format(
+                    self.name, self.weight, self.assigned, self.submitted,
+                    rate, "" if depth is None
+                    else "; queue depth {}".format(depth))
+
+
+class PackageBalancer(object):
+    """
+    Spreads the jobs of a looper invocation across several compute packages.
+
+    Every job is written with the submission template, and submitted with
+    the submission command, of the package it's assigned to. Each package
+    has its own throttle, from the throttle settings of the package, so the
+    queue depth and in-flight jobs are tracked per package. A job that
+    depends on other jobs goes to the package most of them were submitted
+    to; the jobs it depends on in other packages, unknown to its scheduler,
+    are waited for before it's submitted.
+    """
+    def __init__(self, dcc, weights, policy=None, overrides=None):
+        """
+        :param divvy.ComputingConfiguration dcc: compute configuration with
+            the packages; its active package is switched as the jobs are
+            assigned
+        :param Iterable[(str, float)] weights: names and weights of the
+            packages to spread the jobs across
+        :param str policy: how the jobs are assigned, one of
+            BALANCE_POLICIES; 'weighted' by default
+        :param Mapping overrides: throttle settings overriding the ones of
+            every package, e.g. from the command line
+        :raise ValueError: if a package is unknown, the policy or a throttle
+            setting is invalid, or a package has no queue monitoring with the
+            capacity policy
+        """
+        self.dcc = dcc
+        self.policy = policy or BALANCE_POLICIES[0]
+        if self.policy not in BALANCE_POLICIES:
+            raise ValueError("Unknown compute package balancing policy: '{}'; "
+                             "use one of: {}".format(
+                                 self.policy, ", ".join(BALANCE_POLICIES)))
+        self.packages = OrderedDict()
+        for name, weight in weights:
+            if name not in (dcc.compute_packages or {}):
+                raise ValueError("Unknown compute package: '{}'".format(name))
+            settings = throttle_settings(dcc.compute_packages[name])
+            settings.update(overrides or {})
+            throttle = SubmissionThrottle.from_settings(settings)
+            if self.policy == "capacity" and throttle.monitor is None:
+                raise ValueError(
+                    "The capacity policy requires '{}' and '{}' in compute "
+                    "package '{}'".format(QUEUE_COMMAND_KEY, QUEUE_HIGH_KEY,
+                                          name))
+            self.packages[name] = _Package(name, float(weight), throttle)
+        self.active = None
+        # package of every submitted job
+        self._job_packages = {}
+
+    @property
+    def throttles(self):
+        """
+        :return list[looper.throttle.SubmissionThrottle]: throttles of the
+            packages
+        """
+        return [p.throttle for p in self.packages.values()]
+
+    def choose(self, after=None):
+        """
+        Assign the next job to a package.
+
+        :param Iterable[(str, callable)] after: jobs the job depends on
+        :return str: name of the package
+        """
+        package = self._affinity(after) or self._pick()
+        package.assigned += 1
+        return package.name
+
+    def activate(self, name):
+        """
+        Make a package the active one of the compute configuration, on top
+        of the default package, as the package selected for a run is.
+
+        :param str name: name of the package
+        :return looper.throttle.SubmissionThrottle: throttle of the package
+        """
+        if name != self.active:
+            self.dcc.reset_active_settings()
+            self.dcc.activate_package(DEFAULT_COMPUTE_PACKAGE)
+            if name != DEFAULT_COMPUTE_PACKAGE:
+                self.dcc.activate_package(name)
+            self.active = name
+        return self.packages[name].throttle
+
+    def record(self, job, name):
+        """
+        Account for a job submitted to a package.
+
+        :param (str, callable) job: scheduler ID and finished check of the
+            job
+        :param str name: name of the package
+        """
+        package = self.packages[name]
+        package.submitted += 1
+        package.last = time.monotonic()
+        if package.first is None:
+            package.first = package.last
+        self._job_packages[job] = name
+
+    def local_jobs(self, jobs, name):
+        """
+        Wait for the jobs submitted to the other packages, whose IDs the
+        scheduler of a package doesn't know, polling their state with the
+        settings of their packages.
+
+        :param Iterable[(str, callable)] jobs: jobs a job depends on
+        :param str name: name of the package of the job
+        :return list[(str, callable)] | NoneType: the jobs submitted to the
+            package, or not by this balancer; None if the jobs submitted to
+            another package were given up on
+        """
+        local, elsewhere = [], defaultdict(list)
+        for job in jobs:
+            package = self._job_packages.get(job, name)
+            if package == name:
+                local.append(job)
+            else:
+                elsewhere[package].append(job)
+        for package, pkg_jobs in elsewhere.items():
+            settings = self.dcc.compute_packages[package]
+            _LOGGER.info("Waiting for {} jobs submitted to compute package "
+                         "'{}' to finish".format(len(pkg_jobs), package))
+            if wait_for_jobs(pkg_jobs, settings.get(JOB_STATUS_COMMAND_KEY),
+                             settings.get(DEPENDENCY_POLL_KEY),
+                             settings.get(MAX_JOB_WAIT_KEY)):
+                return None
+        return local
+
+    def summary(self):
+        """
+        :return list[str]: tallies of the jobs of every package, and of the
+            retried and failed submissions
+        """
+        lines = []
+        for package in self.packages.values():
+            lines.append(package.summary())
+            if package.throttle.retry.summary():
+                lines.append("  " + package.throttle.retry.summary())
+        return lines
+
+    def _affinity(self, after):
+        """
+        :param Iterable[(str, callable)] after: jobs a job depends on
+        :return _Package | NoneType: package most of the jobs were submitted
+            to, None if none of them was submitted by this balancer
+        """
+        counts = OrderedDict()
+        for job in after or []:
+            name = self._job_packages.get(job)
+            if name is not None:
+                counts[name] = counts.get(name, 0) + 1
+        if not counts:
+            return None
+        return self.packages[max(counts, key=counts.get)]
+
+    def _pick(self):
+        """
+        :return _Package: package to assign a job to, according to the
+            policy
+        """
+        packages = list(self.packages.values())
+        if self.policy == "capacity":
+            return max(packages, key=lambda p: p.free())
+        # the package furthest below its share of the jobs, among the ones
+        # whose queue isn't full
+        available = [p for p in packages if p.throttle.monitor is None or
+                     not p.full()] or packages
+        return min(available, key=lambda p: (p.assigned + 1) / p.weight)
+
+
+def package_weights(x):
+    """
+    Parse a compute package balancing specification, 'NAME[:WEIGHT],...'.
+
+    :param str x: comma-separated package names, each with an optional
+        weight, 1 by default, e.g. 'cluster_a:3,cluster_b:1,local'
+    :return list[(str, float)]: names and weights of the packages
+    :raise argparse.ArgumentTypeError: if the specification is invalid
+    """
+    weights = OrderedDict()
+    for item in x.split(","):
+        name, _, weight = item.strip().partition(":")
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            weight = 0
+        if not name or weight <= 0 or name in weights:
+            raise argparse.ArgumentTypeError(
+                "Invalid compute packages '{}'; use NAME[:WEIGHT],..., with "
+                "distinct names and positive weights".format(x))
+        weights[name] = weight
+    return list(weights.items())
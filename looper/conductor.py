@@ -6,9 +6,10 @@ import subprocess
 import time
 import importlib
 
+from functools import partial
 from jinja2.exceptions import UndefinedError
-from subprocess import check_output, CalledProcessError
-from json import loads
+from subprocess import check_output, CalledProcessError, Popen, PIPE
+from json import loads, dumps
 from yaml import dump
 
 from attmap import AttMap
@@ -18,12 +19,21 @@ from ubiquerg import expandpath
 from peppy.const import CONFIG_KEY, SAMPLE_YAML_EXT, SAMPLE_NAME_ATTR
 
 from .processed_project import populate_sample_paths
+from .resources import fit_resource_model
 from .const import *
-from .exceptions import JobSubmissionException
+from .exceptions import JobSubmissionException, MisconfigurationException
+from .journal import DEFAULT_JOB_ID_PATTERN, SubmissionJournal, \
+    dependency_option, parse_job_id, wait_for_jobs
+from .sample_columns import MISSING
+from .samples_table import write_samples_table
+from .timings import timed
 from .utils import fetch_sample_flags, jinja_render_template_strictly
 
 _LOGGER = logging.getLogger(__name__)
 
+# Flags of the jobs that are done, whether successfully or not
+_FINISHED_FLAGS = ["completed", "failed"]
+
 
 def _get_yaml_path(namespaces, template_key, default_name_appendix="",
                    filename=None):
@@ -200,7 +210,8 @@ class SubmissionConductor(object):
     def __init__(self, pipeline_interface, prj, delay=0, extra_args=None,
                  extra_args_override=None, ignore_flags=False,
                  compute_variables=None, max_cmds=None, max_size=None,
-                 automatic=True, collate=False):
+                 automatic=True, collate=False, job_plan=None, throttle=None,
+                 dependencies=None, upstream=None, balancer=None):
         """
         Create a job submission manager.
 
@@ -236,6 +247,22 @@ class SubmissionConductor(object):
             the pool reaches capacity.
         :param bool collate: Whether a collate job is to be submitted (runs on
             the project level, rather that on the sample level)
+        :param looper.jobplan.JobPlan job_plan: plan to add the jobs to
+            instead of submitting them
+        :param looper.throttle.SubmissionThrottle throttle: rate limit and
+            queue backpressure to wait on before each job submission; may be
+            shared with other conductors
+        :param Iterable[(str, callable)] dependencies: jobs that the
+            submitted jobs depend on, e.g. the sample jobs of a collate job:
+            the scheduler ID of each, None if not known, and a check of
+            whether it's finished
+        :param Iterable[SubmissionConductor] upstream: conductors of the
+            pipelines this one depends on; a job depends on their jobs of
+            the same samples
+        :param looper.balance.PackageBalancer balancer: balancer spreading
+            the jobs across compute packages; every job is then written and
+            submitted with the package it's assigned to, and throttled with
+            the throttle of the package instead of the given one
         """
         super(SubmissionConductor, self).__init__()
         self.collate = collate
@@ -252,12 +279,50 @@ class SubmissionConductor(object):
         self.ignore_flags = ignore_flags
 
         self.dry_run = self.prj.dry_run
+        self.job_plan = job_plan
+        # rendered commands and resources of the last written script
+        self._job_command = None
+        self._job_resources = None
         self.delay = float(delay)
+        self.throttle = throttle
+        self.balancer = balancer
+        # compute package of the current job, with a balancer
+        self._package = None
+        throttles = [throttle] if throttle is not None else []
+        if balancer is not None:
+            throttles = balancer.throttles
+        for t in throttles:
+            t.cap.set_limit(
+                self.pl_name,
+                self.pl_iface.get(COMPUTE_KEY, {}).get(MAX_JOBS_KEY))
         self._num_good_job_submissions = 0
         self._num_total_job_submissions = 0
         self._num_cmds_submitted = 0
         self._curr_size = 0
         self._failed_sample_names = []
+        # model predicting the resources of the sample jobs, fitted on the
+        # first use
+        self._resource_model = None
+        self._resource_model_fitted = False
+        # transiently failed submissions: command, script and samples
+        self._requeued = []
+        # jobs that wait for the jobs they depend on, submitted after the
+        # others: command, script and samples
+        self._deferred = []
+        # names of the samples of the deferred jobs
+        self._deferred_names = set()
+        self.dependencies = list(dependencies or [])
+        self.upstream = list(upstream or [])
+        # shard jobs of a sample, followed by a gather job; for a project
+        # pipeline, partial jobs of sample chunks followed by a merge job
+        self._scatter = self.pl_iface.get(
+            REDUCE_KEY if self.collate else SCATTER_KEY)
+        self._final_key = MERGE_CMD_KEY if self.collate else GATHER_CMD_KEY
+        # scheduler ID and finished check of every submitted job, and of the
+        # latest job of every sample
+        self._submitted_jobs = []
+        self._sample_jobs = {}
+        self._pre_submit_server = None
 
         if self.extra_pipe_args:
             _LOGGER.debug("String appended to every pipeline command: "
@@ -275,6 +340,9 @@ class SubmissionConductor(object):
             else:
                 self.max_cmds = max_cmds
             self.max_size = max_size or float("inf")
+            if self._scatter:
+                # the jobs of a scattered sample aren't lumped with others
+                self.max_cmds, self.max_size = 1, float("inf")
 
             self._pool = []
             self._reset_curr_skips()
@@ -284,6 +352,17 @@ class SubmissionConductor(object):
     def failed_samples(self):
         return self._failed_sample_names
 
+    @property
+    def submitted_jobs(self):
+        """
+        Return the jobs that this conductor has submitted.
+
+        :return list[(str, callable)]: scheduler ID of each job, None if
+            not known, and a check of whether the job is finished, according
+            to the flags of its samples
+        """
+        return self._submitted_jobs
+
     @property
     def num_cmd_submissions(self):
         """
@@ -302,7 +381,7 @@ class SubmissionConductor(object):
         """
         return self._num_good_job_submissions
 
-    def add_sample(self, sample, rerun=False):
+    def add_sample(self, sample, rerun=False, eligible=None):
         """
         Add a sample for submission to this conductor.
 
@@ -310,6 +389,10 @@ class SubmissionConductor(object):
             currently growing collection of command submissions
         :param bool rerun: whether the given sample is being rerun rather than
             run for the first time
+        :param bool eligible: whether the sample is eligible for submission,
+            as determined beforehand for all the samples (see
+            looper.eligibility.plan_submission); if not provided, the flags
+            and the toggle attribute of the sample are checked
         :return bool: Indication of whether the given sample was added to
             the current 'pool.'
         :raise TypeError: If sample subtype is provided but does not extend
@@ -317,33 +400,10 @@ class SubmissionConductor(object):
         """
         _LOGGER.debug("Adding {} to conductor for {} to {}run".format(
             sample.sample_name, self.pl_name, "re" if rerun else ""))
-        flag_files = fetch_sample_flags(self.prj, sample, self.pl_name)
-        use_this_sample = not rerun
-
-        if flag_files or rerun:
-            if not self.ignore_flags:
-                use_this_sample = False
-            # But rescue the sample in case rerun/failed passes
-            failed_flag = any("failed" in x for x in flag_files)
-            if rerun:
-                if failed_flag:
-                    _LOGGER.info("> Re-running failed sample")
-                    use_this_sample = True
-                else:
-                    use_this_sample = False
-            if not use_this_sample:
-                msg = "> Skipping sample because no failed flag found"
-                if flag_files:
-                    msg += ". Flags found: {}".format(flag_files)
-                _LOGGER.info(msg)
-
-        if self.prj.toggle_key in sample \
-                and int(sample[self.prj.toggle_key]) == 0:
-            _LOGGER.warning(
-                "> Skipping sample ({}: {})".
-                    format(self.prj.toggle_key, sample[self.prj.toggle_key])
-            )
-            use_this_sample = False
+        if eligible is None:
+            use_this_sample = self._check_eligibility(sample, rerun)
+        else:
+            use_this_sample = eligible
 
         skip_reasons = []
         validation = {}
@@ -352,7 +412,9 @@ class SubmissionConductor(object):
         _LOGGER.debug("Determining missing requirements")
         schema_source = self.pl_iface.get_pipeline_schemas()
         if schema_source and self.prj.file_checks:
-            validation = validate_inputs(sample, read_schema(schema_source))
+            with timed("validate_inputs", sample=sample.sample_name,
+                       pipeline=self.pl_name):
+                validation = validate_inputs(sample, read_schema(schema_source))
             if validation[MISSING_KEY]:
                 missing_reqs_msg = f"Missing files: {validation[MISSING_KEY]}"
                 _LOGGER.warning(NOT_SUB_MSG.format(missing_reqs_msg))
@@ -373,6 +435,45 @@ class SubmissionConductor(object):
 
         return skip_reasons
 
+    def _check_eligibility(self, sample, rerun=False):
+        """
+        Check the flags and the toggle attribute of a sample.
+
+        :param peppy.Sample sample: sample to check
+        :param bool rerun: whether the given sample is being rerun rather than
+            run for the first time
+        :return bool: whether the sample is eligible for submission
+        """
+        with timed("flags", sample=sample.sample_name,
+                   pipeline=self.pl_name):
+            flag_files = fetch_sample_flags(self.prj, sample, self.pl_name)
+        use_this_sample = not rerun
+
+        if flag_files or rerun:
+            if not self.ignore_flags:
+                use_this_sample = False
+            # But rescue the sample in case rerun/failed passes
+            failed_flag = any("failed" in x for x in flag_files)
+            if rerun:
+                if failed_flag:
+                    _LOGGER.info("> Re-running failed sample")
+                    use_this_sample = True
+                else:
+                    use_this_sample = False
+            if not use_this_sample:
+                msg = "> Skipping sample because no failed flag found"
+                if flag_files:
+                    msg += ". Flags found: {}".format(flag_files)
+                _LOGGER.info(msg)
+
+        toggle = self.prj.sample_columns.value(sample, self.prj.toggle_key)
+        if toggle is not MISSING and int(toggle) == 0:
+            _LOGGER.warning(
+                "> Skipping sample ({}: {})".format(self.prj.toggle_key, toggle)
+            )
+            use_this_sample = False
+        return use_this_sample
+
     def submit(self, force=False):
         """
         Submit one or more commands as a job.
@@ -399,30 +500,37 @@ class SubmissionConductor(object):
                     for schema in schemas:
                         populate_sample_paths(s, read_schema(schema))
 
-            script = self.write_script(self._pool, self._curr_size)
-            # Determine whether to actually do the submission.
-            _LOGGER.info("Job script (n={0}; {1:.2f}Gb): {2}".
-                         format(len(self._pool), self._curr_size, script))
-            if self.dry_run:
-                _LOGGER.info("Dry run, not submitted")
-            elif self._rendered_ok:
-                sub_cmd = self.prj.dcc.compute.submission_command
-                submission_command = "{} {}".format(sub_cmd, script)
+            if self.balancer is not None:
+                self._activate_package(self.balancer.choose(
+                    self.dependencies + self._upstream_jobs(self._pool)))
+            if self._scatter:
+                rendered = self._submit_scattered()
+            else:
+                script = self.write_script(self._pool, self._curr_size)
+                rendered = self._rendered_ok
                 # Capture submission command return value so that we can
                 # intercept and report basic submission failures; #167
                 try:
-                    subprocess.check_call(submission_command, shell=True)
-                except subprocess.CalledProcessError:
-                    fails = "" if self.collate \
-                        else [s.sample_name for s in self._samples]
-                    self._failed_sample_names.extend(fails)
+                    self._dispatch(script, self._pool)
+                except JobSubmissionException:
+                    raise self._submission_failure(script)
+                except subprocess.CalledProcessError as e:
+                    if not getattr(e, "transient", False):
+                        raise self._submission_failure(script)
+                    # The retries are exhausted, but the scheduler may
+                    # recover by the end of the run; see submit_requeued
+                    _LOGGER.warning("Job submission re-queued: {}".
+                                    format(script))
+                    self._requeued.append(
+                        (self.prj.dcc.compute.submission_command, script,
+                         list(self._pool), self._package))
+                    self.throttle.retry.requeued += 1
                     self._reset_pool()
-                    raise JobSubmissionException(sub_cmd, script)
-                time.sleep(self.delay)
+                    return False
 
             # Update the job and command submission tallies.
             _LOGGER.debug("SUBMITTED")
-            if self._rendered_ok:
+            if rendered:
                 submitted = True
                 self._num_cmds_submitted += len(self._pool)
             self._reset_pool()
@@ -434,6 +542,305 @@ class SubmissionConductor(object):
 
         return submitted
 
+    def _dispatch(self, script, pool, after=None, folder=None):
+        """
+        Submit a job script, unless the job is planned or it's a dry run.
+
+        :param str script: path to the job script
+        :param Iterable[peppy.Sample] pool: samples of the job
+        :param Iterable[(str, callable)] after: jobs this one depends on, in
+            addition to the dependencies of the conductor
+        :param str folder: folder of the flags of the job, if not the folders
+            of its samples, e.g. that of a shard
+        :return (str, callable) | NoneType: scheduler ID and finished check
+            of the submitted job; None if it wasn't submitted
+        :raise subprocess.CalledProcessError: if the submission fails
+        """
+        _LOGGER.info("Job script (n={0}; {1:.2f}Gb): {2}".
+                     format(len(pool), self._curr_size, script))
+        if self.job_plan is not None:
+            if self._rendered_ok:
+                self.job_plan.add(
+                    pipeline=self.pl_name,
+                    samples=[] if self.collate
+                    else [s.sample_name for s in pool],
+                    script=script,
+                    submission_command=self.prj.dcc.compute.submission_command,
+                    resources=self._job_resources,
+                    command=self._job_command)
+        elif self.dry_run:
+            _LOGGER.info("Dry run, not submitted")
+        elif self._rendered_ok:
+            jobs = self._job_dependencies(pool, after)
+            if self._defer(pool, jobs):
+                _LOGGER.info("Deferred until the other jobs are submitted")
+                self._deferred.append(
+                    (self.prj.dcc.compute.submission_command, script,
+                     list(pool), self._package))
+                self._deferred_names.update(s.sample_name for s in pool)
+                return None
+            job = self._submit_script(self.prj.dcc.compute.submission_command,
+                                      script, pool, jobs, folder)
+            with timed("sleep"):
+                time.sleep(self.delay)
+            return job
+        return None
+
+    def _submission_failure(self, script):
+        """
+        Record the failed submission of the pooled samples.
+
+        :param str script: path to the job script
+        :return JobSubmissionException: exception to raise
+        """
+        fails = "" if self.collate \
+            else [s.sample_name for s in self._samples]
+        self._failed_sample_names.extend(fails)
+        if self.throttle is not None:
+            self.throttle.retry.failed += 1
+        self._reset_pool()
+        return JobSubmissionException(self.prj.dcc.compute.submission_command,
+                                      script)
+
+    def _submit_scattered(self):
+        """
+        Submit the pooled sample as shard jobs, followed by a gather job
+        that depends on all of them; or, for a project pipeline, the partial
+        jobs of the sample chunks, followed by a merge job.
+
+        Nothing is submitted unless the scripts of all the jobs are
+        rendered. A shard job whose submission fails is not re-queued, as
+        the gather job would have to wait for it. Each shard job has its own
+        output folder, whose flags tell whether it's finished.
+
+        :return bool: whether the job scripts were rendered
+        :raise JobSubmissionException: if a submission fails
+        :raise MisconfigurationException: if sample jobs are to be scattered
+            with no dependency template in the compute package
+        """
+        shards = self._shards(self._pool[0])
+        if not shards:
+            _LOGGER.warning(NOT_SUB_MSG.format("no shards"))
+            return False
+        scripts = []
+        for index in range(len(shards)):
+            scripts.append(self.write_script(
+                self._pool, self._curr_size, shards=shards, shard=index))
+            if not self._rendered_ok:
+                return False
+        gather = None
+        if self._scatter.get(self._final_key):
+            gather = self.write_script(self._pool, self._curr_size,
+                                       shards=shards)
+            if not self._rendered_ok:
+                return False
+        # the compute settings are those of the rendered scripts
+        if not self.collate and self.job_plan is None and \
+                not self.dry_run and \
+                not self.prj.dcc.compute.get(DEPENDENCY_TEMPLATE_KEY):
+            raise MisconfigurationException(
+                "Pipeline '{}' is scattered, but the compute package has no "
+                "'{}' to make the jobs depend on the shard jobs".
+                format(self.pl_name, DEPENDENCY_TEMPLATE_KEY))
+        shard_jobs = []
+        for index, script in enumerate(scripts):
+            folder = None if self.collate \
+                else self._shard_folder(self._pool, index)
+            try:
+                job = self._dispatch(script, self._pool, folder=folder)
+            except (subprocess.CalledProcessError, JobSubmissionException):
+                raise self._submission_failure(script)
+            if job is not None:
+                shard_jobs.append(job)
+        if gather:
+            try:
+                self._dispatch(gather, self._pool, after=shard_jobs)
+            except (subprocess.CalledProcessError, JobSubmissionException):
+                raise self._submission_failure(gather)
+        elif shard_jobs and not self.collate:
+            # the dependent pipelines wait for all the shards
+            for sample in self._pool:
+                self._sample_jobs[sample.sample_name] = shard_jobs
+        return True
+
+    def _shards(self, sample):
+        """
+        Split the work of a sample into shards.
+
+        :param peppy.Sample sample: sample to split the work of; none for a
+            project pipeline, whose samples are split into chunks
+        :return list: chunks of the work, from the sample attribute listing
+            them, or shard indices; for a project pipeline, lists of samples
+        """
+        if self.collate:
+            return _sample_chunks(self.prj.samples,
+                                  self._scatter.get(REDUCE_CHUNKS_KEY),
+                                  self._scatter.get(REDUCE_CHUNK_SIZE_KEY))
+        attr = self._scatter.get(SCATTER_ATTR_KEY)
+        if not attr:
+            return list(range(int(self._scatter.get(SCATTER_SHARDS_KEY, 1))))
+        chunks = sample[attr] if attr in sample else None
+        if isinstance(chunks, str):
+            chunks = [c.strip() for c in chunks.split(",")]
+        return [c for c in chunks or [] if c not in ("", None)]
+
+    def submit_deferred(self):
+        """
+        Submit the jobs deferred until the others were submitted.
+
+        With no dependency template in the compute package, a job that
+        depends on other jobs is submitted once they finish. The waits are
+        left for the end of the run, so that the jobs of the other samples
+        aren't held up one sample at a time.
+
+        :return int: number of jobs submitted
+        """
+        deferred, self._deferred = self._deferred, []
+        submitted = 0
+        for sub_cmd, script, pool, package in deferred:
+            _LOGGER.info("Submitting deferred job: {}".format(script))
+            if package is not None:
+                self._activate_package(package)
+            try:
+                # the upstream jobs deferred too are submitted by now
+                self._submit_script(sub_cmd, script, pool)
+            except (subprocess.CalledProcessError, JobSubmissionException):
+                _LOGGER.error("Job submission failed: {}".format(script))
+                self._failed_sample_names.extend(
+                    [s.sample_name for s in pool])
+                self._num_cmds_submitted -= len(pool)
+                if self.throttle is not None:
+                    self.throttle.retry.failed += 1
+                continue
+            submitted += 1
+        self._deferred_names = set()
+        return submitted
+
+    def _defer(self, pool, jobs):
+        """
+        Determine whether a sample job is to be submitted after the others.
+
+        That's the case if the compute package has no dependency template,
+        so the jobs it depends on have to be waited for, or if an upstream
+        job of its samples was deferred.
+
+        :param Iterable[peppy.Sample] pool: samples of the job
+        :param Iterable[(str, callable)] jobs: all the jobs this one depends
+            on, see _job_dependencies
+        :return bool: whether to defer the job
+        """
+        if self.collate or \
+                self.prj.dcc.compute.get(DEPENDENCY_TEMPLATE_KEY):
+            return False
+        if any(s.sample_name in c._deferred_names
+               for c in self.upstream for s in pool):
+            return True
+        return any(i is not None for i, _ in jobs)
+
+    def _job_dependencies(self, pool, after=None):
+        """
+        Get all the jobs a job depends on.
+
+        :param Iterable[peppy.Sample] pool: samples of the job
+        :param Iterable[(str, callable)] after: jobs the job depends on, in
+            addition to the dependencies of the conductor and the upstream
+            jobs of its samples
+        :return list[(str, callable)]: scheduler ID and finished check of
+            the jobs
+        """
+        return self.dependencies + self._upstream_jobs(pool) + \
+            list(after or [])
+
+    def submit_requeued(self):
+        """
+        Retry the job submissions that failed transiently.
+
+        These are the submissions re-queued after their retries were
+        exhausted; submitting them again at the end of the run gives the
+        scheduler time to recover. Each gets another round of retries, after
+        which its samples are considered failed.
+
+        :return int: number of jobs submitted
+        """
+        requeued, self._requeued = self._requeued, []
+        submitted = 0
+        for sub_cmd, script, pool, package in requeued:
+            _LOGGER.info("Resubmitting re-queued job: {}".format(script))
+            if package is not None:
+                self._activate_package(package)
+            try:
+                self._submit_script(sub_cmd, script, pool)
+            except (subprocess.CalledProcessError, JobSubmissionException):
+                _LOGGER.error("Job submission failed permanently: {}".
+                              format(script))
+                self._failed_sample_names.extend(
+                    [] if self.collate else [s.sample_name for s in pool])
+                self.throttle.retry.failed += 1
+                continue
+            self._num_cmds_submitted += len(pool)
+            submitted += 1
+        return submitted
+
+    def _submit_script(self, sub_cmd, script, pool, jobs=None, folder=None):
+        """
+        Submit a job script, within the limits of the throttle.
+
+        :param str sub_cmd: submission command
+        :param str script: path to the job script
+        :param Iterable[peppy.Sample] pool: samples of the job
+        :param Iterable[(str, callable)] jobs: all the jobs this one depends
+            on, if already known; by default, the dependencies of the
+            conductor and the upstream jobs of its samples
+        :param str folder: folder of the flags of the job, if not the folders
+            of its samples, e.g. that of a shard
+        :return (str, callable): scheduler ID of the job, None if not known,
+            and a check of whether it's finished, None for project jobs
+        :raise subprocess.CalledProcessError: if the submission fails; with
+            a throttle, after the retries if the failure is transient
+        :raise JobSubmissionException: if the jobs this one depends on were
+            waited for and given up on
+        """
+        if jobs is None:
+            jobs = self._job_dependencies(pool)
+        dependency = self._dependency_option(jobs)
+        if dependency is None:
+            _LOGGER.error("Not submitted, the jobs it depends on didn't "
+                          "finish: {}".format(script))
+            raise JobSubmissionException(sub_cmd, script)
+        if dependency:
+            sub_cmd = "{} {}".format(sub_cmd, dependency)
+        submission_command = "{} {}".format(sub_cmd, script)
+        if self.throttle:
+            self.throttle.wait(self.pl_name)
+        with timed("submit", sample=partial(_pool_sample_names, pool),
+                   pipeline=self.pl_name):
+            if self.throttle is None:
+                subprocess.check_call(submission_command, shell=True)
+                output = None
+            else:
+                output = self.throttle.retry.submit(submission_command)
+        job_name = os.path.splitext(os.path.basename(script))[0]
+        job_id = parse_job_id(output, self.prj.dcc.compute.get(
+            JOB_ID_PATTERN_KEY) or DEFAULT_JOB_ID_PATTERN)
+        if job_id is not None:
+            _LOGGER.debug("Job ID: {}".format(job_id))
+        SubmissionJournal(self.prj.submission_folder).record(
+            job_id, job_name, self.pl_name,
+            [] if self.collate else [s.sample_name for s in pool], script)
+        finished = None if self.collate \
+            else _flags_finished(self.prj, list(pool), self.pl_name, folder)
+        job = (job_id, finished)
+        if finished is not None:
+            self._submitted_jobs.append(job)
+            for sample in pool:
+                self._sample_jobs[sample.sample_name] = [job]
+        if self.throttle:
+            self.throttle.record_submission(self.pl_name, job_name,
+                                            finished=finished)
+        if self.balancer is not None:
+            self.balancer.record(job, self._package)
+        return job
+
     def _is_full(self, pool, size):
         """
         Determine whether it's time to submit a job for the pool of commands.
@@ -457,6 +864,83 @@ class SubmissionConductor(object):
         """
         return [s for s in self._pool]
 
+    def _dependency_option(self, jobs):
+        """
+        Make a job depend on other jobs: this conductor's dependencies, the
+        upstream jobs of its samples and those given for the job.
+
+        With a dependency template in the compute package, the scheduler
+        holds the job until the jobs it depends on finish. Otherwise, or if
+        their IDs are unknown, the jobs are waited for here, as are the jobs
+        a balancer submitted to other compute packages; sample jobs that
+        wait are deferred until the others are submitted, see
+        submit_deferred.
+
+        :param Iterable[(str, callable)] jobs: the jobs the job depends on,
+            see _job_dependencies
+        :return str | NoneType: submission command option that makes the job
+            depend on the others; empty if there's none; None if the jobs
+            waited for here were given up on
+        """
+        if self.balancer is not None:
+            jobs = self.balancer.local_jobs(jobs, self._package)
+            if jobs is None:
+                return None
+        job_ids = [i for i, _ in jobs if i is not None]
+        if not job_ids:
+            return ""
+        compute = self.prj.dcc.compute
+        template = compute.get(DEPENDENCY_TEMPLATE_KEY)
+        if template:
+            _LOGGER.info("Job depends on {} jobs".format(len(job_ids)))
+            if len(job_ids) < len(jobs):
+                _LOGGER.warning("Unknown IDs of {} jobs; the job doesn't "
+                                "depend on them".
+                                format(len(jobs) - len(job_ids)))
+            return dependency_option(template, job_ids,
+                                     compute.get(DEPENDENCY_SEPARATOR_KEY))
+        _LOGGER.info("No '{}' in the compute package; waiting for {} jobs to "
+                     "finish".format(DEPENDENCY_TEMPLATE_KEY, len(job_ids)))
+        if wait_for_jobs(jobs, compute.get(JOB_STATUS_COMMAND_KEY),
+                         compute.get(DEPENDENCY_POLL_KEY),
+                         compute.get(MAX_JOB_WAIT_KEY)):
+            return None
+        return ""
+
+    def _activate_package(self, name):
+        """
+        Make the compute package a job is assigned to the active one, with
+        the compute settings from the command line on top of it.
+
+        :param str name: name of the package
+        """
+        self._package = name
+        self.throttle = self.balancer.activate(name)
+        self.prj.dcc.compute.update(self.compute_variables or {})
+
+    def _upstream_jobs(self, pool):
+        """
+        Get the jobs of the upstream pipelines for the samples of a job.
+
+        Upstream jobs that are still pooled are submitted first.
+
+        :param Iterable[peppy.Sample] pool: samples of the job
+        :return list[(str, callable)]: scheduler ID and finished check of
+            the upstream jobs
+        """
+        if self.collate or not self.upstream:
+            return []
+        names = [s.sample_name for s in pool]
+        jobs = []
+        for conductor in self.upstream:
+            if any(s.sample_name in names for s in conductor._pool):
+                conductor.submit(force=True)
+            for name in names:
+                # samples lumped into one upstream job share it
+                jobs.extend(job for job in conductor._sample_jobs.get(name, [])
+                            if job not in jobs)
+        return jobs
+
     def _sample_lump_name(self, pool):
         """ Determine how to refer to the 'sample' for this submission. """
         if self.collate:
@@ -476,12 +960,24 @@ class SubmissionConductor(object):
             # name concordant with 1-based, not 0-based indexing.
             return "lump{}".format(self._num_total_job_submissions + 1)
 
+    def _shard_folder(self, pool, shard):
+        """
+        Get the output folder of a shard job of a scattered sample.
+
+        :param Iterable[peppy.Sample] pool: the scattered sample
+        :param int shard: index of the shard
+        :return str: path to the folder, in the output folder of the sample
+        """
+        return os.path.join(self.prj.results_folder,
+                            self._sample_lump_name(pool),
+                            "shard{}".format(shard + 1))
+
     def _jobname(self, pool):
         """ Create the name for a job submission. """
         return "{}_{}".format(self.pl_iface.pipeline_name,
                               self._sample_lump_name(pool))
 
-    def _set_looper_namespace(self, pool, size):
+    def _set_looper_namespace(self, pool, size, shards=None, shard=None):
         """
         Compile a dictionary of looper/submission related settings for use in
         the command templates and in submission script creation
@@ -489,6 +985,10 @@ class SubmissionConductor(object):
 
         :param Iterable[peppy.Sample] pool: collection of sample instances
         :param float size: cumulative size of the given pool
+        :param list shards: chunks of the work of a scattered sample, or the
+            sample chunks of a project pipeline
+        :param int shard: index of the shard of a shard job; a gather (or
+            merge) job if not given with the shards
         :return dict: looper/submission related settings
         """
         settings = AttMap()
@@ -499,6 +999,29 @@ class SubmissionConductor(object):
         settings.sample_output_folder = \
             os.path.join(self.prj.results_folder, self._sample_lump_name(pool))
         settings.job_name = self._jobname(pool)
+        if shards is not None and self.collate:
+            settings.num_chunks = len(shards)
+            if shard is None:
+                settings.job_name += "_merge"
+            else:
+                settings.chunk_samples = \
+                    [s[SAMPLE_NAME_ATTR] for s in shards[shard]]
+                settings.chunk_index = shard
+                settings.job_name += "_chunk{}".format(shard + 1)
+        elif shards is not None:
+            settings.num_shards = len(shards)
+            if shard is None:
+                # lists are rendered space-separated
+                settings.shards = [str(x) for x in shards]
+                settings.shard_output_folders = \
+                    [self._shard_folder(pool, i) for i in range(len(shards))]
+                settings.job_name += "_gather"
+            else:
+                settings.shard = shards[shard]
+                settings.shard_index = shard
+                # the shards mustn't share their outputs and flags
+                settings.sample_output_folder = self._shard_folder(pool, shard)
+                settings.job_name += "_shard{}".format(shard + 1)
         settings.total_input_size = size
         settings.log_file = \
             os.path.join(self.prj.submission_folder, settings.job_name) + ".log"
@@ -516,24 +1039,31 @@ class SubmissionConductor(object):
                 settings.pipeline_config = pl_config_file
         return settings
 
-    def write_script(self, pool, size):
+    def write_script(self, pool, size, shards=None, shard=None):
         """
         Create the script for job submission.
 
         :param Iterable[peppy.Sample] pool: collection of sample instances
         :param float size: cumulative size of the given pool
+        :param list shards: chunks of the work of a scattered sample, or the
+            sample chunks of a project pipeline
+        :param int shard: index of the shard of a shard job; a gather (or
+            merge) job, with its command template, if not given with the
+            shards
         :return str: Path to the job submission script created.
         """
         # looper settings determination
         if self.collate:
             pool = [None]
-        looper = self._set_looper_namespace(pool, size)
+        looper = self._set_looper_namespace(pool, size, shards, shard)
         commands = []
         namespaces = dict(project=self.prj[CONFIG_KEY],
                           looper=looper,
                           pipeline=self.pl_iface,
                           compute=self.prj.dcc.compute)
-        templ = self.pl_iface["command_template"]
+        templ = self.pl_iface["command_template"] \
+            if shards is None or shard is not None \
+            else self._scatter[self._final_key]
         if not self.override_extra:
             extras_template = EXTRA_PROJECT_CMD_TEMPLATE if self.collate \
                 else EXTRA_SAMPLE_CMD_TEMPLATE
@@ -545,19 +1075,28 @@ class SubmissionConductor(object):
             if sample:
                 namespaces.update({"sample": sample})
             else:
-                namespaces.update({"samples": self.prj.samples})
-            res_pkg = self.pl_iface.choose_resource_package(namespaces, size or 0)  # config
+                namespaces.update(
+                    {"samples": self._write_samples_table(looper, shards,
+                                                          shard)})
+            res_pkg = self.pl_iface.choose_resource_package(
+                namespaces, size or 0, self._fitted_resource_model())  # config
             res_pkg.update(cli)
             self.prj.dcc.compute.update(res_pkg)  # divcfg
             namespaces["compute"].update(res_pkg)
             self.pl_iface.render_var_templates(namespaces=namespaces)
             namespaces["pipeline"] = self.pl_iface
             # pre_submit hook namespace updates
-            namespaces = _exec_pre_submit(self.pl_iface, namespaces)
+            with timed("pre_submit", pipeline=self.pl_name,
+                       sample=partial(_pool_sample_names, [sample])):
+                namespaces = _exec_pre_submit(
+                    self.pl_iface, namespaces,
+                    server=self._get_pre_submit_server(namespaces))
             self._rendered_ok = False
             try:
-                argstring = jinja_render_template_strictly(template=templ,
-                                                           namespaces=namespaces)
+                with timed("render", pipeline=self.pl_name,
+                           sample=partial(_pool_sample_names, [sample])):
+                    argstring = jinja_render_template_strictly(
+                        template=templ, namespaces=namespaces)
             except UndefinedError as jinja_exception:
                 _LOGGER.warning(NOT_SUB_MSG.format(str(jinja_exception)))
             except KeyError as e:
@@ -569,8 +1108,11 @@ class SubmissionConductor(object):
                 self._num_good_job_submissions += 1
                 self._num_total_job_submissions += 1
         looper.command = "\n".join(commands)
+        self._job_command = looper.command
+        self._job_resources = res_pkg
         if self.collate:
-            _LOGGER.debug("samples namespace:\n{}".format(self.prj.samples))
+            _LOGGER.debug("samples namespace: {} samples".
+                          format(len(namespaces["samples"])))
         else:
             _LOGGER.debug("sample namespace:\n{}".format(
                 sample.__str__(max_attr=len(list(sample.keys())))))
@@ -579,8 +1121,49 @@ class SubmissionConductor(object):
         _LOGGER.debug("compute namespace:\n{}".format(self.prj.dcc.compute))
         _LOGGER.debug("looper namespace:\n{}".format(looper))
         subm_base = os.path.join(self.prj.submission_folder, looper.job_name)
-        return self.prj.dcc.write_script(output_path=subm_base + ".sub",
-                                         extra_vars=[{"looper": looper}])
+        with timed("write_script", sample=partial(_pool_sample_names, pool),
+                   pipeline=self.pl_name):
+            return self.prj.dcc.write_script(output_path=subm_base + ".sub",
+                                             extra_vars=[{"looper": looper}])
+
+    def _fitted_resource_model(self):
+        """
+        :return looper.resources.ResourceModel | NoneType: model predicting
+            the memory and time of the sample jobs, fitted on the first use;
+            None if the pipeline doesn't use one, there are too few runs to
+            fit it on or the jobs are project jobs
+        """
+        if not self._resource_model_fitted:
+            self._resource_model_fitted = True
+            if not self.collate and RESOURCE_MODEL_KEY in \
+                    self.pl_iface.get(COMPUTE_KEY, {}):
+                with timed("resource_model", pipeline=self.pl_name):
+                    self._resource_model = \
+                        fit_resource_model(self.prj, self.pl_iface)
+        return self._resource_model
+
+    def _write_samples_table(self, looper, shards=None, shard=None):
+        """
+        Write the table of the samples of a project job, next to its script,
+        and record its path and number of rows in the looper namespace.
+
+        :param looper.AttMap looper: looper namespace of the job
+        :param list shards: sample chunks of a project pipeline
+        :param int shard: index of the chunk of a partial job; all the
+            samples if not given
+        :return looper.samples_table.SamplesTable: table of the samples of
+            the job, to be used as the samples namespace
+        """
+        samples = shards[shard] if shard is not None else self.prj.samples
+        os.makedirs(self.prj.submission_folder, exist_ok=True)
+        with timed("samples_table", pipeline=self.pl_name):
+            table = write_samples_table(
+                samples, os.path.join(self.prj.submission_folder,
+                                      looper.job_name + "_samples"),
+                self.pl_iface.get(SAMPLES_TABLE_FORMAT_KEY))
+        looper.samples_table = table.path
+        looper.num_samples = len(table)
+        return table
 
     def write_skipped_sample_scripts(self):
         """
@@ -597,6 +1180,46 @@ class SubmissionConductor(object):
             [self.write_script(pool, size)
              for pool, size in self._skipped_sample_pools]
 
+    def close(self):
+        """
+        Release the resources held by this conductor for the duration of a run.
+
+        Currently that's the pre-submission hook server process, if one was
+        started.
+        """
+        if self._pre_submit_server is not None:
+            self._pre_submit_server.close()
+            self._pre_submit_server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get_pre_submit_server(self, namespaces):
+        """
+        Get the pre-submission hook server for this conductor's pipeline.
+
+        The server command template is rendered with the namespaces of the
+        first submission that needs it; the process is then reused for every
+        subsequent submission handled by this conductor.
+
+        :param dict[dict] namespaces: namespaces mapping
+        :return PreSubmitServer | NoneType: server to send hook requests to,
+            None if the pipeline interface does not define one
+        """
+        if self._pre_submit_server is None:
+            try:
+                templ = \
+                    self.pl_iface[PRE_SUBMIT_HOOK_KEY][PRE_SUBMIT_SERVER_KEY]
+            except KeyError:
+                return None
+            cmd = jinja_render_template_strictly(template=templ,
+                                                 namespaces=namespaces)
+            self._pre_submit_server = PreSubmitServer(cmd)
+        return self._pre_submit_server
+
     def _reset_pool(self):
         """ Reset the state of the pool of samples """
         self._pool = []
@@ -607,16 +1230,165 @@ class SubmissionConductor(object):
         self._curr_skip_size = 0
 
 
+class PreSubmitServer(object):
+    """
+    Long-lived pre-submission hook process.
+
+    The process is started once and then receives one request per line on its
+    standard input: the JSON-encoded namespaces mapping. For every request it
+    has to write a single line to its standard output, a JSON object with the
+    namespace updates, just like the output of the 'command_templates' hooks.
+    The process is expected to exit once its standard input is closed.
+    """
+    def __init__(self, cmd):
+        """
+        :param str cmd: command that starts the server
+        """
+        self.cmd = cmd
+        self._proc = None
+
+    def request(self, namespaces):
+        """
+        Send namespaces to the server and wait for the response.
+
+        The server process is started on the first request.
+
+        :param dict[dict] namespaces: namespaces mapping
+        :return: object decoded from the JSON response
+        :raise subprocess.CalledProcessError: if the server process exits
+            before responding
+        """
+        if self._proc is None:
+            _LOGGER.info("Starting pre-submit server: {}".format(self.cmd))
+            self._proc = Popen(self.cmd, shell=True, stdin=PIPE, stdout=PIPE,
+                               universal_newlines=True)
+        try:
+            self._proc.stdin.write(
+                dumps(_namespaces_to_dict(namespaces), default=str) + "\n")
+            self._proc.stdin.flush()
+            response = self._proc.stdout.readline()
+        except (IOError, OSError):
+            response = ""
+        if not response:
+            raise CalledProcessError(self._proc.wait(), self.cmd)
+        return loads(response)
+
+    def close(self):
+        """ Close the server input and wait for the process to exit """
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        try:
+            self._proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _LOGGER.warning("Pre-submit server did not exit, terminating: "
+                            "{}".format(self.cmd))
+            self._proc.kill()
+            self._proc.wait()
+        self._proc = None
+
+
+def _namespaces_to_dict(namespaces):
+    """
+    Convert namespaces to plain, JSON-serializable Python objects.
+
+    :param dict[dict] namespaces: namespaces mapping
+    :return dict[dict]: namespaces mapping consisting of dicts and lists
+    """
+    def _to_dict(x):
+        if hasattr(x, "to_dict"):
+            return x.to_dict()
+        if isinstance(x, list):
+            return [_to_dict(i) for i in x]
+        return x
+    return {str(namespace): _to_dict(values)
+            for namespace, values in namespaces.items()}
+
+
+def _pool_sample_names(pool):
+    """
+    Get a label for the samples in a pool, used in trace spans.
+
+    :param Iterable[peppy.Sample] pool: samples; None for project-level jobs
+    :return str | NoneType: comma-separated sample names, None if there are
+        no samples in the pool
+    """
+    return ",".join(s.sample_name for s in pool if s is not None) or None
+
+
+def _flags_finished(prj, samples, pl_name, folder=None):
+    """
+    Create a check of whether a job is finished, based on the flags of its
+    samples written since now.
+
+    :param looper.Project prj: project the samples belong to
+    :param Iterable[peppy.Sample] samples: samples of the job
+    :param str pl_name: name of the pipeline of the job
+    :param str folder: folder of the flags of the job, if not the folders of
+        its samples, e.g. that of a shard
+    :return callable: function checking whether every sample of the job has
+        a completed or failed flag written since the job submission
+    """
+    since = time.time()
+
+    def _flags(sample):
+        if folder is None:
+            return fetch_sample_flags(prj, sample, pl_name)
+        if not os.path.isdir(folder):
+            return []
+        return [os.path.join(folder, f) for f in os.listdir(folder)
+                if f.endswith(".flag") and f.startswith(pl_name)]
+
+    def _finished():
+        for sample in samples:
+            flags = _flags(sample)
+            try:
+                if not any(os.path.getmtime(f) >= since and
+                           any(x in os.path.basename(f)
+                               for x in _FINISHED_FLAGS) for f in flags):
+                    return False
+            except OSError:
+                # flag replaced while checked, e.g. running -> completed
+                return False
+        return True
+    return _finished
+
+
+def _sample_chunks(samples, chunks=None, chunk_size=None):
+    """
+    Partition the samples into consecutive chunks of about the same size.
+
+    :param Sequence[peppy.Sample] samples: samples to partition
+    :param int chunks: number of chunks
+    :param int chunk_size: number of samples in a chunk, if the number of
+        chunks isn't given
+    :return list[list[peppy.Sample]]: the chunks, no more than the samples
+    """
+    n = len(samples)
+    if chunks is None:
+        chunks = -(-n // int(chunk_size)) if chunk_size else 1
+    chunks = max(1, min(int(chunks), n))
+    return [list(samples[i * n // chunks:(i + 1) * n // chunks])
+            for i in range(chunks)]
+
+
 def _use_sample(flag, skips):
     return flag and not skips
 
 
-def _exec_pre_submit(piface, namespaces):
+def _exec_pre_submit(piface, namespaces, server=None):
     """
     Execute pre submission hooks defined in the pipeline interface
 
+    Python functions are executed first, then the request to the hook
+    server is sent and finally the command templates are executed.
+
     :param PipelineInterface piface: piface, a source of pre_submit hooks to execute
     :param dict[dict[]] namespaces: namspaces mapping
+    :param PreSubmitServer server: hook server to send the namespaces to
     :return dict[dict[]]: updated namspaces mapping
     """
 
@@ -658,6 +1430,15 @@ def _exec_pre_submit(piface, namespaces):
                 _LOGGER.info("Calling pre-submit function: {}.{}".format(
                     pkgstr, func.__name__))
                 _update_namespaces(namespaces, func(namespaces))
+        if server is not None:
+            _LOGGER.debug("Sending request to pre-submit server: {}".
+                          format(server.cmd))
+            try:
+                json = server.request(namespaces)
+            except (CalledProcessError, ValueError):
+                _log_raise_latest(server.cmd)
+            else:
+                _update_namespaces(namespaces, json, cmd=True)
         if PRE_SUBMIT_CMD_KEY in pre_submit:
             for cmd_template in pre_submit[PRE_SUBMIT_CMD_KEY]:
                 _LOGGER.debug(
@@ -22,7 +22,19 @@ __all__ = [
     "DOTFILE_CFG_PTH_KEY", "DRY_RUN_KEY", "FILE_CHECKS_KEY", "CLI_KEY",
     "PRE_SUBMIT_HOOK_KEY", "PRE_SUBMIT_PY_FUN_KEY", "PRE_SUBMIT_CMD_KEY",
     "SUBMISSION_YAML_PATH_KEY", "SAMPLE_YAML_PRJ_PATH_KEY",
-    "SAMPLE_CWL_YAML_PATH_KEY",
+    "SAMPLE_CWL_YAML_PATH_KEY", "PRE_SUBMIT_SERVER_KEY",
+    "SUBMISSION_RATE_KEY", "SUBMISSION_BURST_KEY", "QUEUE_COMMAND_KEY",
+    "QUEUE_HIGH_KEY", "QUEUE_LOW_KEY", "QUEUE_POLL_KEY", "THROTTLE_KEYS",
+    "MAX_JOBS_KEY", "JOB_NAMES_COMMAND_KEY", "MAX_JOB_WAIT_KEY",
+    "SUBMISSION_RETRIES_KEY",
+    "SUBMISSION_BACKOFF_KEY", "SUBMISSION_MAX_BACKOFF_KEY",
+    "RETRY_PATTERNS_KEY", "JOB_ID_PATTERN_KEY", "JOB_STATUS_COMMAND_KEY",
+    "DEPENDENCY_TEMPLATE_KEY", "DEPENDENCY_SEPARATOR_KEY",
+    "DEPENDENCY_POLL_KEY", "DEPENDS_ON_KEY", "SCATTER_KEY",
+    "SCATTER_ATTR_KEY", "SCATTER_SHARDS_KEY", "GATHER_CMD_KEY", "REDUCE_KEY",
+    "REDUCE_CHUNKS_KEY", "REDUCE_CHUNK_SIZE_KEY", "MERGE_CMD_KEY",
+    "SAMPLES_TABLE_FORMAT_KEY", "RESOURCE_HISTORY_KEY", "HEADROOM_KEY",
+    "RESOURCE_MODEL_KEY", "MIN_SAMPLES_KEY",
 ]
 
 FLAGS = ["completed", "running", "failed", "waiting", "partial"]
@@ -71,6 +83,64 @@ def _get_apperance_dict(type, templ=APPEARANCE_BY_FLAG):
 PRE_SUBMIT_HOOK_KEY = "pre_submit"
 PRE_SUBMIT_PY_FUN_KEY = "python_functions"
 PRE_SUBMIT_CMD_KEY = "command_templates"
+PRE_SUBMIT_SERVER_KEY = "server_command_template"
+
+# compute package settings of the submission throttle and retries
+SUBMISSION_RATE_KEY = "submission_rate"
+SUBMISSION_BURST_KEY = "submission_burst"
+QUEUE_COMMAND_KEY = "queue_command"
+QUEUE_HIGH_KEY = "queue_high"
+QUEUE_LOW_KEY = "queue_low"
+QUEUE_POLL_KEY = "queue_poll_interval"
+MAX_JOBS_KEY = "max_concurrent_jobs"
+JOB_NAMES_COMMAND_KEY = "job_names_command"
+MAX_JOB_WAIT_KEY = "max_job_wait"
+SUBMISSION_RETRIES_KEY = "submission_retries"
+SUBMISSION_BACKOFF_KEY = "submission_backoff"
+SUBMISSION_MAX_BACKOFF_KEY = "submission_max_backoff"
+RETRY_PATTERNS_KEY = "submission_retry_patterns"
+THROTTLE_KEYS = [SUBMISSION_RATE_KEY, SUBMISSION_BURST_KEY, QUEUE_COMMAND_KEY,
+                 QUEUE_HIGH_KEY, QUEUE_LOW_KEY, QUEUE_POLL_KEY, MAX_JOBS_KEY,
+                 JOB_NAMES_COMMAND_KEY, MAX_JOB_WAIT_KEY,
+                 SUBMISSION_RETRIES_KEY, SUBMISSION_BACKOFF_KEY,
+                 SUBMISSION_MAX_BACKOFF_KEY, RETRY_PATTERNS_KEY]
+# compute package settings of the job IDs and their status in the scheduler
+JOB_ID_PATTERN_KEY = "job_id_pattern"
+JOB_STATUS_COMMAND_KEY = "job_status_command"
+# compute package settings of the dependencies of a job on other jobs, e.g.
+# of a project job on the sample jobs, of a dependent sample pipeline job on
+# the upstream one or of a gather job on the shard jobs: the submission
+# command option, e.g. '--dependency=afterok:{job_ids}', the separator of the
+# job IDs in it, and the polling interval in seconds if there's no option
+DEPENDENCY_TEMPLATE_KEY = "dependency_template"
+DEPENDENCY_SEPARATOR_KEY = "dependency_separator"
+DEPENDENCY_POLL_KEY = "dependency_poll_interval"
+# pipeline interface key: names of the pipelines whose job of the same sample
+# a sample pipeline job depends on
+DEPENDS_ON_KEY = "depends_on"
+# pipeline interface section that splits the job of a sample into shards
+SCATTER_KEY = "scatter"
+SCATTER_ATTR_KEY = "attribute"
+SCATTER_SHARDS_KEY = "shards"
+GATHER_CMD_KEY = "gather_command_template"
+# project pipeline interface section that splits the samples into chunks
+REDUCE_KEY = "reduce"
+REDUCE_CHUNKS_KEY = "chunks"
+REDUCE_CHUNK_SIZE_KEY = "chunk_size"
+MERGE_CMD_KEY = "merge_command_template"
+# project pipeline interface key: format of the samples table written for
+# every project job, 'tsv', 'jsonl' or 'parquet'
+SAMPLES_TABLE_FORMAT_KEY = "samples_table_format"
+# pipeline interface compute section that derives the memory and time of
+# the sample jobs from the profiles of their last successful runs, and the
+# factor their resource usage is multiplied by
+RESOURCE_HISTORY_KEY = "resource_history"
+HEADROOM_KEY = "headroom"
+# pipeline interface compute section that predicts the memory and time of
+# the sample jobs from their input size, with a model fitted on the
+# profiles of the successful runs, and the number of runs it requires
+RESOURCE_MODEL_KEY = "resource_model"
+MIN_SAMPLES_KEY = "min_samples"
 
 LOGGING_LEVEL = "INFO"
 CFG_ENV_VARS = ["LOOPER"]
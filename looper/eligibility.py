@@ -0,0 +1,223 @@
+""" Sample eligibility for submission, determined before the submission loop """
+
+import os
+from logging import getLogger
+
+import numpy as np
+
+from .sample_columns import MISSING
+
+__all__ = ["FlagIndex", "SubmissionPlan", "plan_submission",
+           "NO_PIFACE_REASON"]
+
+_LOGGER = getLogger(__name__)
+
+NO_PIFACE_REASON = "No pipeline interfaces defined"
+FLAG_EXT = ".flag"
+
+
+class FlagIndex(object):
+    """
+    Flag files in the sample results folders of a project.
+
+    The results folder is scanned once: its subfolders are listed and the
+    flag files they hold recorded, so that looking up the flags of a sample
+    doesn't touch the file system. Sample folders that aren't direct
+    subfolders of the results folder are listed on first lookup.
+    """
+    def __init__(self, results_folder):
+        """
+        :param str results_folder: path to the project results folder, with
+            a subfolder per sample
+        """
+        self.results_folder = results_folder
+        self._flags = {}
+        try:
+            entries = list(os.scandir(results_folder))
+        except OSError:
+            _LOGGER.debug("Results folder doesn't exist: {}".
+                          format(results_folder))
+            entries = []
+        for entry in entries:
+            if entry.is_dir():
+                self._flags[entry.name] = _list_flags(entry.path)
+        _LOGGER.debug("Indexed flags of {} sample folders: {}".
+                      format(len(self._flags), results_folder))
+
+    @property
+    def flagged(self):
+        """
+        :return set[str]: names of the sample folders with any flag files
+        """
+        return {name for name, flags in self._flags.items() if flags}
+
+    def sample_flags(self, sample_name, pl_name=""):
+        """
+        Get the flag files of a sample.
+
+        :param str sample_name: name of the sample
+        :param str pl_name: name of the pipeline the flags should be for
+        :return list[str]: paths to the flag files of the sample
+        """
+        try:
+            names = self._flags[sample_name]
+        except KeyError:
+            if os.path.basename(sample_name) == sample_name:
+                return []
+            names = _list_flags(
+                os.path.join(self.results_folder, sample_name))
+            self._flags[sample_name] = names
+        folder = os.path.join(self.results_folder, sample_name)
+        return [os.path.join(folder, f) for f in names
+                if f.startswith(pl_name)]
+
+
+class SubmissionPlan(object):
+    """
+    Eligibility of the sample and pipeline interface pairs for submission.
+
+    Rows of the eligibility mask correspond to the planned samples and
+    columns to the pipeline interfaces of the sample registry. Pairs that
+    are assigned but not eligible have a skip reason, and so do the samples
+    with no pipeline interfaces.
+    """
+    def __init__(self, registry, sample_ids, eligible, skip_reasons,
+                 sample_reasons):
+        """
+        :param looper.registry.SampleRegistry registry: registry of the
+            samples and pipeline interfaces
+        :param numpy.ndarray sample_ids: IDs of the planned samples
+        :param numpy.ndarray eligible: boolean mask, a row per planned
+            sample and a column per interface
+        :param dict[(int, int), str] skip_reasons: reasons for skipping the
+            ineligible pairs, by sample and interface ID
+        :param dict[int, str] sample_reasons: reasons for skipping the
+            samples as a whole, by sample ID
+        """
+        self.registry = registry
+        self.sample_ids = sample_ids
+        self.eligible = eligible
+        self.skip_reasons = skip_reasons
+        self.sample_reasons = sample_reasons
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    @property
+    def num_eligible(self):
+        """
+        :return int: number of eligible sample and pipeline interface pairs
+        """
+        return int(self.eligible.sum())
+
+    @property
+    def eligible_sample_ids(self):
+        """
+        :return numpy.ndarray: IDs of the samples with any eligible pair
+        """
+        return self.sample_ids[self.eligible.any(axis=1)]
+
+    def interface_ids(self, row):
+        """
+        :param int row: row of the planned sample
+        :return numpy.ndarray: IDs of the interfaces the sample is eligible
+            for
+        """
+        return np.flatnonzero(self.eligible[row])
+
+
+def plan_submission(prj, samples, limit=None, rerun=False,
+                    ignore_flags=False, flag_index=None):
+    """
+    Determine which samples to submit, and for which pipelines.
+
+    This is done for all the samples at once, before any of them is
+    processed, based on the pipeline interfaces assigned to them, the
+    toggle attribute and the flag files. A sample with flags for a pipeline
+    is skipped, unless flags are ignored; on rerun only the samples with a
+    failed flag for a pipeline are submitted.
+
+    :param looper.Project | looper.project.ProjectContext prj: project
+    :param Iterable[peppy.Sample] samples: samples to consider, in order
+    :param int limit: maximum number of samples to consider
+    :param bool rerun: whether only the failed samples should be submitted
+    :param bool ignore_flags: whether to submit the samples with flags
+    :param FlagIndex flag_index: index of the project flag files; created
+        if not provided
+    :return SubmissionPlan: the submission plan
+    :raise ValueError: if the limit is negative or a toggle value is not
+        an integer
+    """
+    registry = prj.sample_registry
+    samples = list(samples)
+    if limit is not None:
+        if limit < 0:
+            raise ValueError("Invalid number of samples to run: {}".
+                             format(limit))
+        samples = samples[:limit]
+    sample_ids = np.array([registry.sample_id(s.sample_name)
+                           for s in samples], dtype=np.int64)
+    assigned = registry.membership[:, sample_ids].T
+    sample_reasons = {int(i): NO_PIFACE_REASON
+                      for i in sample_ids[~assigned.any(axis=1)]}
+
+    # flags; only the samples with any flag files are visited
+    flag_index = flag_index or FlagIndex(prj.results_folder)
+    flagged = flag_index.flagged
+    pl_names = [pi.pipeline_name for pi in registry.interfaces]
+    if rerun:
+        use = np.zeros(assigned.shape, dtype=bool)
+    else:
+        use = np.ones(assigned.shape, dtype=bool)
+    skip_reasons = {}
+    for row, sample in enumerate(samples):
+        name = sample.sample_name
+        if name not in flagged and os.path.basename(name) == name:
+            continue
+        sid = int(sample_ids[row])
+        for iid in np.flatnonzero(assigned[row]):
+            flag_files = flag_index.sample_flags(name, pl_names[iid])
+            if rerun:
+                use[row, iid] = any("failed" in x for x in flag_files)
+            elif flag_files and not ignore_flags:
+                use[row, iid] = False
+                skip_reasons[(sid, int(iid))] = "Flags found: {}".format(
+                    ", ".join(os.path.basename(f) for f in flag_files))
+    if rerun:
+        for row, iid in zip(*np.nonzero(assigned & ~use)):
+            skip_reasons[(int(sample_ids[row]), int(iid))] = \
+                "No failed flag found"
+
+    # toggle
+    columns = prj.sample_columns
+    toggle_key = prj.toggle_key
+    if columns.has_attribute(toggle_key):
+        values = [columns.value(s, toggle_key) for s in samples]
+        off = np.array([v is not MISSING and int(v) == 0 for v in values],
+                       dtype=bool)
+        use[off] = False
+        for row in np.flatnonzero(off & assigned.any(axis=1)):
+            for iid in np.flatnonzero(assigned[row]):
+                skip_reasons[(int(sample_ids[row]), int(iid))] = \
+                    "Toggled off ({}: {})".format(toggle_key, values[row])
+
+    eligible = assigned & use
+    _LOGGER.debug("Eligible for submission: {} of {} sample-pipeline pairs".
+                  format(int(eligible.sum()), int(assigned.sum())))
+    return SubmissionPlan(registry, sample_ids, eligible, skip_reasons,
+                          sample_reasons)
+
+
+def _list_flags(folder):
+    """
+    List the flag files in a folder.
+
+    :param str folder: path to the folder
+    :return list[str]: names of the flag files; empty if the folder doesn't
+        exist
+    """
+    try:
+        return [f for f in os.listdir(folder)
+                if os.path.splitext(f)[1] == FLAG_EXT]
+    except OSError:
+        return []
@@ -12,6 +12,7 @@ from datetime import timedelta
 from ._version import __version__ as v
 from .const import *
 from .processed_project import get_project_outputs
+from .timings import timed
 from .utils import get_file_for_project
 from peppy.const import *
 from eido import read_schema
@@ -501,7 +502,9 @@ class HTMLReportBuilder(object):
             for row in stats:
                 table_cell_data = []
                 sample_name = row["sample_name"]
-                sample_page = self.create_sample_html(objs, sample_name, row, navbar_reports, footer)
+                with timed("report.sample_page", sample=sample_name):
+                    sample_page = self.create_sample_html(
+                        objs, sample_name, row, navbar_reports, footer)
                 # treat sample_name column differently - provide a link to the sample page
                 table_cell_data.append([sample_page, sample_name])
                 # for each column read the data from the stats
@@ -517,27 +520,38 @@ class HTMLReportBuilder(object):
             _LOGGER.warning("No stats file '%s'", stats_file_name)
 
         # Create parent samples page with links to each sample
-        save_html(os.path.join(self.reports_dir, "samples.html"), self.create_sample_parent_html(navbar_reports, footer))
+        with timed("report.samples_page"):
+            save_html(os.path.join(self.reports_dir, "samples.html"),
+                      self.create_sample_parent_html(navbar_reports, footer))
         _LOGGER.debug(" * Creating object pages...")
         # Create objects pages
         if not objs.dropna().empty:
             for key in objs['key'].drop_duplicates().sort_values():
                 single_object = objs[objs['key'] == key]
-                self.create_object_html(single_object, navbar_reports, footer)
+                with timed("report.object_page", object=str(key)):
+                    self.create_object_html(single_object, navbar_reports,
+                                            footer)
 
         # Create parent objects page with links to each object type
-        save_html(os.path.join(self.reports_dir, "objects.html"),
-                  self.create_object_parent_html(objs, navbar_reports, footer))
+        with timed("report.objects_page"):
+            save_html(os.path.join(self.reports_dir, "objects.html"),
+                      self.create_object_parent_html(objs, navbar_reports,
+                                                     footer))
         # Create status page with each sample's status listed
-        save_html(os.path.join(self.reports_dir, "status.html"),
-                  self.create_status_html(create_status_table(self.prj), navbar_reports, footer))
+        with timed("report.status_page"):
+            save_html(os.path.join(self.reports_dir, "status.html"),
+                      self.create_status_html(create_status_table(self.prj),
+                                              navbar_reports, footer))
         # Add project level objects
-        project_objects = self.create_project_objects()
+        with timed("report.project_objects"):
+            project_objects = self.create_project_objects()
         # Complete and close HTML file
         template_vars = dict(project_name=self.prj.name, stats_json=_read_tsv_to_json(stats_file_name),
                              navbar=navbar, footer=footer, stats_file_path=stats_file_path,
                              project_objects=project_objects, columns=col_names, table_row_data=table_row_data)
-        save_html(index_html_path, render_jinja_template("index.html", self.j_env, template_vars))
+        with timed("report.index_page"):
+            save_html(index_html_path, render_jinja_template(
+                "index.html", self.j_env, template_vars))
         return index_html_path
 
 
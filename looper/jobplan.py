@@ -0,0 +1,307 @@
+""" Submission plans: jobs prepared by 'looper plan', submitted by 'looper apply' """
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+from ._version import __version__
+from .const import MAX_JOBS_KEY
+from .journal import DEFAULT_JOB_ID_PATTERN, SubmissionJournal, parse_job_id
+from .throttle import SubmissionThrottle
+from .timings import timed
+
+__all__ = ["JobPlan", "apply_plans", "plan_path", "read_plan", "shard_spec"]
+
+_LOGGER = logging.getLogger(__name__)
+
+PLAN_FORMAT = 1
+PLAN_FILE_NAME = "looper_plan"
+PLAN_EXT = ".jsonl"
+# Submission log of a plan, next to it, with the IDs of the submitted jobs
+DONE_EXT = ".done"
+
+
+class JobPlan(object):
+    """
+    Jobs prepared for submission, written to a JSON lines file.
+
+    The first line is a header with the plan metadata, followed by a line
+    per job: its ID, pipeline, samples, resource package, rendered commands,
+    path to the submission script and the submission command. Jobs are
+    written as they are added, to a temporary file that replaces the plan
+    file when the plan is closed, so that a plan is never incomplete.
+    """
+    def __init__(self, path, config_file=None, shard=None, throttle=None,
+                 job_id_pattern=None):
+        """
+        :param str path: path to the plan file
+        :param str config_file: path to the project config the plan is for
+        :param (int, int) shard: zero-based index and number of the sample
+            shards, if only a shard of the samples is planned
+        :param Mapping throttle: submission throttle settings to apply the
+            plan with
+        :param str job_id_pattern: regular expression matching the job IDs
+            in the output of the submission command
+        """
+        self.path = os.path.abspath(path)
+        self.shard = shard
+        self.num_jobs = 0
+        folder = os.path.dirname(self.path)
+        os.makedirs(folder, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        self._file = os.fdopen(fd, "w")
+        self._write({"format": PLAN_FORMAT, "looper_version": __version__,
+                     "config_file": config_file and
+                     os.path.abspath(config_file),
+                     "shard": list(shard) if shard else None,
+                     "throttle": dict(throttle or {}),
+                     "job_id_pattern": job_id_pattern,
+                     "created": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def add(self, pipeline, samples, script, submission_command,
+            resources=None, command=None):
+        """
+        Add a job to the plan.
+
+        :param str pipeline: name of the pipeline
+        :param Iterable[str] samples: names of the samples in the job
+        :param str script: path to the submission script
+        :param str submission_command: command to submit the script with
+        :param Mapping resources: resource package of the job
+        :param str command: rendered pipeline commands
+        :return int: ID of the job
+        """
+        job_id = self.num_jobs
+        self._write({"id": job_id, "pipeline": pipeline,
+                     "samples": list(samples), "script": script,
+                     "submission_command": submission_command,
+                     "resources": dict(resources or {}), "command": command})
+        self.num_jobs += 1
+        return job_id
+
+    def close(self):
+        """ Write the plan file """
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        # the jobs of a previous plan at this path are not the same ones
+        done = self.path + DONE_EXT
+        if os.path.exists(done):
+            os.remove(done)
+        _LOGGER.info("Plan with {} jobs written to: {}".
+                     format(self.num_jobs, self.path))
+
+    def discard(self):
+        """ Drop the plan, leaving a previous plan file in place """
+        self._file.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, default=str) + "\n")
+
+
+def plan_path(folder, shard=None):
+    """
+    Get the default path to a plan file.
+
+    :param str folder: folder to put the plan in
+    :param (int, int) shard: zero-based index and number of the shards
+    :return str: path to the plan file
+    """
+    name = PLAN_FILE_NAME if not shard else \
+        "{}_{}of{}".format(PLAN_FILE_NAME, shard[0] + 1, shard[1])
+    return os.path.join(folder, name + PLAN_EXT)
+
+
+def read_plan(path):
+    """
+    Read a plan file.
+
+    :param str path: path to the plan file
+    :return (dict, list[dict]): plan header and the jobs
+    :raise ValueError: if the file is not a plan or its format is unsupported
+    """
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records or records[0].get("format") != PLAN_FORMAT:
+        raise ValueError("Not a looper plan or unsupported plan format: {}".
+                         format(path))
+    return records[0], records[1:]
+
+
+def apply_plans(paths, dry_run=False, delay=0, throttle_overrides=None):
+    """
+    Submit the jobs of the plans.
+
+    Submitted jobs are recorded next to the plan file, so that a
+    subsequent invocation skips them and submits only the remaining ones,
+    e.g. after an interruption or a submission failure. Submissions are
+    throttled with the settings recorded in the plan; plans with the same
+    settings, e.g. the shards of a project, share the throttle. The caps of
+    the pipelines on the jobs in flight are taken from the job resources;
+    with no flags to check, jobs in flight are tracked with the job names
+    command only.
+
+    :param Iterable[str] paths: paths to the plan files
+    :param bool dry_run: whether to only list the jobs that would be
+        submitted
+    :param float delay: time in seconds to wait between the submissions
+    :param Mapping throttle_overrides: throttle settings overriding the
+        ones recorded in the plans
+    :return int: number of jobs that failed to be submitted
+    :raise ValueError: if a plan or its throttle settings are invalid
+    """
+    submitted, skipped, failed = 0, 0, 0
+    throttles = {}
+    for path in paths:
+        header, jobs = read_plan(path)
+        settings = dict(header.get("throttle") or {},
+                        **(throttle_overrides or {}))
+        key = json.dumps(settings, sort_keys=True, default=str)
+        if key not in throttles:
+            throttles[key] = SubmissionThrottle.from_settings(settings)
+        throttle = throttles[key]
+        job_id_pattern = header.get("job_id_pattern") or \
+            DEFAULT_JOB_ID_PATTERN
+        done_path = path + DONE_EXT
+        done = _read_done(done_path)
+        _LOGGER.info("Applying plan ({} jobs, {} submitted before): {}".
+                     format(len(jobs), len(done), path))
+        with open(done_path, "a") as done_file:
+            requeued = []
+            for job in jobs:
+                if job["id"] in done:
+                    skipped += 1
+                    continue
+                cmd = "{} {}".format(job["submission_command"], job["script"])
+                if dry_run:
+                    _LOGGER.info("Dry run, not submitted: {}".format(cmd))
+                    continue
+                if not os.path.isfile(job["script"]):
+                    _LOGGER.error("Missing submission script: {}".
+                                  format(job["script"]))
+                    failed += 1
+                    continue
+                try:
+                    _submit_job(job, throttle, done_file, job_id_pattern)
+                except subprocess.CalledProcessError as e:
+                    if getattr(e, "transient", False):
+                        _LOGGER.warning("Job submission re-queued: {}".
+                                        format(cmd))
+                        throttle.retry.requeued += 1
+                        requeued.append(job)
+                    else:
+                        _LOGGER.error("Job submission failed ({}): {}".
+                                      format(e.returncode, cmd))
+                        throttle.retry.failed += 1
+                        failed += 1
+                    continue
+                submitted += 1
+                with timed("sleep"):
+                    time.sleep(delay)
+            # Transiently failed submissions are retried once the others
+            # are done, giving the scheduler time to recover
+            for job in requeued:
+                _LOGGER.info("Resubmitting re-queued job: {}".
+                             format(job["script"]))
+                try:
+                    _submit_job(job, throttle, done_file, job_id_pattern)
+                except subprocess.CalledProcessError as e:
+                    _LOGGER.error("Job submission failed permanently ({}): "
+                                  "{}".format(e.returncode, job["script"]))
+                    throttle.retry.failed += 1
+                    failed += 1
+                    continue
+                submitted += 1
+    for throttle in throttles.values():
+        if throttle.retry.summary():
+            _LOGGER.info(throttle.retry.summary())
+    _LOGGER.info("Jobs submitted: {}; submitted before: {}; failed: {}".
+                 format(submitted, skipped, failed))
+    if dry_run:
+        _LOGGER.info("Dry run. No jobs were actually submitted.")
+    return failed
+
+
+def _submit_job(job, throttle, done_file, job_id_pattern):
+    """
+    Submit a planned job and record it as submitted, in the submission log
+    of the plan and in the journal of the submission folder.
+
+    :param dict job: the planned job
+    :param looper.throttle.SubmissionThrottle throttle: throttle and retry
+        policy of the submission
+    :param file done_file: submission log of the plan
+    :param str job_id_pattern: regular expression matching the job ID in
+        the output of the submission command
+    :raise subprocess.CalledProcessError: if the submission fails, after
+        the retries if the failure is transient
+    """
+    job_name = os.path.splitext(os.path.basename(job["script"]))[0]
+    throttle.cap.set_limit(
+        job["pipeline"], (job.get("resources") or {}).get(MAX_JOBS_KEY))
+    if throttle:
+        throttle.wait(job["pipeline"])
+    with timed("submit", sample=",".join(job["samples"]),
+               pipeline=job["pipeline"]):
+        output = throttle.retry.submit(
+            "{} {}".format(job["submission_command"], job["script"]))
+    job_id = parse_job_id(output, job_id_pattern)
+    done_file.write(json.dumps({
+        "id": job["id"], "job_id": job_id,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S")}) + "\n")
+    done_file.flush()
+    SubmissionJournal(os.path.dirname(job["script"])).record(
+        job_id, job_name, job["pipeline"], job["samples"], job["script"])
+    throttle.record_submission(job["pipeline"], job_name)
+
+
+def shard_spec(x):
+    """
+    Parse a sample shard specification, 'K/N'.
+
+    :param str x: one-based shard index and number of shards, e.g. '2/4'
+    :return (int, int): zero-based shard index and number of shards
+    :raise argparse.ArgumentTypeError: if the specification is invalid
+    """
+    try:
+        k, n = [int(i) for i in x.split("/")]
+    except ValueError:
+        k = n = 0
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError(
+            "Invalid shard '{}'; use K/N, with 1 <= K <= N".format(x))
+    return k - 1, n
+
+
+def _read_done(path):
+    """
+    Read the IDs of the submitted jobs of a plan.
+
+    :param str path: path to the submission log of the plan
+    :return set[int]: IDs of the submitted jobs
+    """
+    if not os.path.isfile(path):
+        return set()
+    done = set()
+    with open(path) as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                # e.g. a line cut short by an interruption
+                continue
+    return done
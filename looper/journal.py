@@ -0,0 +1,221 @@
+""" Journal of the submitted jobs and their status in the scheduler """
+
+import json
+import logging
+import os
+import re
+import subprocess
+import time
+
+from .const import DEPENDENCY_TEMPLATE_KEY, JOB_STATUS_COMMAND_KEY, \
+    MAX_JOB_WAIT_KEY
+from .exceptions import MisconfigurationException
+from .throttle import DEFAULT_MAX_JOB_WAIT
+from .timings import timed
+
+__all__ = ["SubmissionJournal", "dependency_option", "parse_job_id",
+           "query_job_states", "wait_for_jobs", "DEFAULT_JOB_ID_PATTERN"]
+
+_LOGGER = logging.getLogger(__name__)
+
+JOURNAL_FILE_NAME = "looper_jobs.jsonl"
+# Output of SLURM's sbatch
+DEFAULT_JOB_ID_PATTERN = r"Submitted batch job (\d+)"
+# Placeholder for the job IDs in the job status and dependency commands
+JOB_IDS_PLACEHOLDER = "{job_ids}"
+DEFAULT_DEPENDENCY_SEPARATOR = ":"
+DEFAULT_POLL_INTERVAL = 30
+# Scheduler job states, as reported by SLURM, PBS/Torque, SGE and LSF
+_STATES = {"pending": "queued", "pd": "queued", "q": "queued", "qw": "queued",
+           "pend": "queued", "h": "queued", "configuring": "queued",
+           "running": "running", "r": "running", "run": "running",
+           "completing": "running", "cg": "running", "e": "running"}
+
+
+class SubmissionJournal(object):
+    """
+    Journal of the submitted jobs, a JSON lines file in the submission folder.
+
+    A line is appended for every submitted job: its scheduler ID, if it
+    could be determined, name, pipeline, samples, script and submission
+    time. Resubmissions append new lines, so the last job of a sample and
+    pipeline is its latest submission.
+    """
+    def __init__(self, folder):
+        """
+        :param str folder: path to the submission folder
+        """
+        self.path = os.path.join(folder, JOURNAL_FILE_NAME)
+
+    def record(self, job_id, job_name, pipeline, samples, script):
+        """
+        Record a submitted job.
+
+        :param str job_id: scheduler ID of the job, None if not known
+        :param str job_name: name of the job
+        :param str pipeline: name of the pipeline of the job
+        :param Iterable[str] samples: names of the samples in the job; none
+            for project jobs
+        :param str script: path to the submission script
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps({
+                "job_id": job_id, "job_name": job_name, "pipeline": pipeline,
+                "samples": list(samples), "script": script,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S")}) + "\n")
+
+    def jobs(self):
+        """
+        :return list[dict]: the recorded jobs, in the submission order
+        """
+        if not os.path.isfile(self.path):
+            return []
+        jobs = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    jobs.append(json.loads(line))
+                except ValueError:
+                    # e.g. a line cut short by an interruption
+                    continue
+        return jobs
+
+    def latest(self):
+        """
+        Get the latest job of every sample and pipeline.
+
+        :return dict[(str, str), dict]: the latest jobs by pipeline and
+            sample name; None for the sample of the project jobs
+        """
+        latest = {}
+        for job in self.jobs():
+            for sample in job.get("samples") or [None]:
+                latest[(job.get("pipeline"), sample)] = job
+        return latest
+
+
+def parse_job_id(output, pattern=DEFAULT_JOB_ID_PATTERN):
+    """
+    Find the scheduler job ID in the output of a submission command.
+
+    :param str output: output of the submission command
+    :param str pattern: regular expression matching the job ID, or with a
+        group matching it
+    :return str | NoneType: the job ID, None if not found
+    """
+    match = re.search(pattern, output or "")
+    if match is None:
+        return None
+    return match.group(1) if match.groups() else match.group(0)
+
+
+def query_job_states(command, job_ids):
+    """
+    Get the states of the jobs in the scheduler with a single command.
+
+    The command prints a line per job, with the job ID and state, e.g.
+    'squeue -h -u $USER -o "%i %T"'. The '{job_ids}' placeholder, if
+    present, is replaced with the comma-separated IDs of the jobs.
+
+    :param str command: job status command
+    :param Iterable[str] job_ids: IDs of the jobs to get the states of
+    :return dict[str, str] | NoneType: states of the listed jobs, by job ID:
+        'queued', 'running' or the scheduler state, lowercased; None if the
+        command failed
+    """
+    job_ids = [str(i) for i in job_ids]
+    command = command.replace(JOB_IDS_PLACEHOLDER, ",".join(job_ids))
+    try:
+        with timed("job_status"):
+            out = subprocess.check_output(command, shell=True,
+                                          universal_newlines=True)
+    except subprocess.CalledProcessError as e:
+        _LOGGER.warning("Failed to query the job states with '{}': {}".
+                        format(command, e))
+        return None
+    states = {}
+    for line in out.splitlines():
+        fields = line.split()
+        if len(fields) >= 2:
+            state = fields[1].lower()
+            states[fields[0]] = _STATES.get(state, state)
+    return states
+
+
+def dependency_option(template, job_ids, separator=None):
+    """
+    Render the submission command option making a job depend on others.
+
+    :param str template: option with the '{job_ids}' placeholder, e.g.
+        '--dependency=afterok:{job_ids}'
+    :param Iterable[str] job_ids: IDs of the jobs to depend on
+    :param str separator: separator of the job IDs in the option, ':' by
+        default
+    :return str: the option
+    """
+    if separator is None:
+        separator = DEFAULT_DEPENDENCY_SEPARATOR
+    return template.replace(JOB_IDS_PLACEHOLDER,
+                            separator.join(str(i) for i in job_ids))
+
+
+def wait_for_jobs(jobs, status_command=None, interval=None, max_wait=None):
+    """
+    Wait for the jobs to finish, polling their state.
+
+    A job with a scheduler ID is finished once the job status command, if
+    given, doesn't list it as queued or running anymore; otherwise once the
+    flags of its samples say so. Jobs with no ID, e.g. those of the local
+    executor, were run by the submission command and are finished already.
+    Jobs with no flags to check, e.g. project jobs, can't be waited for
+    without the job status command. Jobs that are checked with their flags
+    only must write them: a job that dies without a completed or failed flag
+    is given up on after the maximum wait.
+
+    :param Iterable[(str, callable)] jobs: scheduler ID, None if not known,
+        and check of whether the job is finished, None if there's none, of
+        each job
+    :param str status_command: command printing the ID and state of the jobs
+        in the scheduler, see query_job_states
+    :param float interval: time in seconds between the polls
+    :param float max_wait: time in seconds after which the jobs checked with
+        their flags are given up on, a day by default
+    :return list[str]: IDs of the jobs given up on; empty if all finished
+    :raise MisconfigurationException: if there are jobs with no flags to
+        check and no job status command
+    """
+    interval = DEFAULT_POLL_INTERVAL if interval is None else float(interval)
+    max_wait = DEFAULT_MAX_JOB_WAIT if max_wait is None else float(max_wait)
+    pending = [(i, finished) for i, finished in jobs if i is not None]
+    if not status_command:
+        unchecked = [i for i, finished in pending if finished is None]
+        if unchecked:
+            raise MisconfigurationException(
+                "Can't wait for {} jobs with no flags to check, e.g. project "
+                "jobs, with no '{}' or '{}' in the compute package: {}".
+                format(len(unchecked), DEPENDENCY_TEMPLATE_KEY,
+                       JOB_STATUS_COMMAND_KEY, ", ".join(unchecked)))
+    start = time.time()
+    while pending:
+        states = query_job_states(status_command, [i for i, _ in pending]) \
+            if status_command else None
+        if states is None:
+            pending = [(i, finished) for i, finished in pending
+                       if finished is not None and not finished()]
+            if pending and time.time() - start >= max_wait:
+                job_ids = [i for i, _ in pending]
+                _LOGGER.warning("Gave up waiting for {} jobs after {:.0f} s "
+                                "('{}'), no completed or failed flags: {}".
+                                format(len(job_ids), max_wait,
+                                       MAX_JOB_WAIT_KEY, ", ".join(job_ids)))
+                return job_ids
+        else:
+            pending = [(i, finished) for i, finished in pending
+                       if states.get(i) in ("queued", "running")]
+        if not pending:
+            break
+        _LOGGER.info("Waiting for {} jobs to finish".format(len(pending)))
+        with timed("wait"):
+            time.sleep(interval)
+    return []
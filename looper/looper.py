@@ -14,37 +14,34 @@ if sys.version_info < (3, 3):
     from collections import Mapping
 else:
     from collections.abc import Mapping
-import yaml
-import pandas as _pd
 
 from collections import defaultdict
-# Need specific sequence of actions for colorama imports?
-from colorama import init
-init()
-from colorama import Fore, Style
 from shutil import rmtree
-from jsonschema import ValidationError
 from copy import copy
 
+# pandas, yaml, colorama, jsonschema, jinja2 (the conductor), divvy, eido,
+# peppy (the project) and the HTML reports are imported by the subcommands
+# that need them, to keep the CLI startup fast.
 from . import __version__, build_parser, _LEVEL_BY_VERBOSITY
-from .conductor import SubmissionConductor
 from .const import *
 from .exceptions import JobSubmissionException, MisconfigurationException
-from .html_reports import HTMLReportBuilder
-from .project import Project, ProjectContext
+from .timings import TIMINGS, timed
+from .tracing import TRACER
+from .profiling import Profiler
+from .snapshot import cached_project
+from .throttle import SubmissionThrottle, throttle_settings
 from .utils import *
-from .looper_config import *
 
-from divvy import DEFAULT_COMPUTE_RESOURCES_NAME, select_divvy_config
 from logmuse import init_logger
-from peppy.const import *
-from eido import validate_sample, validate_config, inspect_project
 from ubiquerg.cli_tools import query_yes_no
 from ubiquerg.collection import uniqify
 
 
 _PKGNAME = "looper"
 _LOGGER = logging.getLogger(_PKGNAME)
+# Throttle settings with command-line options, named after the settings
+_THROTTLE_OPTS = [SUBMISSION_RATE_KEY, SUBMISSION_BURST_KEY, MAX_JOBS_KEY,
+                  SUBMISSION_RETRIES_KEY]
 
 class Executor(object):
     """ Base class that ensures the program's Sample counter starts.
@@ -127,6 +124,144 @@ class Checker(Executor):
                              len(files), "\n".join(files))
 
 
+class Status(Executor):
+    """ Status of the sample jobs, from the scheduler and the flag files """
+
+    def __call__(self, status_command=None):
+        """
+        Report the status of the latest job of every sample and pipeline.
+
+        The states of all the jobs in the submission journal are queried
+        from the scheduler with a single command. Jobs the scheduler doesn't
+        list anymore get the state of their newest flag file.
+
+        :param str status_command: command printing the ID and state of the
+            jobs in the scheduler; the '{job_ids}' placeholder is replaced
+            with the comma-separated job IDs. Without it only the flag
+            files are checked
+        :return dict[str, int]: number of jobs by status
+        """
+        from .eligibility import FLAG_EXT, FlagIndex
+        from .journal import SubmissionJournal, query_job_states
+        latest = SubmissionJournal(self.prj.submission_folder).latest()
+        states = None
+        job_ids = {job["job_id"] for job in latest.values() if job["job_id"]}
+        if status_command and job_ids:
+            states = query_job_states(status_command, sorted(job_ids))
+        flag_index = FlagIndex(self.prj.results_folder)
+        registry = self.prj.sample_registry
+        keys = [(piface.pipeline_name, registry.sample_names[i])
+                for i in range(registry.num_samples)
+                for piface in registry.sample_interfaces(i)]
+        keys.extend(sorted(k for k in latest if k[1] is None))
+        counts = defaultdict(int)
+        rows = []
+        for pipeline, sample in keys:
+            job = latest.get((pipeline, sample))
+            job_id = job and job["job_id"]
+            flags = [] if sample is None else \
+                flag_index.sample_flags(sample, pipeline)
+            if states and job_id in states:
+                status = states[job_id]
+            elif flags:
+                flag = max(flags, key=os.path.getmtime)
+                status = os.path.basename(flag)[len(pipeline) + 1:]\
+                    [:-len(FLAG_EXT)]
+            elif job is None:
+                status = "not submitted"
+            elif states is not None and job_id:
+                # neither listed by the scheduler nor flagged by the pipeline
+                status = "unknown"
+            else:
+                status = "submitted"
+            counts[status] += 1
+            rows.append((sample or self.prj.name, pipeline, status,
+                         job_id or ""))
+        widths = [max([len(r[i]) for r in rows] or [0]) for i in range(3)]
+        for row in rows:
+            _LOGGER.info("  ".join([v.ljust(w) for v, w in
+                                    zip(row, widths)] + [row[3]]).rstrip())
+        for status in sorted(counts):
+            _LOGGER.info("%s: %d", status.upper(), counts[status])
+        return dict(counts)
+
+
+class Resources(Executor):
+    """ Memory and time requests of the sample jobs, and their sources """
+
+    def __call__(self, explain=False):
+        """
+        Report the resources the sample job of every sample would request,
+        for the pipelines that derive them from the resource history or
+        predict them with a resource model.
+
+        :param bool explain: whether to report the fitted resource models
+            and the runs they are fitted on, too
+        :return dict[str, int]: number of jobs by source of the resources:
+            'project', 'history', 'model' or 'size table'
+        """
+        from peppy.const import CONFIG_KEY
+        from .resources import fit_resource_model, format_rows, \
+            input_schema, input_size, last_usage, usage_resources
+        registry = self.prj.sample_registry
+        samples = {s.sample_name: s for s in self.prj.samples}
+        project = self.prj[CONFIG_KEY]
+        # the project resources override all the others, as they do for the
+        # submission
+        overrides = project.get(LOOPER_KEY, {}).get(COMPUTE_KEY, {}).\
+            get(RESOURCES_KEY, {})
+        counts = defaultdict(int)
+        for interface_id, piface in enumerate(registry.interfaces):
+            compute = piface.get(COMPUTE_KEY, {})
+            history = compute.get(RESOURCE_HISTORY_KEY)
+            if history is None and RESOURCE_MODEL_KEY not in compute:
+                continue
+            # the input size and the last run of every sample are read once
+            names = registry.names(registry.sample_ids(interface_id))
+            schema = input_schema(piface)
+            sizes = {n: input_size(samples[n], schema) for n in names}
+            usages = {n: last_usage(os.path.join(self.prj.results_folder, n),
+                                    piface.pipeline_name) for n in names}
+            runs = [(n, sizes[n]) + usages[n] for n in names
+                    if usages[n] is not None]
+            model = fit_resource_model(self.prj, piface, runs=runs)
+            if explain and model is not None:
+                for line in model.explain():
+                    _LOGGER.info(line)
+            rows = [("sample", "input size (GB)", "cores", "mem (MB)", "time",
+                     "source")]
+            for name in names:
+                last = {} if history is None or usages[name] is None \
+                    else usage_resources(usages[name],
+                                         history.get(HEADROOM_KEY))
+                namespaces = {
+                    "project": project, "sample": samples[name],
+                    "looper": {RESULTS_SUBDIR_KEY: self.prj.results_folder}}
+                res = piface.choose_resource_package(
+                    namespaces, sizes[name], model, history=last)
+                if "mem" in overrides or "time" in overrides:
+                    source = "project"
+                elif last:
+                    source = "history"
+                elif model is not None:
+                    source = "model"
+                else:
+                    source = "size table"
+                counts[source] += 1
+                rows.append((name, "{:.6g}".format(sizes[name]),
+                             str(res.get("cores", "")),
+                             str(res.get("mem", "")), str(res.get("time", "")),
+                             source))
+            _LOGGER.info("Resources of the jobs of pipeline '{}':".
+                         format(piface.pipeline_name))
+            for line in format_rows(rows):
+                _LOGGER.info("  " + line)
+        if not counts:
+            _LOGGER.info("No pipeline derives the resources from the "
+                         "resource history or a resource model")
+        return dict(counts)
+
+
 class Cleaner(Executor):
     """ Remove all intermediate files (defined by pypiper clean scripts). """
 
@@ -222,14 +357,23 @@ class Collator(Executor):
         super(Executor, self).__init__()
         self.prj = prj
 
-    def __call__(self, args, **compute_kwargs):
+    def __call__(self, args, after=None, balancer=None, **compute_kwargs):
         """
         Matches collators by protocols, creates submission scripts
         and submits them
 
         :param argparse.Namespace args: parsed command-line options and
             arguments, recognized by looper
+        :param Iterable[(str, callable)] after: sample jobs the project jobs
+            depend on: the scheduler ID of each, None if not known, and a
+            check of whether it's finished
+        :param looper.balance.PackageBalancer balancer: balancer the sample
+            jobs were spread across the compute packages with; one is
+            created from the options if not given
         """
+        from jsonschema import ValidationError
+        from .conductor import SubmissionConductor
+        from .pipeline_interface import PipelineInterface
         jobs = 0
         project_pifaces = self.prj.project_pipeline_interface_sources
         if not project_pifaces:
@@ -239,6 +383,9 @@ class Collator(Executor):
                 "pipeline: "
                 "http://looper.databio.org/en/latest/defining-a-project")
         self.counter = LooperCounter(len(project_pifaces))
+        throttle = _submission_throttle(self.prj, args, compute_kwargs)
+        if balancer is None:
+            balancer = _package_balancer(self.prj, args, compute_kwargs)
         for project_piface in project_pifaces:
             try:
                 project_piface_object = \
@@ -252,7 +399,8 @@ class Collator(Executor):
             _LOGGER.info(self.counter.show(
                 name=self.prj.name, type="project",
                 pipeline_name=project_piface_object.pipeline_name))
-            conductor = SubmissionConductor(
+            # the pre-submission hook server is stopped on failures too
+            with SubmissionConductor(
                 pipeline_interface=project_piface_object,
                 prj=self.prj,
                 compute_variables=compute_kwargs,
@@ -260,19 +408,27 @@ class Collator(Executor):
                 extra_args=args.command_extra,
                 extra_args_override=args.command_extra_override,
                 ignore_flags=args.ignore_flags,
-                collate=True
-            )
-            conductor._pool = [None]
-            conductor.submit()
+                collate=True,
+                throttle=throttle,
+                dependencies=after,
+                balancer=balancer
+            ) as conductor:
+                conductor._pool = [None]
+                try:
+                    conductor.submit()
+                except JobSubmissionException as e:
+                    _LOGGER.error("Job submission failed: {}".format(e))
+                conductor.submit_requeued()
             jobs += conductor.num_job_submissions
         _LOGGER.info("\nLooper finished")
         _LOGGER.info("Jobs submitted: {}".format(jobs))
+        _log_submission_summary(throttle, balancer)
 
 
 class Runner(Executor):
     """ The true submitter of pipelines """
 
-    def __call__(self, args, rerun=False, **compute_kwargs):
+    def __call__(self, args, rerun=False, job_plan=None, **compute_kwargs):
         """
         Do the Sample submission.
 
@@ -282,114 +438,184 @@ class Runner(Executor):
             recognized by looper, germane to samples/pipelines
         :param bool rerun: whether the given sample is being rerun rather than
             run for the first time
+        :param looper.jobplan.JobPlan job_plan: plan to add the jobs to
+            instead of submitting them; with a shard set only the samples of
+            the shard are processed
         """
-        max_cmds = sum(list(map(len, self.prj._samples_by_interface.values())))
-        self.counter.total = max_cmds
-        failures = defaultdict(list)  # Collect problems by sample.
-        processed_samples = set()  # Enforce one-time processing.
-        submission_conductors = {}
+        from eido import validate_sample, validate_config
+        from .conductor import SubmissionConductor
+        from .eligibility import plan_submission
+        registry = self.prj.sample_registry
+        max_cmds = registry.num_assignments
+        failures = defaultdict(list)  # Collect problems by sample ID.
+        # Enforce one-time processing; flags indexed by sample ID.
+        processed_samples = bytearray(registry.num_samples)
         comp_vars = compute_kwargs or {}
-
-        # Determine number of samples eligible for processing.
-        num_samples = len(self.prj.samples)
-        if args.limit is None:
-            upper_sample_bound = num_samples
-        elif args.limit < 0:
-            raise ValueError("Invalid number of samples to run: {}".format(args.limit))
-        else:
-            upper_sample_bound = min(args.limit, num_samples)
+        self.submitted_jobs = []
+        self.balancer = None
+
+        # Determine the samples and pipelines eligible for processing.
+        samples = self.prj.samples
+        num_samples = len(samples)
+        with timed("plan"):
+            plan = plan_submission(self.prj, samples, limit=args.limit,
+                                   rerun=rerun, ignore_flags=args.ignore_flags)
         _LOGGER.debug("Limiting to {} of {} samples".
-                      format(upper_sample_bound, num_samples))
+                      format(len(plan), num_samples))
+        for sample_id, reason in plan.sample_reasons.items():
+            _LOGGER.warning(NOT_SUB_MSG.format(reason))
+            failures[sample_id].append(reason)
+        skipped = len(plan.skip_reasons)
+        if skipped:
+            _LOGGER.info("Skipping {} of {} sample-pipeline pairs; flags, "
+                         "toggle or rerun".format(skipped, max_cmds))
+            for (sample_id, interface_id), reason in \
+                    plan.skip_reasons.items():
+                _LOGGER.debug("> Skipping {} ({}): {}".format(
+                    registry.sample_names[sample_id],
+                    registry.interfaces[interface_id].pipeline_name, reason))
+        rows = plan.eligible.any(axis=1).nonzero()[0]
+        if job_plan is not None and job_plan.shard:
+            shard, num_shards = job_plan.shard
+            rows = rows[rows % num_shards == shard]
+        self.counter.total = int(plan.eligible[rows].sum())
 
         num_commands_possible = 0
         failed_submission_scripts = []
 
         # config validation (samples excluded) against all schemas defined
         # for every pipeline matched for this project
-        [validate_config(self.prj, schema_file, True)
-         for schema_file in self.prj.get_schemas(self.prj.pipeline_interfaces)]
-
-        for piface in self.prj.pipeline_interfaces:
-            conductor = SubmissionConductor(
-                pipeline_interface=piface,
-                prj=self.prj,
-                compute_variables=comp_vars,
-                delay=args.time_delay,
-                extra_args=args.command_extra,
-                extra_args_override=args.command_extra_override,
-                ignore_flags=args.ignore_flags,
-                max_cmds=args.lumpn,
-                max_size=args.lump
-            )
-            submission_conductors[piface.pipe_iface_file] = conductor
-
-        for sample in self.prj.samples[:upper_sample_bound]:
-            pl_fails = []
-            skip_reasons = []
-            sample_pifaces = self.prj.get_sample_piface(sample[SAMPLE_NAME_ATTR])
-            if not sample_pifaces:
-                skip_reasons.append("No pipeline interfaces defined")
-
-            if skip_reasons:
-                _LOGGER.warning(NOT_SUB_MSG.format(", ".join(skip_reasons)))
-                failures[sample.sample_name] = skip_reasons
-                continue
-
-            # single sample validation against a single schema
-            # (from sample's piface)
-            [validate_sample(self.prj, sample.sample_name, schema_file, True)
-             for schema_file in self.prj.get_schemas(sample_pifaces)]
-
-            processed_samples.add(sample[SAMPLE_NAME_ATTR])
-
-            for sample_piface in sample_pifaces:
-                _LOGGER.info(
-                    self.counter.show(name=sample.sample_name,
-                                      pipeline_name=sample_piface.pipeline_name)
-                )
-                num_commands_possible += 1
-                cndtr = submission_conductors[sample_piface.pipe_iface_file]
+        with timed("validate_config"):
+            [validate_config(self.prj, schema_file, True) for schema_file
+             in self.prj.get_schemas(self.prj.pipeline_interfaces)]
+
+        # Planned jobs are throttled when the plan is applied
+        throttle = None if job_plan is not None \
+            else _submission_throttle(self.prj, args, comp_vars)
+        if job_plan is None:
+            self.balancer = _package_balancer(self.prj, args, comp_vars)
+        # Conductors indexed by pipeline interface ID
+        submission_conductors = [SubmissionConductor(
+            pipeline_interface=piface,
+            prj=self.prj,
+            compute_variables=comp_vars,
+            delay=args.time_delay,
+            extra_args=args.command_extra,
+            extra_args_override=args.command_extra_override,
+            ignore_flags=args.ignore_flags,
+            max_cmds=args.lumpn,
+            max_size=args.lump,
+            job_plan=job_plan,
+            throttle=throttle,
+            balancer=self.balancer
+        ) for piface in registry.interfaces]
+        # the pre-submission hook servers are stopped on failures too
+        try:
+            # Upstream pipelines of a sample are submitted first
+            rank, upstream = _pipeline_stages(registry.interfaces)
+            for conductor, interface_ids in \
+                    zip(submission_conductors, upstream):
+                conductor.upstream = \
+                    [submission_conductors[i] for i in interface_ids]
+
+            # Only the eligible samples are validated and rendered
+            for row in rows:
+                sample = samples[row]
+                sample_id = int(plan.sample_ids[row])
+                interface_ids = sorted(plan.interface_ids(row),
+                                       key=rank.__getitem__)
+                sample_pifaces = \
+                    [registry.interfaces[i] for i in interface_ids]
+                pl_fails = []
+
+                # single sample validation against a single schema
+                # (from sample's piface)
+                with timed("validate_sample", sample=sample.sample_name):
+                    [validate_sample(self.prj, sample.sample_name, schema_file,
+                                     True)
+                     for schema_file in self.prj.get_schemas(sample_pifaces)]
+
+                processed_samples[sample_id] = 1
+
+                for interface_id, sample_piface in \
+                        zip(interface_ids, sample_pifaces):
+                    _LOGGER.info(
+                        self.counter.show(
+                            name=sample.sample_name,
+                            pipeline_name=sample_piface.pipeline_name)
+                    )
+                    num_commands_possible += 1
+                    cndtr = submission_conductors[interface_id]
+                    try:
+                        with timed("add_sample", sample=sample.sample_name,
+                                   pipeline=sample_piface.pipeline_name):
+                            curr_pl_fails = cndtr.add_sample(
+                                sample, rerun=rerun, eligible=True)
+                    except JobSubmissionException as e:
+                        failed_submission_scripts.append(e.script)
+                    else:
+                        pl_fails.extend(curr_pl_fails)
+                if pl_fails:
+                    failures[sample_id].extend(pl_fails)
+
+            job_sub_total = 0
+            cmd_sub_total = 0
+
+            for conductor in submission_conductors:
                 try:
-                    curr_pl_fails = cndtr.add_sample(sample, rerun=rerun)
+                    conductor.submit(force=True)
                 except JobSubmissionException as e:
                     failed_submission_scripts.append(e.script)
-                else:
-                    pl_fails.extend(curr_pl_fails)
-            if pl_fails:
-                failures[sample.sample_name].extend(pl_fails)
-
-        job_sub_total = 0
-        cmd_sub_total = 0
-
-        for piface, conductor in submission_conductors.items():
-            conductor.submit(force=True)
-            job_sub_total += conductor.num_job_submissions
-            cmd_sub_total += conductor.num_cmd_submissions
-            conductor.write_skipped_sample_scripts()
+            # Jobs waiting for their upstream jobs are submitted once the
+            # others are, the upstream ones first
+            for interface_id in sorted(range(len(submission_conductors)),
+                                       key=rank.__getitem__):
+                submission_conductors[interface_id].submit_deferred()
+            # Transiently failed submissions are retried once the others are
+            # done
+            for conductor in submission_conductors:
+                conductor.submit_requeued()
+                job_sub_total += conductor.num_job_submissions
+                cmd_sub_total += conductor.num_cmd_submissions
+                conductor.write_skipped_sample_scripts()
+                self.submitted_jobs.extend(conductor.submitted_jobs)
+        finally:
+            for conductor in submission_conductors:
+                conductor.close()
 
         # Report what went down.
         _LOGGER.info("\nLooper finished")
         _LOGGER.info("Samples valid for job generation: {} of {}".
-                     format(len(processed_samples), num_samples))
+                     format(processed_samples.count(1), num_samples))
         _LOGGER.info("Commands submitted: {} of {}".
                      format(cmd_sub_total, max_cmds))
-        _LOGGER.info("Jobs submitted: {}".format(job_sub_total))
+        if job_plan is not None:
+            _LOGGER.info("Jobs planned: {}".format(job_plan.num_jobs))
+        else:
+            _LOGGER.info("Jobs submitted: {}".format(job_sub_total))
         if args.dry_run:
             _LOGGER.info("Dry run. No jobs were actually submitted.")
+        elif throttle is not None:
+            _log_submission_summary(throttle, self.balancer)
 
         # Restructure sample/failure data for display.
         samples_by_reason = defaultdict(set)
-        # Collect names of failed sample(s) by failure reason.
-        for sample, failures in failures.items():
+        # Collect IDs of failed sample(s) by failure reason.
+        for sample_id, failures in failures.items():
             for f in failures:
-                samples_by_reason[f].add(sample)
+                samples_by_reason[f].add(sample_id)
         # Collect samples by pipeline with submission failure.
-        for piface, conductor in submission_conductors.items():
+        for conductor in submission_conductors:
             # Don't add failure key if there are no samples that failed for
             # that reason.
             if conductor.failed_samples:
-                fails = set(conductor.failed_samples)
+                fails = {registry.sample_id(n)
+                         for n in conductor.failed_samples}
                 samples_by_reason[SUBMISSION_FAILURE_MESSAGE] |= fails
+        # Translate back to names, in the project order
+        samples_by_reason = {
+            reason: registry.names(sorted(ids))
+            for reason, ids in samples_by_reason.items()}
 
         failed_sub_samples = samples_by_reason.get(SUBMISSION_FAILURE_MESSAGE)
         if failed_sub_samples:
@@ -412,14 +638,16 @@ class Runner(Executor):
 class Report(Executor):
     """ Combine project outputs into a browsable HTML report """
     def __call__(self, args):
+        from .html_reports import HTMLReportBuilder
         # initialize the report builder
         report_builder = HTMLReportBuilder(self.prj)
 
         # Do the stats and object summarization.
         table = Table(self.prj)()
         # run the report builder. a set of HTML pages is produced
-        report_path = report_builder(table.objs, table.stats,
-                                     uniqify(table.columns))
+        with timed("report.build"):
+            report_path = report_builder(table.objs, table.stats,
+                                         uniqify(table.columns))
 
         _LOGGER.info("HTML Report (n=" + str(len(table.stats)) + "): "
                      + report_path)
@@ -435,8 +663,11 @@ class Table(Executor):
     def __call__(self):
         # pull together all the fits and stats from each sample into
         # project-combined spreadsheets.
-        self.stats, self.columns = _create_stats_summary(self.prj, self.counter)
-        self.objs = _create_obj_summary(self.prj, self.counter)
+        with timed("table.stats"):
+            self.stats, self.columns = \
+                _create_stats_summary(self.prj, self.counter)
+        with timed("table.objects"):
+            self.objs = _create_obj_summary(self.prj, self.counter)
         return self
 
 
@@ -448,6 +679,7 @@ def _create_stats_summary(project, counter):
     :param looper.Project project: the project to be summarized
     :param looper.LooperCounter counter: a counter object
     """
+    import pandas as _pd
     # Create stats_summary file
     columns = []
     stats = []
@@ -500,6 +732,7 @@ def _create_obj_summary(project, counter):
     :param looper.LooperCounter counter: a counter object
     :return pandas.DataFrame: objects spreadsheet
     """
+    import pandas as _pd
     _LOGGER.info("Creating objects summary...")
     objs = _pd.DataFrame()
     # Create objects summary file
@@ -531,6 +764,7 @@ def _create_obj_summary(project, counter):
 
 def _create_failure_message(reason, samples):
     """ Explain lack of submission for a single reason, 1 or more samples. """
+    from colorama import Fore, Style
     color = Fore.LIGHTRED_EX
     reason_text = color + reason + Style.RESET_ALL
     samples_text = ", ".join(samples)
@@ -597,7 +831,7 @@ class LooperCounter(object):
         self.count += 1
         return _submission_status_text(type=type,
             curr=self.count, total=self.total, name=name,
-            pipeline_name=pipeline_name, color=Fore.CYAN
+            pipeline_name=pipeline_name
         )
 
     def reset(self):
@@ -608,9 +842,10 @@ class LooperCounter(object):
 
 
 def _submission_status_text(curr, total, name, pipeline_name=None,
-                            type="sample", color=Fore.CYAN):
+                            type="sample", color=None):
     """ Generate submission sample text for run or collate """
-    txt = color + "## [{n} of {t}] {type}: {name}".\
+    from colorama import Fore, Style
+    txt = (color or Fore.CYAN) + "## [{n} of {t}] {type}: {name}".\
         format(n=curr, t=total, type=type, name=name)
     if pipeline_name:
         txt += "; pipeline: {}".format(pipeline_name)
@@ -631,6 +866,7 @@ def _proc_resources_spec(args):
     :raise ValueError: if interpretation of the given specification as encoding
         of key-value pairs fails
     """
+    import yaml
     spec = getattr(args, "compute", None)
     try:
         settings_data = read_yaml_file(args.settings) or {}
@@ -656,6 +892,207 @@ def _proc_resources_spec(args):
     return settings_data
 
 
+def _throttle_settings(prj, args, compute_kwargs=None):
+    """
+    Determine the submission throttle settings: the ones of the active
+    compute package, overridden by the compute settings and the throttle
+    options from the command line.
+
+    :param Project prj: project with the compute configuration
+    :param argparse.Namespace args: parsed command-line options and arguments
+    :param Mapping compute_kwargs: compute settings from the command line
+    :return dict: throttle settings
+    """
+    dcc = getattr(prj, "dcc", None)
+    settings = throttle_settings(dcc.compute) \
+        if dcc is not None and dcc.compute is not None else {}
+    settings.update(_throttle_overrides(args, compute_kwargs))
+    return settings
+
+
+def _throttle_overrides(args, compute_kwargs=None):
+    """
+    Determine the submission throttle settings from the command line: the
+    compute settings and the throttle options.
+
+    :param argparse.Namespace args: parsed command-line options and arguments
+    :param Mapping compute_kwargs: compute settings from the command line
+    :return dict: throttle settings overriding the compute package ones
+    """
+    settings = throttle_settings(compute_kwargs or {})
+    for key in _THROTTLE_OPTS:
+        if getattr(args, key, None) is not None:
+            settings[key] = getattr(args, key)
+    return settings
+
+
+def _compute_setting(prj, key, compute_kwargs=None):
+    """
+    Get a setting of the active compute package, possibly overridden by the
+    compute settings from the command line.
+
+    :param Project prj: project with the compute configuration
+    :param str key: name of the setting
+    :param Mapping compute_kwargs: compute settings from the command line
+    :return object: value of the setting, None if not set
+    """
+    if compute_kwargs and compute_kwargs.get(key):
+        return compute_kwargs[key]
+    dcc = getattr(prj, "dcc", None)
+    if dcc is None or dcc.compute is None:
+        return None
+    return dcc.compute.get(key)
+
+
+def _pipeline_stages(interfaces):
+    """
+    Order the sample pipelines by their dependencies.
+
+    :param Sequence[looper.PipelineInterface] interfaces: sample pipeline
+        interfaces, by ID
+    :return (list[int], list[list[int]]): rank of each interface, with the
+        upstream ones first, and IDs of the interfaces each one depends on
+    :raise MisconfigurationException: if the dependencies form a cycle
+    """
+    ids_by_name = defaultdict(list)
+    for interface_id, piface in enumerate(interfaces):
+        ids_by_name[piface.pipeline_name].append(interface_id)
+    upstream = []
+    for piface in interfaces:
+        names = piface.get(DEPENDS_ON_KEY) or []
+        ids = []
+        for name in [names] if isinstance(names, str) else names:
+            if name not in ids_by_name:
+                _LOGGER.warning("Unknown pipeline '{}' that '{}' depends on".
+                                format(name, piface.pipeline_name))
+                continue
+            ids.extend(ids_by_name[name])
+        upstream.append(ids)
+    order = []
+    # 1: dependencies being visited; 2: visited
+    visited = [0] * len(interfaces)
+
+    def _visit(interface_id):
+        if visited[interface_id] == 1:
+            raise MisconfigurationException(
+                "Pipeline dependency cycle involving '{}'".
+                format(interfaces[interface_id].pipeline_name))
+        if visited[interface_id] == 0:
+            visited[interface_id] = 1
+            for i in upstream[interface_id]:
+                _visit(i)
+            visited[interface_id] = 2
+            order.append(interface_id)
+
+    for interface_id in range(len(interfaces)):
+        _visit(interface_id)
+    rank = [0] * len(interfaces)
+    for r, interface_id in enumerate(order):
+        rank[interface_id] = r
+    return rank, upstream
+
+
+def _submission_throttle(prj, args, compute_kwargs=None):
+    """
+    Create the submission throttle shared by the conductors of a run.
+
+    :param Project prj: project with the compute configuration
+    :param argparse.Namespace args: parsed command-line options and arguments
+    :param Mapping compute_kwargs: compute settings from the command line
+    :return looper.throttle.SubmissionThrottle: the throttle
+    :raise MisconfigurationException: if the throttle settings are invalid
+    """
+    try:
+        return SubmissionThrottle.from_settings(
+            _throttle_settings(prj, args, compute_kwargs))
+    except ValueError as e:
+        raise MisconfigurationException(str(e))
+
+
+def _package_balancer(prj, args, compute_kwargs=None):
+    """
+    Create the balancer spreading the jobs of a run across the compute
+    packages listed on the command line.
+
+    :param Project prj: project with the compute configuration
+    :param argparse.Namespace args: parsed command-line options and arguments
+    :param Mapping compute_kwargs: compute settings from the command line
+    :return looper.balance.PackageBalancer | NoneType: the balancer, None if
+        no compute packages are listed
+    :raise MisconfigurationException: if the packages or the policy are
+        invalid
+    """
+    weights = getattr(args, "compute_packages", None)
+    if not weights:
+        return None
+    from .balance import PackageBalancer
+    if getattr(prj, "dcc", None) is None:
+        raise MisconfigurationException(
+            "Compute packages can't be balanced with no divvy configuration")
+    try:
+        return PackageBalancer(prj.dcc, weights,
+                               policy=getattr(args, "compute_policy", None),
+                               overrides=_throttle_overrides(args,
+                                                             compute_kwargs))
+    except ValueError as e:
+        raise MisconfigurationException(str(e))
+
+
+def _log_submission_summary(throttle, balancer=None):
+    """
+    Log the tallies of the retried and failed submissions of a run, and of
+    the jobs of every compute package if they were balanced.
+
+    :param looper.throttle.SubmissionThrottle throttle: throttle of the run
+    :param looper.balance.PackageBalancer balancer: balancer of the run
+    """
+    if balancer is not None:
+        for line in balancer.summary():
+            _LOGGER.info(line)
+    elif throttle.retry.summary():
+        _LOGGER.info(throttle.retry.summary())
+
+
+def _report_timings(args):
+    """
+    Log the summary of the execution phase timings and write it to a file,
+    if requested.
+
+    :param argparse.Namespace args: parsed command-line options and arguments
+    """
+    _LOGGER.info("\nTimings:\n{}".format(TIMINGS.report()))
+    if getattr(args, "timings", None):
+        TIMINGS.write(args.timings)
+
+
+def _init_loggers(args):
+    """
+    Establish the loggers of looper and the libraries it uses.
+
+    :param argparse.Namespace args: parsed command-line options and arguments
+    :return logging.Logger: looper logger
+    """
+    # Set the logging level.
+    if args.dbg:
+        # Debug mode takes precedence and will listen for all messages.
+        level = args.logging_level or logging.DEBUG
+    elif args.verbosity is not None:
+        # Verbosity-framed specification trumps logging_level.
+        level = _LEVEL_BY_VERBOSITY[args.verbosity]
+    else:
+        # Normally, we're not in debug mode, and there's not verbosity.
+        level = LOGGING_LEVEL
+
+    # Establish the project-root logger and attach one for this module.
+    logger_kwargs = {"level": level,
+                     "logfile": args.logfile,
+                     "devmode": args.dbg}
+    init_logger(name="peppy", **logger_kwargs)
+    init_logger(name="divvy", **logger_kwargs)
+    init_logger(name="eido", **logger_kwargs)
+    return init_logger(name=_PKGNAME, **logger_kwargs)
+
+
 def main():
     """ Primary workflow """
     global _LOGGER
@@ -667,6 +1104,23 @@ def main():
     if args.command is None:
         parser.print_help(sys.stderr)
         sys.exit(1)
+    if args.command == "apply":
+        # Plans are submitted as they are, with no project
+        from .jobplan import apply_plans
+        _LOGGER = _init_loggers(args)
+        _LOGGER.info("Looper version: {}\nCommand: {}".
+                     format(__version__, args.command))
+        try:
+            failed = apply_plans(
+                args.plan_files, dry_run=args.dry_run, delay=args.time_delay,
+                throttle_overrides={
+                    k: getattr(args, k) for k in _THROTTLE_OPTS
+                    if getattr(args, k) is not None})
+        except ValueError as e:
+            _LOGGER.error(str(e))
+            sys.exit(1)
+        _report_timings(args)
+        sys.exit(int(failed > 0))
     if args.config_file is None:
         m = "No project config defined"
         try:
@@ -680,27 +1134,16 @@ def main():
                   format(read_cfg_from_dotfile(), dotfile_path()))
     if args.command == "init":
         sys.exit(int(not init_dotfile(dotfile_path(), args.config_file, args.force)))
-    args = enrich_args_via_cfg(args, aux_parser)
+    # The config is read once, for the CLI defaults and for the Project
+    with timed("config", config=args.config_file):
+        prj_cfg = read_project_config(args.config_file, args.amend) \
+            if os.path.exists(args.config_file) else None
+    args = enrich_args_via_cfg(args, aux_parser, prj_cfg)
 
-    # Set the logging level.
-    if args.dbg:
-        # Debug mode takes precedence and will listen for all messages.
-        level = args.logging_level or logging.DEBUG
-    elif args.verbosity is not None:
-        # Verbosity-framed specification trumps logging_level.
-        level = _LEVEL_BY_VERBOSITY[args.verbosity]
-    else:
-        # Normally, we're not in debug mode, and there's not verbosity.
-        level = LOGGING_LEVEL
+    from colorama import init
+    init()
 
-    # Establish the project-root logger and attach one for this module.
-    logger_kwargs = {"level": level,
-                     "logfile": args.logfile,
-                     "devmode": args.dbg}
-    init_logger(name="peppy", **logger_kwargs)
-    init_logger(name="divvy", **logger_kwargs)
-    init_logger(name="eido", **logger_kwargs)
-    _LOGGER = init_logger(name=_PKGNAME, **logger_kwargs)
+    _LOGGER = _init_loggers(args)
 
     # lc = LooperConfig(select_looper_config(filename=args.looper_config))
     # _LOGGER.debug("Determined genome config: {}".format(lc))
@@ -712,62 +1155,119 @@ def main():
         _LOGGER.warning("Unrecognized arguments: {}".
                       format(" ".join([str(x) for x in remaining_args])))
 
-    divcfg = select_divvy_config(filepath=args.divvy) \
-        if hasattr(args, "divvy") else None
-
-    # Initialize project
-    _LOGGER.debug("Building Project")
+    trace = getattr(args, "trace", None)
+    if trace:
+        TRACER.enable()
+    profiler = Profiler(mode=getattr(args, "profile", None),
+                        prefix=os.path.abspath("looper_" + args.command))
+    profiler.start()
     try:
-        p = Project(config_file=args.config_file,
-                    amendments=args.amend,
-                    divcfg_path=divcfg,
-                    runp=args.command == "runp",
-                    **{attr: getattr(args, attr) for attr in CLI_PROJ_ATTRS if attr in args})
-    except yaml.parser.ParserError as e:
-        _LOGGER.error("Project config parse failed -- {}".format(e))
-        sys.exit(1)
+        import yaml
+        from divvy import DEFAULT_COMPUTE_RESOURCES_NAME, select_divvy_config
+        from .project import Project, ProjectContext
+        divcfg = select_divvy_config(filepath=args.divvy) \
+            if hasattr(args, "divvy") else None
+
+        # Initialize project
+        _LOGGER.debug("Building Project")
+        try:
+            prj_kwargs = dict(config_file=args.config_file,
+                              amendments=args.amend,
+                              runp=args.command == "runp",
+                              project_config=prj_cfg,
+                              **{attr: getattr(args, attr)
+                                 for attr in CLI_PROJ_ATTRS if attr in args})
+            with timed("project", config=args.config_file):
+                if getattr(args, "project_cache", None):
+                    p = cached_project(args.project_cache,
+                                       divcfg_path=divcfg, **prj_kwargs)
+                else:
+                    p = Project(divcfg_path=divcfg, **prj_kwargs)
+        except yaml.parser.ParserError as e:
+            _LOGGER.error("Project config parse failed -- {}".format(e))
+            sys.exit(1)
+        profiler.checkpoint("project")
 
-    selected_compute_pkg = p.selected_compute_package \
-                           or DEFAULT_COMPUTE_RESOURCES_NAME
-    if p.dcc is not None and not p.dcc.activate_package(selected_compute_pkg):
-        _LOGGER.info("Failed to activate '{}' computing package. "
-                     "Using the default one".format(selected_compute_pkg))
+        selected_compute_pkg = p.selected_compute_package \
+                               or DEFAULT_COMPUTE_RESOURCES_NAME
+        if p.dcc is not None and not p.dcc.activate_package(selected_compute_pkg):
+            _LOGGER.info("Failed to activate '{}' computing package. "
+                         "Using the default one".format(selected_compute_pkg))
 
-    with ProjectContext(prj=p,
-                        selector_attribute=args.sel_attr,
-                        selector_include=args.sel_incl,
-                        selector_exclude=args.sel_excl) as prj:
+        with ProjectContext(prj=p,
+                            selector_attribute=args.sel_attr,
+                            selector_include=args.sel_incl,
+                            selector_exclude=args.sel_excl) as prj:
 
-        if args.command in ["run", "rerun"]:
-            run = Runner(prj)
-            try:
+            if args.command in ["run", "rerun"]:
+                run = Runner(prj)
+                try:
+                    compute_kwargs = _proc_resources_spec(args)
+                    run(args, rerun=(args.command == "rerun"), **compute_kwargs)
+                    if args.collate:
+                        Collator(prj)(args, after=run.submitted_jobs,
+                                      balancer=run.balancer, **compute_kwargs)
+                except IOError:
+                    _LOGGER.error("{} pipeline_interfaces: '{}'".
+                                  format(prj.__class__.__name__,
+                                         prj.pipeline_interface_sources))
+                    raise
+
+            if args.command == "plan":
+                from .jobplan import JobPlan, plan_path
+                compute_kwargs = _proc_resources_spec(args)
+                path = args.plan_file or \
+                    plan_path(prj.submission_folder, args.shard)
+                with JobPlan(path, config_file=args.config_file,
+                             shard=args.shard,
+                             throttle=_throttle_settings(
+                                 prj, args, compute_kwargs),
+                             job_id_pattern=_compute_setting(
+                                 prj, JOB_ID_PATTERN_KEY, compute_kwargs)
+                             ) as job_plan:
+                    Runner(prj)(args, rerun=args.rerun, job_plan=job_plan,
+                                **compute_kwargs)
+
+            if args.command == "runp":
+                compute_kwargs = _proc_resources_spec(args)
+                collate = Collator(prj)
+                collate(args, **compute_kwargs)
+
+            if args.command in ["run", "rerun", "plan", "runp"]:
+                profiler.checkpoint("submission")
+                _report_timings(args)
+
+            if args.command == "destroy":
+                return Destroyer(prj)(args)
+
+            if args.command == "table":
+                Table(prj)()
+                profiler.checkpoint("table")
+                _report_timings(args)
+
+            if args.command == "report":
+                Report(prj)(args)
+                profiler.checkpoint("report")
+                _report_timings(args)
+
+            if args.command == "check":
+                Checker(prj)(flags=args.flags)
+
+            if args.command == "status":
                 compute_kwargs = _proc_resources_spec(args)
-                run(args, rerun=(args.command == "rerun"), **compute_kwargs)
-            except IOError:
-                _LOGGER.error("{} pipeline_interfaces: '{}'".
-                              format(prj.__class__.__name__,
-                                     prj.pipeline_interface_sources))
-                raise
-
-        if args.command == "runp":
-            compute_kwargs = _proc_resources_spec(args)
-            collate = Collator(prj)
-            collate(args, **compute_kwargs)
-
-        if args.command == "destroy":
-            return Destroyer(prj)(args)
-
-        if args.command == "table":
-            Table(prj)()
-        
-        if args.command == "report":
-            Report(prj)(args)
-
-        if args.command == "check":
-            Checker(prj)(flags=args.flags)
-
-        if args.command == "clean":
-            return Cleaner(prj)(args)
-
-        if args.command == "inspect":
-            inspect_project(p, args.snames, args.attr_limit)
+                Status(prj)(status_command=_compute_setting(
+                    prj, JOB_STATUS_COMMAND_KEY, compute_kwargs))
+
+            if args.command == "resources":
+                Resources(prj)(explain=args.explain)
+
+            if args.command == "clean":
+                return Cleaner(prj)(args)
+
+            if args.command == "inspect":
+                from eido import inspect_project
+                inspect_project(p, args.snames, args.attr_limit)
+    finally:
+        profiler.stop()
+        if trace:
+            TRACER.write(trace)
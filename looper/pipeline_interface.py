@@ -2,7 +2,6 @@
 
 import os
 import jsonschema
-import pandas as pd
 
 from collections import Mapping
 from logging import getLogger
@@ -92,13 +91,20 @@ class PipelineInterface(PXAM):
                     os.path.dirname(self.pipe_iface_file), schema_source)
         return schema_source
 
-    def choose_resource_package(self, namespaces, file_size):
+    def choose_resource_package(self, namespaces, file_size, model=None,
+                                history=None):
         """
         Select resource bundle for given input file size to given pipeline.
 
         :param float file_size: Size of input data (in gigabytes).
         :param Mapping[Mapping[str]] namespaces: namespaced variables to pass
             as a context for fluid attributes command rendering
+        :param looper.resources.ResourceModel model: model of the pipeline
+            predicting the memory and time of the sample jobs from the input
+            size, overriding the size dependent variables
+        :param Mapping history: memory and time derived from the last run of
+            the sample, if already known; by default, read from its profile
+            if the pipeline uses the resource history
         :return MutableMapping: resource bundle appropriate for given pipeline,
             for given input file size
         :raises ValueError: if indicated file size is negative, or if the
@@ -189,6 +195,7 @@ class PipelineInterface(PXAM):
                     resources_tsv_path = os.path.join(
                         os.path.dirname(piface.pipe_iface_file),
                         resources_tsv_path)
+                import pandas as pd
                 df = pd.read_csv(resources_tsv_path, sep='\t', header=0).\
                     fillna(float("inf"))
                 df[ID_COLNAME] = df.index
@@ -238,6 +245,13 @@ class PipelineInterface(PXAM):
 
         if COMPUTE_KEY in self:
             resources_data.update(self[COMPUTE_KEY])
+        if model is not None and namespaces.get("sample"):
+            predicted = model.resources(file_size)
+            _LOGGER.debug("Resources predicted for input size {}Gb: {}".
+                          format(file_size, predicted))
+            resources_data.update(predicted)
+        resources_data.update(self._history_resources(namespaces)
+                              if history is None else history)
         project = namespaces["project"]
         if LOOPER_KEY in project and COMPUTE_KEY in project[LOOPER_KEY] \
                 and RESOURCES_KEY in project[LOOPER_KEY][COMPUTE_KEY]:
@@ -246,6 +260,34 @@ class PipelineInterface(PXAM):
                 update(project[LOOPER_KEY][COMPUTE_KEY][RESOURCES_KEY])
         return resources_data
 
+    def _history_resources(self, namespaces):
+        """
+        Derive the memory and time of a sample job from the profile of the
+        last successful run of the sample, if the pipeline opts in.
+
+        :param Mapping[Mapping[str]] namespaces: namespaced variables of the
+            job
+        :return Mapping: memory and time to request; empty if the pipeline
+            doesn't use the resource history, the job is a project job or
+            the sample has no successful run
+        """
+        history = self.get(COMPUTE_KEY, {}).get(RESOURCE_HISTORY_KEY)
+        sample = namespaces.get("sample")
+        if history is None or not sample:
+            return {}
+        from .resources import history_resources
+        resources = history_resources(
+            os.path.join(namespaces["looper"][RESULTS_SUBDIR_KEY],
+                         sample.sample_name),
+            self.pipeline_name, history.get(HEADROOM_KEY))
+        if resources is None:
+            _LOGGER.debug("No successful run of sample '{}' to derive the "
+                          "resources from".format(sample.sample_name))
+            return {}
+        _LOGGER.debug("Resources derived from the last run of sample '{}': "
+                      "{}".format(sample.sample_name, resources))
+        return resources
+
     def _expand_paths(self, keys):
         """
         Expand paths defined in the pipeline interface file
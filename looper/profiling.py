@@ -0,0 +1,150 @@
+""" CPU and memory profiling of looper subcommands """
+
+import logging
+import os
+
+__all__ = ["Profiler", "PROFILE_MODES"]
+
+_LOGGER = logging.getLogger(__name__)
+
+PROFILE_MODES = ["cpu", "mem"]
+
+
+class Profiler(object):
+    """
+    Profile the execution of a looper subcommand.
+
+    In 'cpu' mode the execution is run under cProfile; the statistics are
+    saved to a '.pstats' file and to a collapsed-stack text file that can be
+    fed directly to flamegraph tools (e.g. flamegraph.pl or speedscope).
+    In 'mem' mode tracemalloc snapshots are taken at the checkpoints and the
+    top allocation sites are reported. With no mode all methods are no-ops.
+    """
+    def __init__(self, mode=None, prefix="looper", top=15):
+        """
+        :param str mode: profiling mode, one of PROFILE_MODES; None to disable
+        :param str prefix: path prefix of the output files
+        :param int top: number of allocation sites to report in 'mem' mode
+        """
+        if mode is not None and mode not in PROFILE_MODES:
+            raise ValueError("Invalid profiling mode '{}'; choose from: {}".
+                             format(mode, ", ".join(PROFILE_MODES)))
+        self.mode = mode
+        self.prefix = prefix
+        self.top = top
+        self._profile = None
+        self._mem_reports = []
+
+    def start(self):
+        """ Start profiling """
+        if self.mode == "cpu":
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif self.mode == "mem":
+            import tracemalloc
+            tracemalloc.start()
+
+    def checkpoint(self, label):
+        """
+        Mark a phase boundary.
+
+        In 'mem' mode a snapshot is taken and its top allocation sites are
+        logged and recorded for the report file.
+
+        :param str label: name of the phase that has just ended
+        """
+        if self.mode != "mem":
+            return
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = ["after {}: current {:.1f} MiB, peak {:.1f} MiB".format(
+            label, current / 2 ** 20, peak / 2 ** 20)]
+        for stat in snapshot.statistics("lineno")[:self.top]:
+            frame = stat.traceback[0]
+            lines.append("  {:>10.1f} KiB {:>9} blocks  {}:{}".format(
+                stat.size / 2 ** 10, stat.count, frame.filename, frame.lineno))
+        report = "\n".join(lines)
+        _LOGGER.info("Top allocation sites {}".format(report))
+        self._mem_reports.append(report)
+
+    def stop(self):
+        """
+        Stop profiling and write the results.
+
+        :return list[str]: paths to the written files
+        """
+        if self.mode == "cpu" and self._profile is not None:
+            self._profile.disable()
+            pstats_path = self.prefix + ".pstats"
+            self._profile.dump_stats(pstats_path)
+            collapsed_path = self.prefix + ".collapsed"
+            write_collapsed_stacks(pstats_path, collapsed_path)
+            self._profile = None
+            paths = [pstats_path, collapsed_path]
+        elif self.mode == "mem" and self._mem_reports:
+            import tracemalloc
+            tracemalloc.stop()
+            paths = [self.prefix + "_mem.txt"]
+            with open(paths[0], "w") as f:
+                f.write("\n\n".join(self._mem_reports) + "\n")
+            self._mem_reports = []
+        else:
+            return []
+        _LOGGER.info("Profile written to: {}".format(", ".join(paths)))
+        return paths
+
+
+def write_collapsed_stacks(pstats_path, collapsed_path, min_us=1):
+    """
+    Convert cProfile statistics to the collapsed-stack format.
+
+    cProfile records caller-callee pairs rather than full stacks, so the
+    stacks are reconstructed by walking the call graph from the entry points
+    and splitting the time of every function among its callers
+    proportionally to the time it spent in each of them. Recursive calls are
+    cut at the first repetition.
+
+    :param str pstats_path: path to the cProfile statistics file
+    :param str collapsed_path: path to the output file, with one
+        'frame1;frame2;... microseconds' line per stack
+    :param int min_us: stacks with less self time are omitted
+    """
+    import pstats
+    stats = pstats.Stats(pstats_path).stats
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, (_, _, _, _, callers) in stats.items()
+             if not callers]
+    totals = {}
+
+    def _label(func):
+        filename, line, name = func
+        return "{}:{}:{}".format(os.path.basename(filename), line, name)
+
+    def _walk(func, stack, scale):
+        stack = stack + [_label(func)]
+        key = ";".join(stack)
+        totals[key] = totals.get(key, 0) + stats[func][2] * scale
+        for callee, edge_time in callees.get(func, []):
+            callee_total = stats[callee][3]
+            if callee_total <= 0 or _label(callee) in stack:
+                continue
+            callee_scale = edge_time * scale / callee_total
+            if callee_total * callee_scale * 1e6 >= min_us:
+                _walk(callee, stack, callee_scale)
+
+    for root in roots:
+        _walk(root, [], 1.0)
+    with open(collapsed_path, "w") as f:
+        for key, seconds in totals.items():
+            us = int(round(seconds * 1e6))
+            if us >= min_us:
+                f.write("{} {}\n".format(key, us))
@@ -9,6 +9,7 @@ from logging import getLogger
 
 from peppy import SAMPLE_NAME_ATTR, OUTDIR_KEY, CONFIG_KEY, \
     Project as peppyProject
+from peppy.const import ACTIVE_AMENDMENTS_KEY, CONFIG_FILE_KEY
 from eido import read_schema, PathAttrNotFoundError
 from divvy import ComputingConfiguration
 from ubiquerg import is_command_callable, expandpath
@@ -18,6 +19,8 @@ from .const import *
 from .exceptions import *
 from .utils import *
 from .pipeline_interface import PipelineInterface
+from .registry import SampleRegistry
+from .sample_columns import SampleColumns
 
 __all__ = ["Project"]
 
@@ -43,10 +46,14 @@ class ProjectContext(object):
         """ Samples are context-specific; other requests are handled
         locally or dispatched to Project. """
         if item == "samples":
-            return fetch_samples(prj=self.prj,
-                                 selector_attribute=self.attribute,
-                                 selector_include=self.include,
-                                 selector_exclude=self.exclude)
+            # The selection is made once per context; a copy is returned
+            # so that the callers can't alter it
+            if "_samples" not in self.__dict__:
+                self.__dict__["_samples"] = fetch_samples(
+                    prj=self.prj, selector_attribute=self.attribute,
+                    selector_include=self.include,
+                    selector_exclude=self.exclude)
+            return list(self.__dict__["_samples"])
         if item in ["prj", "include", "exclude"]:
             # Attributes requests that this context/wrapper handles
             return self.__dict__[item]
@@ -84,18 +91,22 @@ class Project(peppyProject):
         a sample input file(s) do not exist or cannot be open.
     :param str compute_env_file: Environment configuration YAML file specifying
         compute settings.
+    :param peppy.Project project_config: project with the config parsed
+        beforehand, e.g. with looper.utils.read_project_config; used instead
+        of reading the config file again if it was parsed from the same file
+        with the same amendments
     """
     def __init__(self, config_file, amendments=None, divcfg_path=None,
-                 runp=False, **kwargs):
+                 runp=False, project_config=None, **kwargs):
+        # Kept out of the mapping; consumed by parse_config_file
+        self.__dict__["_project_config"] = project_config
         super(Project, self).__init__(config_file, amendments=amendments)
         setattr(self, EXTRA_KEY, dict())
         for attr_name in CLI_PROJ_ATTRS:
             if attr_name in kwargs:
                 setattr(self[EXTRA_KEY], attr_name, kwargs[attr_name])
         if not runp:
-            self._samples_by_interface = \
-                self._samples_by_piface(self.piface_key)
-            self._interfaces_by_sample = self._piface_by_samples()
+            self._registry = self._build_registry(self.piface_key)
         if FILE_CHECKS_KEY in self[EXTRA_KEY]:
             setattr(self, "file_checks", not self[EXTRA_KEY][FILE_CHECKS_KEY])
         if DRY_RUN_KEY in self[EXTRA_KEY]:
@@ -106,6 +117,28 @@ class Project(peppyProject):
             _LOGGER.debug("Ensuring project directories exist")
             self.make_project_dirs()
 
+    def parse_config_file(self, cfg_path, amendments=None):
+        """
+        Parse provided yaml config file, or take the config from the project
+        config parsed beforehand, if it matches the file and the amendments.
+
+        :param str cfg_path: path to the config file to read and parse
+        :param Iterable[str] amendments: Name of amendments to activate
+        """
+        parsed = self.__dict__.pop("_project_config", None)
+        amendments = [amendments] if isinstance(amendments, str) \
+            else amendments
+        if parsed is None or parsed[CONFIG_FILE_KEY] != cfg_path or \
+                list(parsed.get(ACTIVE_AMENDMENTS_KEY) or []) != \
+                list(amendments or []):
+            return super(Project, self).parse_config_file(
+                cfg_path, amendments=amendments)
+        _LOGGER.debug("Using the config parsed beforehand: {}".
+                      format(cfg_path))
+        self[CONFIG_KEY] = parsed[CONFIG_KEY]
+        if ACTIVE_AMENDMENTS_KEY in parsed:
+            self[ACTIVE_AMENDMENTS_KEY] = parsed[ACTIVE_AMENDMENTS_KEY]
+
     @property
     def piface_key(self):
         """
@@ -125,6 +158,21 @@ class Project(peppyProject):
         """
         return self._extra_cli_or_cfg(TOGGLE_KEY_SELECTOR) or SAMPLE_TOGGLE_ATTR
 
+    @property
+    def sample_columns(self):
+        """
+        Columnar view of the sample attributes, used for sample selection
+        and toggling; rebuilt when the project samples are recreated
+
+        :return looper.sample_columns.SampleColumns: view of the samples
+        """
+        samples = self.samples
+        columns = self.__dict__.get("_sample_columns")
+        if columns is None or columns.samples is not samples:
+            columns = SampleColumns(samples)
+            self.__dict__["_sample_columns"] = columns
+        return columns
+
     @property
     def selected_compute_package(self):
         """
@@ -264,9 +312,10 @@ class Project(peppyProject):
         result (ones that exist on disk/remotely and validate successfully
         against the schema)
 
-        :return list[looper.PipelineInterface]: list of pipeline interfaces
+        :return list[looper.PipelineInterface]: list of pipeline interfaces,
+            one per source
         """
-        return [i for s in self._interfaces_by_sample.values() for i in s]
+        return list(self._registry.interfaces)
 
     @property
     def pipeline_interface_sources(self):
@@ -276,7 +325,17 @@ class Project(peppyProject):
 
         :return list[str]: collection of valid pipeline interface sources
         """
-        return self._samples_by_interface.keys()
+        return list(self._registry.sources)
+
+    @property
+    def sample_registry(self):
+        """
+        Integer IDs of the samples and pipeline interfaces, with the
+        assignment of the interfaces to the samples
+
+        :return looper.registry.SampleRegistry: the registry
+        """
+        return self._registry
 
     # def _overwrite_sample_pifaces_with_cli(self, pifaces):
     #     """
@@ -320,10 +379,10 @@ class Project(peppyProject):
         :return list[looper.PipelineInterface]: collection of valid
             pipeline interfaces associated with selected sample
         """
-        try:
-            return self._interfaces_by_sample[sample_name]
-        except KeyError:
+        sample_id = self._registry.sample_id(sample_name)
+        if sample_id is None:
             return None
+        return self._registry.sample_interfaces(sample_id) or None
 
     def build_submission_bundles(self, protocol, priority=True):
         """
@@ -424,21 +483,6 @@ class Project(peppyProject):
                         )
                         raise
 
-    def _piface_by_samples(self):
-        """
-        Create a mapping of all defined interfaces in this Project by samples.
-
-        :return list[str]: a collection of pipeline interfaces keyed by
-        sample name
-        """
-        pifaces_by_sample = {}
-        for source, sample_names in self._samples_by_interface.items():
-            for sample_name in sample_names:
-                pifaces_by_sample.setdefault(sample_name, [])
-                pifaces_by_sample[sample_name].\
-                    append(PipelineInterface(source, pipeline_type="sample"))
-        return pifaces_by_sample
-
     def _omit_from_repr(self, k, cls):
         """
         Exclude the interfaces from representation.
@@ -462,38 +506,48 @@ class Project(peppyProject):
             _LOGGER.debug("Relative path made absolute: {}".format(pth))
         return pth
 
-    def _samples_by_piface(self, piface_key):
+    def _build_registry(self, piface_key):
         """
-        Create a collection of all samples with valid pipeline interfaces
+        Assign the valid pipeline interfaces to the samples.
+
+        Each pipeline interface source is read and validated once and the
+        resulting object is shared by all the samples that point to it.
 
         :param str piface_key: name of the attribute that holds pipeline
          interfaces
-        :return list[str]: a collection of samples keyed by pipeline interface
-            source
+        :return looper.registry.SampleRegistry: registry of the samples and
+            pipeline interfaces
         """
-        samples_by_piface = {}
-        msgs = set()
-        for sample in self.samples:
-            if piface_key in sample and sample[piface_key]:
-                piface_srcs = sample[piface_key]
-                if isinstance(piface_srcs, str):
-                    piface_srcs = [piface_srcs]
-                for source in piface_srcs:
-                    source = self._resolve_path_with_cfg(source)
+        registry = SampleRegistry(s[SAMPLE_NAME_ATTR] for s in self.samples)
+        invalid = {}
+        for sample_id, sample in enumerate(self.samples):
+            if piface_key not in sample or not sample[piface_key]:
+                continue
+            piface_srcs = sample[piface_key]
+            if isinstance(piface_srcs, str):
+                piface_srcs = [piface_srcs]
+            interface_ids = []
+            for source in piface_srcs:
+                source = self._resolve_path_with_cfg(source)
+                if source in invalid:
+                    continue
+                interface_id = registry.interface_id(source)
+                if interface_id is None:
                     try:
-                        PipelineInterface(source, pipeline_type="sample")
+                        piface = PipelineInterface(
+                            source, pipeline_type="sample")
                     except (ValidationError, IOError) as e:
-                        msg = "Ignoring invalid pipeline interface source: " \
-                              "{}. Caught exception: {}".\
+                        invalid[source] = \
+                            "Ignoring invalid pipeline interface source: " \
+                            "{}. Caught exception: {}".\
                             format(source, getattr(e, 'message', repr(e)))
-                        msgs.add(msg)
                         continue
-                    else:
-                        samples_by_piface.setdefault(source, set())
-                        samples_by_piface[source].add(sample[SAMPLE_NAME_ATTR])
-        for msg in msgs:
+                    interface_id = registry.add_interface(source, piface)
+                interface_ids.append(interface_id)
+            registry.assign(sample_id, interface_ids)
+        for msg in invalid.values():
             _LOGGER.warning(msg)
-        return samples_by_piface
+        return registry
 
 
 def fetch_samples(prj, selector_attribute=None, selector_include=None,
@@ -540,9 +594,11 @@ def fetch_samples(prj, selector_attribute=None, selector_include=None,
             "{} "
             "({})".format(selector_attribute, type(selector_attribute)))
 
+    columns = prj.sample_columns if isinstance(prj, Project) \
+        else SampleColumns(prj.samples)
+
     # At least one of the samples has to have the specified attribute
-    if prj.samples and not any(
-            [hasattr(s, selector_attribute) for s in prj.samples]):
+    if len(columns) and not columns.has_attribute(selector_attribute):
         raise AttributeError(
             "The Project samples do not have the attribute '{attr}'".
                 format(attr=selector_attribute))
@@ -554,27 +610,8 @@ def fetch_samples(prj, selector_attribute=None, selector_include=None,
             "Specify only selector_include or selector_exclude parameter, "
             "not both.")
 
-    # Ensure that we're working with sets.
-    def make_set(items):
-        if isinstance(items, str):
-            items = [items]
-        return items
-
-    # Use the attr check here rather than exception block in case the
-    # hypothetical AttributeError would occur; we want such
-    # an exception to arise, not to catch it as if the Sample lacks
-    # "protocol"
-    if not selector_include:
-        # Loose; keep all samples not in the selector_exclude.
-        def keep(s):
-            return not hasattr(s, selector_attribute) \
-                   or getattr(s, selector_attribute) \
-                   not in make_set(selector_exclude)
-    else:
-        # Strict; keep only samples in the selector_include.
-        def keep(s):
-            return hasattr(s, selector_attribute) \
-                   and getattr(s, selector_attribute) \
-                   in make_set(selector_include)
-
-    return list(filter(keep, prj.samples))
+    # Without selector_include it's loose: keep all samples not in the
+    # selector_exclude, including the ones lacking the attribute. Otherwise
+    # it's strict: keep only samples in the selector_include.
+    return columns.select(selector_attribute, include=selector_include,
+                          exclude=selector_exclude)
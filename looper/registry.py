@@ -0,0 +1,163 @@
+""" Integer-indexed bookkeeping of the samples and pipeline interfaces """
+
+from logging import getLogger
+
+import numpy as np
+
+__all__ = ["SampleRegistry"]
+
+_LOGGER = getLogger(__name__)
+
+
+class SampleRegistry(object):
+    """
+    Dense integer IDs for the samples and pipeline interfaces of a project.
+
+    Samples are numbered in the project order and pipeline interfaces in the
+    order their sources are registered; there is a single PipelineInterface
+    object per source. Every sample is assigned a combination of interfaces,
+    stored as an array of combination IDs with one entry per sample, so that
+    samples sharing the same interfaces share the same combination. The
+    sample-by-interface membership is a boolean matrix derived from it.
+    Names are used only to look up IDs and to report results.
+    """
+    def __init__(self, sample_names):
+        """
+        :param Iterable[str] sample_names: names of the project samples, in
+            the project order
+        """
+        self.sample_names = list(sample_names)
+        self._sample_ids = {}
+        for i, name in enumerate(self.sample_names):
+            self._sample_ids.setdefault(name, i)
+        self.sources = []
+        self.interfaces = []
+        self._source_ids = {}
+        self._combos = [()]
+        self._combo_ids = {(): 0}
+        self._assignment = np.zeros(len(self.sample_names), dtype=np.int32)
+        self._membership = None
+
+    @property
+    def num_samples(self):
+        """
+        :return int: number of samples in the registry
+        """
+        return len(self.sample_names)
+
+    @property
+    def num_interfaces(self):
+        """
+        :return int: number of pipeline interfaces in the registry
+        """
+        return len(self.interfaces)
+
+    @property
+    def num_assignments(self):
+        """
+        :return int: number of sample and pipeline interface pairs
+        """
+        sizes = np.fromiter((len(c) for c in self._combos), dtype=np.int64,
+                            count=len(self._combos))
+        return int(sizes[self._assignment].sum())
+
+    def add_interface(self, source, piface):
+        """
+        Register a pipeline interface.
+
+        :param str source: path to the pipeline interface file
+        :param looper.PipelineInterface piface: pipeline interface object
+        :return int: ID of the interface; the existing one if the source was
+            registered before
+        """
+        try:
+            return self._source_ids[source]
+        except KeyError:
+            iid = len(self.sources)
+            self._source_ids[source] = iid
+            self.sources.append(source)
+            self.interfaces.append(piface)
+            self._membership = None
+            return iid
+
+    def interface_id(self, source):
+        """
+        :param str source: path to the pipeline interface file
+        :return int | NoneType: ID of the interface, None if not registered
+        """
+        return self._source_ids.get(source)
+
+    def sample_id(self, sample_name):
+        """
+        :param str sample_name: name of the sample
+        :return int | NoneType: ID of the sample, None if not registered
+        """
+        return self._sample_ids.get(sample_name)
+
+    def assign(self, sample_id, interface_ids):
+        """
+        Assign pipeline interfaces to a sample, replacing the previous ones.
+
+        :param int sample_id: ID of the sample
+        :param Iterable[int] interface_ids: IDs of the interfaces
+        """
+        combo = tuple(sorted(set(interface_ids)))
+        try:
+            cid = self._combo_ids[combo]
+        except KeyError:
+            cid = len(self._combos)
+            self._combo_ids[combo] = cid
+            self._combos.append(combo)
+        self._assignment[sample_id] = cid
+        self._membership = None
+
+    def interface_ids(self, sample_id):
+        """
+        :param int sample_id: ID of the sample
+        :return tuple[int]: IDs of the interfaces assigned to the sample, in
+            the registration order
+        """
+        return self._combos[self._assignment[sample_id]]
+
+    def sample_interfaces(self, sample_id):
+        """
+        :param int sample_id: ID of the sample
+        :return list[looper.PipelineInterface]: interfaces assigned to the
+            sample, in the registration order
+        """
+        return [self.interfaces[i] for i in self.interface_ids(sample_id)]
+
+    @property
+    def membership(self):
+        """
+        Sample-by-interface membership matrix.
+
+        :return numpy.ndarray: boolean array with a row per interface and a
+            column per sample
+        """
+        if self._membership is None:
+            table = np.zeros((len(self._combos), self.num_interfaces),
+                             dtype=bool)
+            for cid, combo in enumerate(self._combos):
+                table[cid, list(combo)] = True
+            self._membership = table[self._assignment].T
+        return self._membership
+
+    def sample_ids(self, interface_id=None):
+        """
+        :param int interface_id: ID of the interface; samples assigned any
+            interface if not specified
+        :return numpy.ndarray: IDs of the samples assigned the interface
+        """
+        if interface_id is None:
+            return np.flatnonzero(self._assignment)
+        return np.flatnonzero(self.membership[interface_id])
+
+    def names(self, sample_ids):
+        """
+        Translate sample IDs to names.
+
+        :param Iterable[int] sample_ids: IDs of the samples
+        :return list[str]: names of the samples
+        """
+        return [self.sample_names[i] for i in sample_ids]
@@ -0,0 +1,347 @@
+""" Resource requests derived from the profiles of previous runs """
+
+import math
+import os
+from logging import getLogger
+
+from .const import *
+
+__all__ = ["history_resources", "usage_resources", "profile_usage",
+           "last_usage", "format_time", "ResourceModel", "fit_resource_model",
+           "input_schema", "input_size", "format_rows"]
+
+_LOGGER = getLogger(__name__)
+
+DEFAULT_HEADROOM = 1.5
+PROFILE_SUFFIX = "_profile.tsv"
+# memory requests are in MB, like in the size dependent variables, and the
+# profiles report GB
+MB_PER_GB = 1000
+# successful runs a resource model is fitted on, by default
+DEFAULT_MIN_SAMPLES = 3
+
+
+def profile_usage(path):
+    """
+    Read the runtime and peak memory of a run from its profile.
+
+    The runtime is the sum of the runtimes of the commands of the run, with
+    the repeated commands, e.g. of a resumed run, counted once, as in the
+    status table of the report.
+
+    :param str path: path to the profile, a pypiper profile.tsv
+    :return (float, float) | NoneType: runtime in seconds and peak memory in
+        GB; None if the profile is empty or can't be read
+    """
+    import pandas as pd
+    try:
+        df = pd.read_csv(path, sep="\t", comment="#", names=PROFILE_COLNAMES)
+        runtimes = pd.to_timedelta(df["runtime"])
+        mem = pd.to_numeric(df["mem"])
+    except (OSError, ValueError) as e:
+        _LOGGER.warning("Can't read the profile '{}': {}".format(path, e))
+        return None
+    if df.empty:
+        return None
+    last = ~df.duplicated("cid", keep="last").values
+    return runtimes[last].dt.total_seconds().sum(), mem.max()
+
+
+def last_usage(folder, pipeline_name):
+    """
+    Get the runtime and peak memory of the last run of a pipeline for a
+    sample, if it was successful.
+
+    The run was successful if the newest flag of the pipeline in the sample
+    results folder is the completed one.
+
+    :param str folder: results folder of the sample
+    :param str pipeline_name: name of the pipeline
+    :return (float, float) | NoneType: runtime in seconds and peak memory in
+        GB; None if there's no profile of a successful run
+    """
+    flags = {}
+    for flag in FLAGS:
+        path = os.path.join(folder, "{}_{}.flag".format(pipeline_name, flag))
+        if os.path.isfile(path):
+            flags[flag] = os.path.getmtime(path)
+    if not flags or max(flags, key=flags.get) != "completed":
+        return None
+    return profile_usage(os.path.join(folder, pipeline_name + PROFILE_SUFFIX))
+
+
+def history_resources(folder, pipeline_name, headroom=None):
+    """
+    Derive the memory and time to request for a pipeline job of a sample
+    from the profile of its last run, if it was successful.
+
+    :param str folder: results folder of the sample
+    :param str pipeline_name: name of the pipeline
+    :param float headroom: factor the resource usage of the last run is
+        multiplied by, 1.5 by default
+    :return dict | NoneType: 'mem', in MB, and 'time', as D-HH:MM:SS, to
+        request; None if there's no profile of a successful run
+    :raise ValueError: if the headroom is not positive
+    """
+    headroom = _headroom(headroom)
+    usage = last_usage(folder, pipeline_name)
+    if usage is None:
+        return None
+    return _request(*usage, headroom=headroom)
+
+
+def usage_resources(usage, headroom=None):
+    """
+    Derive the memory and time to request for a job from the resource usage
+    of a run, see last_usage.
+
+    :param (float, float) usage: runtime in seconds and peak memory in GB
+    :param float headroom: factor the resource usage is multiplied by, 1.5
+        by default
+    :return dict: 'mem', in MB, and 'time', as D-HH:MM:SS, to request
+    :raise ValueError: if the headroom is not positive
+    """
+    return _request(*usage, headroom=_headroom(headroom))
+
+
+class ResourceModel(object):
+    """
+    Runtime and peak memory of the runs of a pipeline as linear functions
+    of the input size of their samples, fitted by least squares on the
+    profiles of the successful runs.
+
+    The predictions are never below the smallest runtime and memory
+    observed, as a line fitted on the sizes of the runs so far is not to be
+    trusted for much smaller inputs.
+    """
+    def __init__(self, pipeline_name, points, headroom=None):
+        """
+        :param str pipeline_name: name of the pipeline
+        :param Iterable[(str, float, float, float)] points: sample name,
+            input size in GB, runtime in seconds and peak memory in GB of
+            each run the model is fitted on; at least one
+        :param float headroom: factor the predicted usage is multiplied by
+            in the resource requests, 1.5 by default
+        :raise ValueError: if there are no runs, or the headroom is not
+            positive
+        """
+        self.pipeline_name = pipeline_name
+        self.points = list(points)
+        if not self.points:
+            raise ValueError("No runs to fit the resource model of pipeline "
+                             "'{}' on".format(pipeline_name))
+        self.headroom = _headroom(headroom)
+        sizes = [p[1] for p in self.points]
+        self.runtime = _least_squares(sizes, [p[2] for p in self.points])
+        self.mem = _least_squares(sizes, [p[3] for p in self.points])
+
+    def predict(self, size):
+        """
+        Predict the resource usage of a run.
+
+        :param float size: input size of the run, in GB
+        :return (float, float): runtime in seconds and peak memory in GB
+        """
+        (a, b, _), (c, d, _) = self.runtime, self.mem
+        return (max(a + b * size, min(p[2] for p in self.points)),
+                max(c + d * size, min(p[3] for p in self.points)))
+
+    def resources(self, size):
+        """
+        Predict the memory and time to request for a run.
+
+        :param float size: input size of the run, in GB
+        :return dict: 'mem', in MB, and 'time', as D-HH:MM:SS, to request
+        """
+        return _request(*self.predict(size), headroom=self.headroom)
+
+    def explain(self):
+        """
+        :return list[str]: the fitted lines, their goodness of fit and the
+            runs they are fitted on
+        """
+        lines = ["Resource model of pipeline '{}', fitted on {} runs; "
+                 "headroom {:g}".format(self.pipeline_name, len(self.points),
+                                        self.headroom)]
+        for name, unit, (a, b, r2) in [("runtime", "s", self.runtime),
+                                       ("peak memory", "GB", self.mem)]:
+            lines.append("  {} ({}) = {:.6g} + {:.6g} * input size (GB); "
+                         "R^2 {}".format(name, unit, a, b, "n/a" if r2 is None
+                                         else "{:.3f}".format(r2)))
+        rows = [("sample", "input size (GB)", "runtime (s)", "memory (GB)")]
+        rows.extend((n, "{:.6g}".format(x), "{:.0f}".format(t),
+                     "{:.3g}".format(m)) for n, x, t, m in self.points)
+        lines.extend("  " + line for line in format_rows(rows))
+        return lines
+
+
+def fit_resource_model(prj, piface, runs=None):
+    """
+    Fit the resource model of a sample pipeline on the successful runs of
+    the project samples, if the pipeline interface opts in.
+
+    The input sizes of the samples are determined with the input schema of
+    the pipeline, like they are for the submission.
+
+    :param looper.Project prj: project with the samples
+    :param looper.PipelineInterface piface: interface of the pipeline
+    :param Iterable[(str, float, float, float)] runs: sample name, input
+        size in GB, runtime in seconds and peak memory in GB of each
+        successful run, if already read; read from the profiles by default
+    :return ResourceModel | NoneType: the model; None if the pipeline
+        doesn't use one or there are too few successful runs to fit it on
+    :raise ValueError: if the model settings are invalid
+    """
+    settings = piface.get(COMPUTE_KEY, {}).get(RESOURCE_MODEL_KEY)
+    if settings is None:
+        return None
+    min_samples = int(settings.get(MIN_SAMPLES_KEY) or DEFAULT_MIN_SAMPLES)
+    if min_samples < 1:
+        raise ValueError("Resource model minimum number of runs must be "
+                         "positive; got: {}".format(min_samples))
+    points = list(runs) if runs is not None \
+        else _successful_runs(prj, piface)
+    if len(points) < min_samples:
+        _LOGGER.info("Resource model of pipeline '{}' not used: {} of the "
+                     "required {} successful runs".format(
+                         piface.pipeline_name, len(points), min_samples))
+        return None
+    _LOGGER.debug("Resource model of pipeline '{}' fitted on {} runs".
+                  format(piface.pipeline_name, len(points)))
+    return ResourceModel(piface.pipeline_name, points,
+                         settings.get(HEADROOM_KEY))
+
+
+def _successful_runs(prj, piface):
+    """
+    :param looper.Project prj: project with the samples
+    :param looper.PipelineInterface piface: interface of the pipeline
+    :return list[(str, float, float, float)]: sample name, input size in GB,
+        runtime in seconds and peak memory in GB of the last run of each
+        sample, if it was successful
+    """
+    registry = prj.sample_registry
+    interface_id = registry.interface_id(piface.source)
+    names = [] if interface_id is None \
+        else registry.names(registry.sample_ids(interface_id))
+    samples = {s.sample_name: s for s in prj.samples}
+    schema = input_schema(piface)
+    if schema is None:
+        _LOGGER.warning("Pipeline '{}' has no input schema; the resource "
+                        "model can't tell the input sizes apart".
+                        format(piface.pipeline_name))
+    points = []
+    for name in names:
+        usage = last_usage(os.path.join(prj.results_folder, name),
+                           piface.pipeline_name)
+        if usage is not None:
+            points.append((name, input_size(samples[name], schema)) + usage)
+    return points
+
+
+def input_schema(piface):
+    """
+    :param looper.PipelineInterface piface: interface of the pipeline
+    :return list[dict] | NoneType: input schema of the pipeline, with its
+        imports; None if there's none
+    """
+    source = piface.get_pipeline_schemas()
+    if not source:
+        return None
+    from eido import read_schema
+    return read_schema(source)
+
+
+def input_size(sample, schema):
+    """
+    :param peppy.Sample sample: the sample
+    :param list[dict] schema: input schema of the pipeline, see input_schema
+    :return float: size of the input files of the sample in GB, 0 if there's
+        no input schema
+    """
+    if schema is None:
+        return 0.0
+    from eido import validate_inputs
+    from eido.const import INPUT_FILE_SIZE_KEY
+    return float(validate_inputs(sample, schema)[INPUT_FILE_SIZE_KEY])
+
+
+def format_time(seconds):
+    """
+    Format a time to request, like the size dependent variables do.
+
+    :param float seconds: the time in seconds
+    :return str: the time as D-HH:MM:SS, e.g. 00-04:30:00
+    """
+    minutes, secs = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return "{:02d}-{:02d}:{:02d}:{:02d}".format(days, hours, minutes, secs)
+
+
+def format_rows(rows):
+    """
+    Align the columns of a table for the log.
+
+    :param Iterable[Sequence[str]] rows: rows of the table, the header first
+    :return list[str]: the rows, with the columns padded to the same width
+    """
+    rows = list(rows)
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+    return ["  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip()
+            for row in rows]
+
+
+def _headroom(headroom):
+    """
+    :param float headroom: factor the resource usage is multiplied by; the
+        default one if None
+    :return float: the headroom
+    :raise ValueError: if the headroom is not positive
+    """
+    headroom = DEFAULT_HEADROOM if headroom is None else float(headroom)
+    if headroom <= 0:
+        raise ValueError("Resource headroom must be positive; got: {}".
+                         format(headroom))
+    return headroom
+
+
+def _request(seconds, mem, headroom):
+    """
+    Scale the resource usage of a run by the headroom and round it up, to
+    whole minutes and MB.
+
+    :param float seconds: runtime of the run
+    :param float mem: peak memory of the run, in GB
+    :param float headroom: factor the usage is multiplied by
+    :return dict: 'mem', in MB, and 'time', as D-HH:MM:SS, to request
+    """
+    # rounded first, so that float error doesn't add a MB or minute
+    mem = round(mem * MB_PER_GB * headroom, 6)
+    minutes = round(seconds * headroom / 60, 6)
+    return {"mem": max(1, int(math.ceil(mem))),
+            "time": format_time(max(60, 60 * math.ceil(minutes)))}
+
+
+def _least_squares(x, y):
+    """
+    Fit a line by ordinary least squares.
+
+    :param Sequence[float] x: values of the independent variable
+    :param Sequence[float] y: values of the dependent variable
+    :return (float, float, float | NoneType): intercept, slope and the
+        coefficient of determination; with no spread of the x values the
+        line is flat, at the mean, and the coefficient is None
+    """
+    n = len(x)
+    mx, my = sum(x) / n, sum(y) / n
+    sxx = sum((v - mx) ** 2 for v in x)
+    syy = sum((v - my) ** 2 for v in y)
+    if sxx == 0:
+        return my, 0.0, None
+    slope = sum((u - mx) * (v - my) for u, v in zip(x, y)) / sxx
+    intercept = my - slope * mx
+    if syy == 0:
+        return intercept, slope, 1.0
+    residual = sum((v - intercept - slope * u) ** 2 for u, v in zip(x, y))
+    return intercept, slope, 1 - residual / syy
@@ -0,0 +1,180 @@
+""" Retries of the job submissions that fail transiently """
+
+import logging
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from .timings import timed
+
+__all__ = ["RetryPolicy", "SubmissionFailure", "TRANSIENT_PATTERNS"]
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 5
+DEFAULT_MAX_BACKOFF = 120
+# Fraction of the backoff delay that is randomized, so that the retries of
+# concurrent looper invocations don't hit the scheduler at the same time
+JITTER = 0.5
+# Error messages of the submission commands that are worth a retry: the
+# scheduler is overloaded or briefly unreachable
+TRANSIENT_PATTERNS = [
+    r"(?i)socket timed out",
+    r"(?i)temporarily unavailable",
+    r"(?i)temporarily unable",
+    r"(?i)try again",
+    r"(?i)unable to contact slurm controller",
+    r"(?i)connection (refused|reset|timed out)",
+    r"(?i)transport endpoint",
+    r"(?i)pbs_iff: cannot",
+]
+
+
+class SubmissionFailure(subprocess.CalledProcessError):
+    """ Failed job submission, after the retries if it was transient """
+    def __init__(self, returncode, cmd, stderr=None, transient=False,
+                 retries=0):
+        """
+        :param int returncode: exit code of the submission command
+        :param str cmd: submission command
+        :param str stderr: error output of the submission command
+        :param bool transient: whether the failure looked transient
+        :param int retries: number of retries made
+        """
+        super(SubmissionFailure, self).__init__(returncode, cmd,
+                                                stderr=stderr)
+        self.transient = transient
+        self.retries = retries
+
+
+class RetryPolicy(object):
+    """
+    Retries of the submission commands that fail transiently.
+
+    A failure is transient if the error output of the submission command
+    matches one of the patterns. Such submissions are retried with an
+    exponentially growing delay, with jitter, up to the number of retries.
+    The policy also keeps the tallies for the summary of a run.
+    """
+    def __init__(self, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, patterns=None):
+        """
+        :param int retries: maximum number of retries of a submission
+        :param float backoff: delay in seconds before the first retry;
+            doubled with every next retry
+        :param float max_backoff: maximum delay in seconds before a retry
+        :param Iterable[str] | str patterns: regular expressions matching
+            the error messages of the transient failures; the common
+            scheduler messages by default
+        :raise ValueError: if a setting is negative or a pattern is invalid
+        """
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        if self.retries < 0 or self.backoff < 0 or self.max_backoff < 0:
+            raise ValueError("Submission retries and backoff can't be "
+                             "negative")
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        try:
+            self.patterns = [re.compile(p)
+                             for p in patterns or TRANSIENT_PATTERNS]
+        except re.error as e:
+            raise ValueError("Invalid submission retry pattern: {}".format(e))
+        self.num_retries = 0
+        self.recovered = 0
+        self.requeued = 0
+        self.failed = 0
+
+    def is_transient(self, message):
+        """
+        :param str message: error output of a submission command
+        :return bool: whether the failure is transient
+        """
+        return bool(message) and any(p.search(message)
+                                     for p in self.patterns)
+
+    def delay(self, retry):
+        """
+        :param int retry: one-based number of the retry
+        :return float: time in seconds to wait before the retry
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (retry - 1))
+        return delay * (1 - JITTER * random.random())
+
+    def submit(self, cmd):
+        """
+        Run a submission command, retrying it if it fails transiently.
+
+        The output of the command is passed on to the standard output and
+        error.
+
+        :param str cmd: submission command
+        :return str: standard output of the successful submission, e.g.
+            with the job ID
+        :raise SubmissionFailure: if the command fails for good
+        """
+        retry = 0
+        while True:
+            returncode, out, err = _run(cmd)
+            if returncode == 0:
+                if retry:
+                    self.recovered += 1
+                return out
+            transient = self.is_transient(err)
+            if not transient or retry >= self.retries:
+                raise SubmissionFailure(returncode, cmd, err,
+                                        transient=transient, retries=retry)
+            retry += 1
+            self.num_retries += 1
+            delay = self.delay(retry)
+            _LOGGER.warning("Transient submission failure ({}); retry {} of "
+                            "{} in {:.1f} s: {}".format(
+                                returncode, retry, self.retries, delay, cmd))
+            with timed("backoff"):
+                time.sleep(delay)
+
+    def summary(self):
+        """
+        :return str: summary of the retried and failed submissions, empty if
+            there were none
+        """
+        if not (self.num_retries or self.requeued or self.failed):
+            return ""
+        return "Submission retries: {}; recovered submissions: {}; " \
+               "re-queued: {}; permanently failed: {}".format(
+                    self.num_retries, self.recovered, self.requeued,
+                    self.failed)
+
+
+def _run(cmd):
+    """
+    Run a command, passing its output on and capturing it.
+
+    The standard output is passed on as it's written, e.g. by the jobs run
+    locally; the standard error, which is usually short, once the command
+    is done.
+
+    :param str cmd: command to run
+    :return (int, str, str): exit code, standard output and standard error
+        of the command
+    """
+    out = []
+    with tempfile.TemporaryFile(mode="w+") as err_file:
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                stderr=err_file, universal_newlines=True)
+        for line in proc.stdout:
+            sys.stdout.write(line)
+            out.append(line)
+        proc.stdout.close()
+        returncode = proc.wait()
+        sys.stdout.flush()
+        err_file.seek(0)
+        err = err_file.read()
+    if err:
+        sys.stderr.write(err)
+    return returncode, "".join(out), err
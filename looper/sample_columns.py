@@ -0,0 +1,143 @@
+""" Columnar view of the sample attributes for selection and toggling """
+
+from logging import getLogger
+
+__all__ = ["SampleColumns"]
+
+_LOGGER = getLogger(__name__)
+
+# Marks the rows of the samples that lack an attribute
+MISSING = object()
+
+
+class SampleColumns(object):
+    """
+    Columnar view of the attributes of a collection of samples.
+
+    A column holds the values of a single attribute, one per sample, in the
+    order of the samples; MISSING marks samples that lack the attribute.
+    Columns are built on first access, in a single pass over the samples,
+    and reused afterwards. Values are stored as returned by the sample,
+    i.e. with the environment variables expanded. The view reflects the
+    samples at the time a column is built, so it's meant for the attributes
+    that come from the sample table, like the selector or toggle attributes.
+    """
+    def __init__(self, samples):
+        """
+        :param Iterable[peppy.Sample] samples: samples to build the view of
+        """
+        self._samples = samples if isinstance(samples, list) \
+            else list(samples)
+        self._columns = {}
+        self._rows = None
+
+    def __len__(self):
+        return len(self._samples)
+
+    @property
+    def samples(self):
+        """
+        :return list[peppy.Sample]: samples in the view, in row order; the
+            list the view was created with, if it was given one
+        """
+        return self._samples
+
+    def column(self, attr):
+        """
+        Get the values of an attribute for all the samples.
+
+        :param str attr: name of the attribute
+        :return list: attribute values in row order, MISSING for the samples
+            that lack the attribute
+        """
+        try:
+            return self._columns[attr]
+        except KeyError:
+            _LOGGER.debug("Building sample attribute column: {}".format(attr))
+            col = [s[attr] if attr in s else MISSING for s in self._samples]
+            self._columns[attr] = col
+            return col
+
+    def has_attribute(self, attr):
+        """
+        Check whether any of the samples has an attribute.
+
+        :param str attr: name of the attribute
+        :return bool: whether at least one sample has the attribute
+        """
+        return any(v is not MISSING for v in self.column(attr))
+
+    def row(self, sample_name):
+        """
+        Get the row of a sample.
+
+        :param str sample_name: name of the sample
+        :return int | NoneType: row index, None if the sample is not in view
+        """
+        if self._rows is None:
+            self._rows = {s.sample_name: i
+                          for i, s in enumerate(self._samples)}
+        return self._rows.get(sample_name)
+
+    def value(self, sample, attr):
+        """
+        Get the value of an attribute of a sample from its column.
+
+        Samples that are not in the view are read directly.
+
+        :param peppy.Sample sample: sample to get the value for
+        :param str attr: name of the attribute
+        :return object: attribute value, MISSING if the sample lacks it
+        """
+        i = self.row(sample.sample_name)
+        if i is None or self._samples[i] is not sample:
+            return sample[attr] if attr in sample else MISSING
+        return self.column(attr)[i]
+
+    def select(self, attr, include=None, exclude=None):
+        """
+        Get the samples with the attribute value in or out of a collection.
+
+        With include, only the samples that have the attribute with one of
+        the values are kept. With exclude, the samples that lack the
+        attribute or have it with none of the values are kept.
+
+        :param str attr: name of the attribute to select on
+        :param Iterable | str include: attribute values to keep
+        :param Iterable | str exclude: attribute values to drop
+        :return list[peppy.Sample]: selected samples, in row order
+        """
+        col = self.column(attr)
+        contains = _membership(include if include else exclude)
+        if include:
+            keep = [v is not MISSING and contains(v) for v in col]
+        else:
+            keep = [v is MISSING or not contains(v) for v in col]
+        return [s for s, k in zip(self._samples, keep) if k]
+
+
+def _membership(items):
+    """
+    Create a membership test for a collection of values.
+
+    Hashable values are looked up in a set; the rest, e.g. the lists of
+    merged subsample attributes, are compared to every item.
+
+    :param Iterable | str items: values to test against; a string is a
+        single value
+    :return callable: function checking if a value is in the collection
+    """
+    if isinstance(items, str):
+        items = [items]
+    items = list(items)
+    try:
+        lookup = set(items)
+    except TypeError:
+        return lambda v: v in items
+
+    def _contains(v):
+        try:
+            return v in lookup
+        except TypeError:
+            return v in items
+    return _contains
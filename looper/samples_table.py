@@ -0,0 +1,133 @@
+""" Compact on-disk samples tables of the project jobs """
+
+import csv
+import json
+import logging
+from collections.abc import Sequence
+
+from .exceptions import MisconfigurationException
+
+__all__ = ["SamplesTable", "write_samples_table", "SAMPLES_TABLE_FORMATS"]
+
+_LOGGER = logging.getLogger(__name__)
+
+# Extensions of the samples table files, by format
+SAMPLES_TABLE_FORMATS = {"tsv": ".tsv", "jsonl": ".jsonl",
+                         "parquet": ".parquet"}
+DEFAULT_SAMPLES_TABLE_FORMAT = "tsv"
+
+
+class SamplesTable(Sequence):
+    """
+    Samples of a project job, written to a table file.
+
+    Renders as the path to the table, so that a command template can pass
+    it on to the pipeline whatever the number of samples, and serializes,
+    e.g. for the pre-submission hooks, as the path, format and number of
+    rows. The samples themselves are only accessed when the table is
+    indexed or iterated, e.g. by a template looping over them.
+    """
+    def __init__(self, path, fmt, samples):
+        """
+        :param str path: path to the table file
+        :param str fmt: format of the table file
+        :param Sequence[peppy.Sample] samples: samples in the table, in row
+            order
+        """
+        self.path = path
+        self.format = fmt
+        self.samples = samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, item):
+        return self.samples[item]
+
+    def __iter__(self):
+        return iter(self.samples)
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return "{}({} samples: {})".format(
+            self.__class__.__name__, len(self), self.path)
+
+    def to_dict(self):
+        """
+        :return dict: path, format and number of rows of the table
+        """
+        return {"path": self.path, "format": self.format,
+                "num_samples": len(self)}
+
+
+def write_samples_table(samples, path_base, fmt=None):
+    """
+    Write the attributes of the samples to a table file, a row per sample.
+
+    The columns are the attributes of the samples, in the order of their
+    first appearance; missing values are left empty. In the TSV format the
+    values that are not scalars, e.g. the lists of subsample attributes, are
+    written as JSON.
+
+    :param Sequence[peppy.Sample] samples: samples to write
+    :param str path_base: path to the table file, without the extension
+    :param str fmt: format of the table, 'tsv' (default), 'jsonl' or
+        'parquet'; the latter requires a Parquet engine, e.g. pyarrow
+    :return SamplesTable: the written table
+    :raise MisconfigurationException: if the format is not supported or
+        its engine is not installed
+    """
+    fmt = (fmt or DEFAULT_SAMPLES_TABLE_FORMAT).lower()
+    if fmt not in SAMPLES_TABLE_FORMATS:
+        raise MisconfigurationException(
+            "Unsupported samples table format: '{}'; use one of: {}".format(
+                fmt, ", ".join(SAMPLES_TABLE_FORMATS)))
+    path = path_base + SAMPLES_TABLE_FORMATS[fmt]
+    rows = (s.to_dict() for s in samples)
+    if fmt == "jsonl":
+        with open(path, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row, default=str) + "\n")
+    else:
+        rows = list(rows)
+        columns = list(dict.fromkeys(k for row in rows for k in row))
+        if fmt == "parquet":
+            _write_parquet(rows, columns, path)
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+                writer.writerow(columns)
+                for row in rows:
+                    writer.writerow([_tsv_value(row.get(c)) for c in columns])
+    _LOGGER.debug("Samples table with {} rows written: {}".
+                  format(len(samples), path))
+    return SamplesTable(path, fmt, samples)
+
+
+def _write_parquet(rows, columns, path):
+    """
+    :param list[dict] rows: attributes of the samples
+    :param list[str] columns: names of the columns
+    :param str path: path to the table file
+    :raise MisconfigurationException: if no Parquet engine is installed
+    """
+    import pandas as pd
+    try:
+        pd.DataFrame(rows, columns=columns).to_parquet(path, index=False)
+    except ImportError as e:
+        raise MisconfigurationException(
+            "Can't write the samples table in Parquet format: {}".format(e))
+
+
+def _tsv_value(x):
+    """
+    :param x: value of a sample attribute
+    :return str: the value as written to a TSV table
+    """
+    if x is None:
+        return ""
+    if isinstance(x, (list, dict)):
+        return json.dumps(x, default=str)
+    return str(x)
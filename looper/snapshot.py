@@ -0,0 +1,253 @@
+""" Snapshots of processed projects for fast repeated invocations """
+
+import copyreg
+import functools
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import sys
+import tempfile
+from collections import OrderedDict
+
+from ubiquerg import is_url
+
+from ._version import __version__
+from .const import *
+from .timings import timed
+
+__all__ = ["cached_project", "project_inputs", "snapshot_key"]
+
+_LOGGER = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 3
+SNAPSHOT_EXT = ".pkl"
+# References to environment variables in the project input files, e.g.
+# '$HOME' or '${HOME}'
+_ENV_VAR_PATTERN = re.compile(rb"\$\{?([A-Za-z_][A-Za-z0-9_]*)")
+# Project attributes that are not stored in the snapshot; the computing
+# configuration is read anew for every invocation
+_SNAPSHOT_EXCLUDED_ATTRS = ["dcc"]
+
+
+def cached_project(cache_dir, divcfg_path=None, **project_kwargs):
+    """
+    Get a Project, from a snapshot if the project inputs did not change.
+
+    The snapshot is looked up by a key derived from the Project constructor
+    arguments. It's used only if the content hashes of all the files the
+    project was built from (configs, sample tables and pipeline interfaces)
+    and the values of the environment variables these files reference, e.g.
+    in the derived attribute sources or the output folder, match the ones
+    recorded in it; otherwise the project is built and the snapshot is
+    replaced. Environment variables referenced elsewhere, e.g. by the files
+    that the inputs point to, and the inputs of custom sample modifiers are
+    not checked.
+
+    :param str cache_dir: directory with the project snapshots
+    :param str divcfg_path: path to the computing configuration file
+    :param project_kwargs: looper.Project constructor arguments
+    :return looper.Project: the processed project
+    """
+    from divvy import ComputingConfiguration
+    from .project import Project
+    path = os.path.join(cache_dir, snapshot_key(**project_kwargs) +
+                        SNAPSHOT_EXT)
+    with timed("snapshot_load"):
+        prj = _load_snapshot(path)
+    if prj is None:
+        prj = Project(divcfg_path=divcfg_path, **project_kwargs)
+        with timed("snapshot_save"):
+            _save_snapshot(prj, path)
+        return prj
+    _LOGGER.info("Using project snapshot: {}".format(path))
+    prj.dcc = None if divcfg_path is None else \
+        ComputingConfiguration(filepath=divcfg_path)
+    if DRY_RUN_KEY in prj and not prj[DRY_RUN_KEY]:
+        prj.make_project_dirs()
+    return prj
+
+
+def snapshot_key(**project_kwargs):
+    """
+    Compute the snapshot key for the given Project constructor arguments.
+
+    The versions of looper, peppy and Python are included, since any of
+    them can change the processed project or its serialized form.
+
+    :param project_kwargs: looper.Project constructor arguments
+    :return str: hex digest identifying the snapshot
+    """
+    import peppy
+    data = {k: v for k, v in project_kwargs.items()
+            if k not in ["project_config", "divcfg_path"]}
+    data["config_file"] = os.path.abspath(data["config_file"])
+    data["versions"] = [__version__, peppy.__version__,
+                        list(sys.version_info[:2]), SNAPSHOT_FORMAT]
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).
+                        encode()).hexdigest()
+
+
+def project_inputs(prj):
+    """
+    List the files a processed project was built from.
+
+    These are the config file and the configs it imports, the sample and
+    subsample tables and every pipeline interface the samples point to,
+    including the invalid or missing ones.
+
+    :param looper.Project prj: processed project
+    :return list[str]: paths or URLs of the project input files
+    """
+    from peppy.const import CFG_IMPORTS_KEY, CFG_SAMPLE_TABLE_KEY, \
+        CFG_SUBSAMPLE_TABLE_KEY, CONFIG_FILE_KEY, CONFIG_KEY, PROJ_MODS_KEY
+
+    def _as_list(x):
+        if not x:
+            return []
+        return [x] if isinstance(x, str) else list(x)
+
+    cfg = prj[CONFIG_KEY]
+    inputs = [prj[CONFIG_FILE_KEY]]
+    if PROJ_MODS_KEY in cfg:
+        inputs.extend(_as_list(cfg[PROJ_MODS_KEY].get(CFG_IMPORTS_KEY)))
+    for key in [CFG_SAMPLE_TABLE_KEY, CFG_SUBSAMPLE_TABLE_KEY]:
+        inputs.extend(_as_list(cfg.get(key)))
+    piface_key = prj.piface_key
+    for sample in prj.samples:
+        if piface_key in sample:
+            inputs.extend(prj._resolve_path_with_cfg(src)
+                          for src in _as_list(sample[piface_key]))
+    return list(OrderedDict.fromkeys(inputs))
+
+
+def _file_digest(path, env_vars=None):
+    """
+    Hash the contents of a file.
+
+    :param str path: path to the file
+    :param set[str] env_vars: set to add the names of the environment
+        variables referenced in the file to; 'HOME' for a '~'
+    :return str | NoneType: hex digest of the contents, None if the file
+        does not exist
+    """
+    if not os.path.isfile(path):
+        return None
+    h = hashlib.sha1()
+    tail = b""
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+            if env_vars is not None:
+                # a reference may span two chunks
+                text = tail + chunk
+                env_vars.update(m.decode()
+                                for m in _ENV_VAR_PATTERN.findall(text))
+                if b"~" in chunk:
+                    env_vars.add("HOME")
+                tail = text[-256:]
+    return h.hexdigest()
+
+
+def _reduce_mapping(obj, exclude=()):
+    """
+    Pickle reduction of the attmap-based classes with required constructor
+    arguments (Project, Sample, PipelineInterface).
+
+    The instance is created without calling the constructor and its items
+    are stored as they are, without the path expansion done on access.
+
+    :param collections.OrderedDict obj: object to reduce
+    :param Iterable[str] exclude: keys of the items not to store
+    :return tuple: reduction for pickle
+    """
+    items = [(k, v) for k, v in OrderedDict.items(obj) if k not in exclude]
+    return copyreg.__newobj__, (type(obj),), vars(obj) or None, None, \
+        iter(items)
+
+
+def _save_snapshot(prj, path):
+    """
+    Write the project snapshot, along with the hashes of its inputs and the
+    values of the environment variables they reference.
+
+    The file is written to a temporary location first and then renamed, so
+    that concurrent invocations never read an incomplete snapshot.
+
+    :param looper.Project prj: processed project
+    :param str path: path to the snapshot file
+    """
+    from peppy import Sample
+    from .pipeline_interface import PipelineInterface
+    from .project import Project
+    inputs = project_inputs(prj)
+    urls = [i for i in inputs if is_url(i)]
+    if urls:
+        _LOGGER.debug("Not saving the project snapshot, remote inputs can't "
+                      "be checked for changes: {}".format(", ".join(urls)))
+        return
+    env_vars = set()
+    digests = {i: _file_digest(i, env_vars) for i in inputs}
+    header = {"format": SNAPSHOT_FORMAT, "inputs": digests,
+              "environment": {v: os.environ.get(v) for v in sorted(env_vars)}}
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            pickler.dispatch_table = copyreg.dispatch_table.copy()
+            pickler.dispatch_table.update({
+                Project: functools.partial(
+                    _reduce_mapping, exclude=_SNAPSHOT_EXCLUDED_ATTRS),
+                Sample: _reduce_mapping,
+                PipelineInterface: _reduce_mapping})
+            pickler.dump(header)
+            pickler.dump(prj)
+        os.replace(tmp, path)
+    except Exception as e:
+        _LOGGER.warning("Could not save the project snapshot ({}): {}".
+                        format(path, getattr(e, 'message', repr(e))))
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    else:
+        _LOGGER.debug("Saved project snapshot: {}".format(path))
+
+
+def _load_snapshot(path):
+    """
+    Read the project snapshot, if it's up to date.
+
+    :param str path: path to the snapshot file
+    :return looper.Project | NoneType: the processed project, None if the
+        snapshot does not exist, can't be read or any of the project input
+        files, or the environment variables they reference, changed since
+        it was saved
+    """
+    if not os.path.isfile(path):
+        _LOGGER.debug("No project snapshot: {}".format(path))
+        return None
+    try:
+        with open(path, "rb") as f:
+            unpickler = pickle.Unpickler(f)
+            header = unpickler.load()
+            if header.get("format") != SNAPSHOT_FORMAT:
+                _LOGGER.debug("Unsupported snapshot format: {}".format(path))
+                return None
+            for i, digest in header["inputs"].items():
+                if _file_digest(i) != digest:
+                    _LOGGER.info("Project input changed, snapshot is "
+                                 "outdated: {}".format(i))
+                    return None
+            for name, value in header["environment"].items():
+                if os.environ.get(name) != value:
+                    _LOGGER.info("Environment variable changed, snapshot is "
+                                 "outdated: {}".format(name))
+                    return None
+            return unpickler.load()
+    except Exception as e:
+        _LOGGER.warning("Could not read the project snapshot ({}): {}".
+                        format(path, getattr(e, 'message', repr(e))))
+        return None
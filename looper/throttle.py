@@ -0,0 +1,456 @@
+""" Submission throttling: rate limit, queue backpressure, in-flight caps """
+
+import logging
+import subprocess
+import time
+from collections import namedtuple
+
+from .const import *
+from .retry import DEFAULT_BACKOFF, DEFAULT_MAX_BACKOFF, DEFAULT_RETRIES, \
+    RetryPolicy
+from .timings import timed
+
+__all__ = ["TokenBucket", "QueueMonitor", "JobCap", "SubmissionThrottle",
+           "throttle_settings"]
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 5
+# time in seconds after which a job whose end is checked with its flags
+# only is no longer counted in flight, e.g. if it was killed before writing
+# a flag
+DEFAULT_MAX_JOB_WAIT = 24 * 60 * 60
+
+# A job in flight; 'finished' checks whether it's done, e.g. with its flags,
+# and 'submitted' is its monotonic submission time
+_Job = namedtuple("_Job", ["pipeline", "job_name", "finished", "submitted"])
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter.
+
+    The bucket holds up to 'burst' tokens and is refilled at 'rate' tokens
+    per second; each submission takes a token. So submissions proceed with
+    no wait as long as there are tokens left, e.g. after an idle period,
+    while over time the rate doesn't exceed the limit.
+    """
+    def __init__(self, rate, burst=1):
+        """
+        :param float rate: number of tokens added per second
+        :param int burst: capacity of the bucket, i.e. the number of
+            submissions that can be made at once
+        :raise ValueError: if the rate or capacity is not positive
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError("Submission rate must be positive and burst at "
+                             "least 1; got: {}, {}".format(rate, burst))
+        self.rate = float(rate)
+        self.burst = int(burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+
+    def acquire(self):
+        """
+        Take a token, waiting for one to become available if needed.
+
+        :return float: time in seconds spent waiting
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        wait = (1 - self._tokens) / self.rate
+        time.sleep(wait)
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        return wait
+
+
+class QueueMonitor(object):
+    """
+    Queue depth backpressure.
+
+    The depth of the queue, i.e. the number of our jobs in it, is determined
+    with a command that prints it, like 'squeue -u $USER -h | wc -l'. The
+    command is run at most once per poll interval; in between, the jobs
+    submitted since the last poll are added to the polled depth. Submission
+    pauses once the depth reaches the high-water mark and resumes once it
+    falls to the low-water mark.
+    """
+    def __init__(self, command, high, low=None,
+                 interval=DEFAULT_POLL_INTERVAL):
+        """
+        :param str command: command printing the number of jobs in the queue
+        :param int high: queue depth at which submission pauses
+        :param int low: queue depth at which a paused submission resumes;
+            one below the high-water mark by default
+        :param float interval: minimal time in seconds between the polls
+        :raise ValueError: if the low-water mark is above the high one
+        """
+        self.command = command
+        self.high = int(high)
+        self.low = self.high - 1 if low is None else int(low)
+        if self.low >= self.high or self.low < 0:
+            raise ValueError("Queue low-water mark must be nonnegative and "
+                             "below the high-water mark; got: {}, {}".
+                             format(self.low, self.high))
+        self.interval = float(interval)
+        self._depth = None
+        self._polled = None
+        self._submitted = 0
+
+    def poll(self):
+        """
+        Run the queue depth command.
+
+        :return int | NoneType: number of jobs in the queue, None if it
+            couldn't be determined
+        """
+        try:
+            with timed("queue_poll"):
+                out = subprocess.check_output(self.command, shell=True,
+                                              universal_newlines=True)
+            depth = int(out.split()[-1])
+        except (subprocess.CalledProcessError, ValueError, IndexError) as e:
+            _LOGGER.warning("Failed to determine the queue depth with '{}': "
+                            "{}".format(self.command, e))
+            depth = None
+        self._depth = depth
+        self._polled = time.monotonic()
+        self._submitted = 0
+        return depth
+
+    def depth(self):
+        """
+        Get the current queue depth, polling if the last poll is stale.
+
+        :return int | NoneType: number of jobs in the queue, None if it
+            couldn't be determined
+        """
+        if self._polled is None or \
+                time.monotonic() - self._polled >= self.interval:
+            self.poll()
+        if self._depth is None:
+            return None
+        return self._depth + self._submitted
+
+    def record_submission(self):
+        """ Count a job submitted since the last poll """
+        self._submitted += 1
+
+    def wait(self):
+        """
+        Wait for the queue to drain if it's at the high-water mark.
+
+        A depth that can't be determined doesn't block the submission.
+
+        :return float: time in seconds spent waiting
+        """
+        depth = self.depth()
+        if depth is None or depth < self.high:
+            return 0.0
+        _LOGGER.info("Queue depth {} reached the high-water mark ({}); "
+                     "pausing submission until it's down to {}".
+                     format(depth, self.high, self.low))
+        start = time.monotonic()
+        while depth is not None and depth > self.low:
+            time.sleep(self.interval)
+            depth = self.poll()
+        waited = time.monotonic() - start
+        _LOGGER.info("Queue depth {}; resuming submission after {:.0f} s".
+                     format(depth, waited))
+        return waited
+
+
+class JobCap(object):
+    """
+    Caps on the number of jobs in flight, i.e. submitted and not finished.
+
+    The jobs submitted by this looper invocation are counted, against a
+    global limit and against the limits of their pipelines. A job is
+    finished once its own check says so, e.g. its samples have completed or
+    failed flags, or, with a job names command like
+    'squeue -h -u $USER -o %j', once the scheduler no longer lists its name.
+    The job names command is run at most once per poll interval. Jobs whose
+    end can't be detected in either way are not counted. A job killed by
+    the scheduler writes no flag, so the jobs checked with their flags only
+    are no longer counted after the maximum job wait.
+    """
+    def __init__(self, limit=None, names_command=None,
+                 interval=DEFAULT_POLL_INTERVAL, max_wait=None):
+        """
+        :param int limit: maximum number of jobs in flight, for all the
+            pipelines together
+        :param str names_command: command printing the names of the jobs in
+            the scheduler queue, one per line
+        :param float interval: time in seconds between the checks of the
+            jobs in flight while waiting
+        :param float max_wait: time in seconds after which a job checked
+            with its flags only is no longer counted in flight; 24 hours by
+            default
+        :raise ValueError: if the limit or the maximum job wait is not
+            positive
+        """
+        self.limit = _cap_limit(limit)
+        self.names_command = names_command
+        self.interval = float(interval)
+        self.max_wait = DEFAULT_MAX_JOB_WAIT if max_wait is None \
+            else float(max_wait)
+        if self.max_wait <= 0:
+            raise ValueError("'{}' must be positive; got: {}".
+                             format(MAX_JOB_WAIT_KEY, max_wait))
+        self._pipeline_limits = {}
+        self._jobs = []
+        self._warned = False
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @property
+    def limited(self):
+        """
+        :return bool: whether any cap is set
+        """
+        return self.limit is not None or bool(self._pipeline_limits)
+
+    def set_limit(self, pipeline, limit):
+        """
+        Cap the number of jobs in flight of a pipeline.
+
+        :param str pipeline: name of the pipeline
+        :param int limit: maximum number of the pipeline jobs in flight
+        :raise ValueError: if the limit is not positive
+        """
+        limit = _cap_limit(limit)
+        if limit is not None:
+            self._pipeline_limits[pipeline] = limit
+
+    def in_flight(self, pipeline=None):
+        """
+        :param str pipeline: name of the pipeline to count the jobs of; all
+            the jobs are counted if not specified
+        :return int: number of jobs in flight
+        """
+        if pipeline is None:
+            return len(self._jobs)
+        return sum(1 for j in self._jobs if j.pipeline == pipeline)
+
+    def add(self, pipeline, job_name, finished=None):
+        """
+        Count a submitted job in flight.
+
+        :param str pipeline: name of the pipeline of the job
+        :param str job_name: name of the job, as listed by the scheduler
+        :param callable finished: function checking whether the job is
+            finished
+        """
+        if not self.limited:
+            return
+        if finished is None and not self.names_command:
+            if not self._warned:
+                _LOGGER.warning("Jobs in flight can't be tracked with no "
+                                "'{}'; not counted towards '{}'".format(
+                                    JOB_NAMES_COMMAND_KEY, MAX_JOBS_KEY))
+                self._warned = True
+            return
+        self._jobs.append(_Job(pipeline, job_name, finished,
+                               time.monotonic()))
+
+    def update(self):
+        """ Stop counting the finished jobs, and the stale ones """
+        queued = self._queued_names() if self.names_command else None
+        self._jobs = [j for j in self._jobs if not (
+            (queued is not None and j.job_name not in queued) or
+            (j.finished is not None and j.finished()) or
+            (queued is None and self._stale(j)))]
+
+    def _stale(self, job):
+        """
+        :param _Job job: a job in flight, checked with its flags
+        :return bool: whether the job has been in flight for longer than the
+            maximum job wait
+        """
+        if time.monotonic() - job.submitted < self.max_wait:
+            return False
+        _LOGGER.warning("Job '{}' of pipeline '{}' wrote no completed or "
+                        "failed flag in {:.0f} s ('{}'); no longer counted "
+                        "in flight".format(job.job_name, job.pipeline,
+                                           self.max_wait, MAX_JOB_WAIT_KEY))
+        return True
+
+    def wait(self, pipeline=None):
+        """
+        Wait until a job of the pipeline can be submitted within the caps.
+
+        :param str pipeline: name of the pipeline of the job to submit
+        :return float: time in seconds spent waiting
+        """
+        if not self._full(pipeline):
+            return 0.0
+        self.update()
+        if not self._full(pipeline):
+            return 0.0
+        _LOGGER.info("{} jobs in flight ({} of pipeline '{}'); waiting for "
+                     "jobs to finish".format(len(self._jobs),
+                                             self.in_flight(pipeline),
+                                             pipeline))
+        start = time.monotonic()
+        while self._full(pipeline):
+            time.sleep(self.interval)
+            self.update()
+        waited = time.monotonic() - start
+        _LOGGER.info("{} jobs in flight; resuming submission after {:.0f} s".
+                     format(len(self._jobs), waited))
+        return waited
+
+    def _full(self, pipeline):
+        """
+        :param str pipeline: name of the pipeline of the job to submit
+        :return bool: whether the global or pipeline cap is reached
+        """
+        if self.limit is not None and len(self._jobs) >= self.limit:
+            return True
+        limit = self._pipeline_limits.get(pipeline)
+        return limit is not None and self.in_flight(pipeline) >= limit
+
+    def _queued_names(self):
+        """
+        Run the job names command.
+
+        :return set[str] | NoneType: names of the jobs in the scheduler
+            queue, None if the command failed
+        """
+        try:
+            with timed("queue_poll"):
+                out = subprocess.check_output(self.names_command, shell=True,
+                                              universal_newlines=True)
+        except subprocess.CalledProcessError as e:
+            _LOGGER.warning("Failed to list the queued jobs with '{}': {}".
+                            format(self.names_command, e))
+            return None
+        return {line.strip() for line in out.splitlines()}
+
+
+class SubmissionThrottle(object):
+    """
+    Combined rate limit, queue backpressure and caps on the jobs in flight,
+    consulted before each job submission, and the retry policy of the
+    submissions. A single throttle is shared by all the submission
+    conductors of a looper invocation, so the limits apply to all its jobs.
+    """
+    def __init__(self, bucket=None, monitor=None, cap=None, retry=None):
+        """
+        :param TokenBucket bucket: rate limiter, if the rate is limited
+        :param QueueMonitor monitor: queue monitor, if there's backpressure
+        :param JobCap cap: caps on the jobs in flight; one with no global cap
+            is created if not provided, for the pipeline caps
+        :param looper.retry.RetryPolicy retry: retries of the transient
+            submission failures; the default policy if not provided
+        """
+        self.bucket = bucket
+        self.monitor = monitor
+        self.cap = cap if cap is not None else JobCap()
+        self.retry = retry if retry is not None else RetryPolicy()
+
+    def __bool__(self):
+        return self.bucket is not None or self.monitor is not None or \
+            self.cap.limited
+
+    def wait(self, pipeline=None):
+        """
+        Wait until a job can be submitted.
+
+        :param str pipeline: name of the pipeline of the job to submit
+        :return float: time in seconds spent waiting
+        """
+        waited = 0.0
+        with timed("throttle"):
+            waited += self.cap.wait(pipeline)
+            if self.monitor is not None:
+                waited += self.monitor.wait()
+            if self.bucket is not None:
+                waited += self.bucket.acquire()
+        return waited
+
+    def record_submission(self, pipeline=None, job_name=None,
+                          finished=None):
+        """
+        Account for a submitted job.
+
+        :param str pipeline: name of the pipeline of the job
+        :param str job_name: name of the job, as listed by the scheduler
+        :param callable finished: function checking whether the job is
+            finished
+        """
+        if self.monitor is not None:
+            self.monitor.record_submission()
+        self.cap.add(pipeline, job_name, finished)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Create a throttle from the compute settings.
+
+        :param Mapping settings: compute settings, e.g. the compute package,
+            with the throttle keys; values may be strings
+        :return SubmissionThrottle: the throttle, possibly with no limits
+        :raise ValueError: if a setting is invalid
+        """
+        settings = throttle_settings(settings)
+        bucket = monitor = None
+        rate = settings.get(SUBMISSION_RATE_KEY)
+        if rate is not None:
+            bucket = TokenBucket(float(rate),
+                                 int(settings.get(SUBMISSION_BURST_KEY, 1)))
+        cmd = settings.get(QUEUE_COMMAND_KEY)
+        if cmd:
+            if settings.get(QUEUE_HIGH_KEY) is None:
+                raise ValueError("'{}' requires '{}'".
+                                 format(QUEUE_COMMAND_KEY, QUEUE_HIGH_KEY))
+            low = settings.get(QUEUE_LOW_KEY)
+            monitor = QueueMonitor(
+                cmd, int(settings[QUEUE_HIGH_KEY]),
+                None if low is None else int(low),
+                float(settings.get(QUEUE_POLL_KEY, DEFAULT_POLL_INTERVAL)))
+        cap = JobCap(settings.get(MAX_JOBS_KEY),
+                     settings.get(JOB_NAMES_COMMAND_KEY),
+                     float(settings.get(QUEUE_POLL_KEY, DEFAULT_POLL_INTERVAL)),
+                     settings.get(MAX_JOB_WAIT_KEY))
+        retry = RetryPolicy(
+            settings.get(SUBMISSION_RETRIES_KEY, DEFAULT_RETRIES),
+            settings.get(SUBMISSION_BACKOFF_KEY, DEFAULT_BACKOFF),
+            settings.get(SUBMISSION_MAX_BACKOFF_KEY, DEFAULT_MAX_BACKOFF),
+            settings.get(RETRY_PATTERNS_KEY))
+        return cls(bucket, monitor, cap, retry)
+
+
+def throttle_settings(settings):
+    """
+    Select the throttle settings from the compute settings.
+
+    :param Mapping settings: compute settings
+    :return dict: throttle settings that are set
+    """
+    return {k: settings[k] for k in THROTTLE_KEYS
+            if k in settings and settings[k] not in (None, "")}
+
+
+def _cap_limit(limit):
+    """
+    Validate a cap on the number of jobs in flight.
+
+    :param int | str limit: the cap, possibly from a config or CLI string
+    :return int | NoneType: the cap, None if not set
+    :raise ValueError: if the cap is not a positive integer
+    """
+    if limit is None:
+        return None
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError("'{}' must be positive; got: {}".
+                         format(MAX_JOBS_KEY, limit))
+    return limit
@@ -0,0 +1,165 @@
+""" Lightweight per-phase timing instrumentation """
+
+import json
+import logging
+from contextlib import contextmanager
+from math import ceil
+from random import Random
+from time import perf_counter
+
+from .tracing import TRACER
+
+__all__ = ["PhaseTimings", "TIMINGS", "timed"]
+
+_LOGGER = logging.getLogger(__name__)
+
+# Number of the durations of a phase kept for its percentiles
+RESERVOIR_SIZE = 1024
+
+
+class PhaseTimings(object):
+    """
+    Collection of the durations of named execution phases.
+
+    Each measurement is a single perf_counter call pair and a constant
+    time update of the statistics of the phase, so the instrumentation can
+    stay in the hot path of job submission. The count and total of a phase
+    are exact; its p50 and p95 are computed on demand from a uniform random
+    sample of at most RESERVOIR_SIZE of its durations, so the memory used
+    doesn't grow with the number of samples. If the tracer is enabled,
+    every measured phase is also recorded as a trace span.
+    """
+    def __init__(self):
+        self._durations = {}
+        self._random = Random(0)
+
+    def __contains__(self, name):
+        return name in self._durations
+
+    def __len__(self):
+        return len(self._durations)
+
+    @contextmanager
+    def phase(self, name, **args):
+        """
+        Measure the duration of the wrapped block.
+
+        :param str name: name of the phase the duration is attributed to
+        :param args: span data to record in the trace, e.g. sample and
+            pipeline names; not used for the timings summary. Callable
+            values are called only if the span is recorded, so that costly
+            labels aren't built with the tracer disabled
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - start
+            self.add(name, duration)
+            if TRACER.enabled:
+                TRACER.add(name, start, duration,
+                           {k: v() if callable(v) else v
+                            for k, v in args.items()})
+
+    def add(self, name, seconds):
+        """
+        Record a single duration of a phase.
+
+        :param str name: name of the phase
+        :param float seconds: duration of the phase
+        """
+        try:
+            stats = self._durations[name]
+        except KeyError:
+            stats = self._durations[name] = _PhaseStats()
+        stats.count += 1
+        stats.total += seconds
+        if len(stats.reservoir) < RESERVOIR_SIZE:
+            stats.reservoir.append(seconds)
+        else:
+            # each duration so far is kept with the same probability
+            i = self._random.randrange(stats.count)
+            if i < RESERVOIR_SIZE:
+                stats.reservoir[i] = seconds
+
+    def reset(self):
+        """ Forget all the recorded durations """
+        self._durations = {}
+
+    def summary(self):
+        """
+        Aggregate the recorded durations.
+
+        :return dict[str, dict[str, float]]: mapping of phase names, in the
+            order of first occurrence, to count, total, p50 and p95 duration
+            statistics, in seconds
+        """
+        return {name: _summarize(stats)
+                for name, stats in self._durations.items()}
+
+    def report(self):
+        """
+        Format the summary as a compact table.
+
+        :return str: table with one phase per line
+        """
+        summary = self.summary()
+        if not summary:
+            return ""
+        width = max(len(name) for name in summary)
+        lines = ["{:<{w}}  {:>8}  {:>10}  {:>10}  {:>10}".format(
+            "phase", "count", "total (s)", "p50 (ms)", "p95 (ms)", w=width)]
+        for name, stats in summary.items():
+            lines.append("{:<{w}}  {:>8}  {:>10.3f}  {:>10.3f}  {:>10.3f}".format(
+                name, stats["count"], stats["total"], stats["p50"] * 1000,
+                stats["p95"] * 1000, w=width))
+        return "\n".join(lines)
+
+    def write(self, path):
+        """
+        Write the summary to a JSON file.
+
+        :param str path: path to the file to write
+        """
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=4)
+        _LOGGER.info("Timings written to: {}".format(path))
+
+
+class _PhaseStats(object):
+    """ Count, total and sampled durations of a phase """
+    __slots__ = ("count", "total", "reservoir")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.reservoir = []
+
+
+def _summarize(stats):
+    """
+    Compute statistics of the durations of a phase.
+
+    :param _PhaseStats stats: recorded statistics of the phase
+    :return dict[str, float]: count, total, p50 and p95 of the durations
+    """
+    ordered = sorted(stats.reservoir)
+    return {"count": stats.count,
+            "total": stats.total,
+            "p50": _percentile(ordered, 50),
+            "p95": _percentile(ordered, 95)}
+
+
+def _percentile(ordered, q):
+    """
+    Nearest-rank percentile of sorted values.
+
+    :param list[float] ordered: sorted values
+    :param int q: percentile to compute, 0-100
+    :return float: percentile value
+    """
+    return ordered[max(0, int(ceil(q / 100.0 * len(ordered))) - 1)]
+
+
+TIMINGS = PhaseTimings()
+timed = TIMINGS.phase
@@ -0,0 +1,64 @@
+""" Chrome trace-event export of the execution spans """
+
+import json
+import logging
+import os
+import threading
+from time import perf_counter
+
+__all__ = ["Tracer", "TRACER"]
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Tracer(object):
+    """
+    Recorder of spans in the Chrome trace-event format.
+
+    The produced JSON file can be opened in Perfetto (https://ui.perfetto.dev)
+    or chrome://tracing. Each span is a complete ("X") event; nesting is
+    inferred by the viewers from the timestamps. The tracer is disabled by
+    default and records nothing until enabled.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._events = []
+        self._origin = perf_counter()
+
+    def enable(self):
+        """ Start recording spans, timestamps are relative to this call """
+        self.enabled = True
+        self._events = []
+        self._origin = perf_counter()
+
+    def add(self, name, start, duration, args=None):
+        """
+        Record a complete span.
+
+        :param str name: name of the span
+        :param float start: perf_counter value at the start of the span
+        :param float duration: duration of the span, in seconds
+        :param dict args: additional span data, e.g. sample and pipeline names
+        """
+        event = {"name": name, "cat": "looper", "ph": "X",
+                 "ts": round((start - self._origin) * 1e6, 3),
+                 "dur": round(duration * 1e6, 3),
+                 "pid": os.getpid(), "tid": threading.get_ident()}
+        if args:
+            event["args"] = {k: v for k, v in args.items() if v is not None}
+        self._events.append(event)
+
+    def write(self, path):
+        """
+        Write the recorded spans to a trace-event JSON file.
+
+        :param str path: path to the file to write
+        """
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self._events,
+                       "displayTimeUnit": "ms"}, f)
+        _LOGGER.info("Trace ({} spans) written to: {}".
+                     format(len(self._events), path))
+
+
+TRACER = Tracer()
@@ -6,10 +6,6 @@ import glob
 import os
 from .const import *
 from .exceptions import MisconfigurationException
-from peppy.const import *
-from peppy import Project as peppyProject
-import jinja2
-import yaml
 import argparse
 from ubiquerg import convert_value, expandpath
 
@@ -98,6 +94,7 @@ def grab_project_data(prj):
     :param Project prj: Project from which to grab data
     :return Mapping: Sample-independent data sections from given Project
     """
+    from peppy.const import CONFIG_KEY
     if not prj:
         return {}
 
@@ -117,6 +114,7 @@ def sample_folder(prj, sample):
         folder path.
     :return str: this Project's root folder for the given Sample
     """
+    from peppy.const import SAMPLE_NAME_ATTR
     return os.path.join(prj.results_folder,
                         sample[SAMPLE_NAME_ATTR])
 
@@ -131,6 +129,7 @@ def get_file_for_project(prj, appendix):
         like 'objs_summary.tsv' for objects summary file
     :return str: path to the file
     """
+    from peppy.const import AMENDMENTS_KEY, NAME_KEY
     fp = os.path.join(prj.output_dir, prj[NAME_KEY])
     if hasattr(prj, AMENDMENTS_KEY) and getattr(prj, AMENDMENTS_KEY):
         fp += '_' + '_'.join(getattr(prj, AMENDMENTS_KEY))
@@ -152,6 +151,8 @@ def jinja_render_template_strictly(template, namespaces):
         Possible namespaces are: looper, project, sample, pipeline
     :return str: rendered command
     """
+    import jinja2
+
     def _finfun(x):
         """
         A callable that can be used to process the result of a variable
@@ -182,6 +183,7 @@ def read_yaml_file(filepath):
     :param str filepath: path to the file to read
     :return dict: read data
     """
+    import yaml
     data = None
     if os.path.exists(filepath):
         with open(filepath, 'r') as f:
@@ -189,7 +191,24 @@ def read_yaml_file(filepath):
     return data
 
 
-def enrich_args_via_cfg(parser_args, aux_parser):
+def read_project_config(config_file, amendments=None):
+    """
+    Parse the project config file, without creating the samples.
+
+    The result can be used to set the arguments with enrich_args_via_cfg and
+    then to build the looper.Project, so that the config (and the configs it
+    imports) is read only once.
+
+    :param str config_file: path to the project config file
+    :param Iterable[str] amendments: names of the amendments to activate
+    :return peppy.Project: project with the parsed config and no samples
+    """
+    from peppy import Project as peppyProject
+    return peppyProject(config_file, defer_samples_creation=True,
+                        amendments=amendments)
+
+
+def enrich_args_via_cfg(parser_args, aux_parser, prj_cfg=None):
     """
     Read in a looper dotfile and set arguments.
 
@@ -198,11 +217,15 @@ def enrich_args_via_cfg(parser_args, aux_parser):
     :param argparse.Namespace parser_args: parsed args by the original parser
     :param argparse.Namespace aux_parser: parsed args by the a parser
         with defaults suppressed
+    :param peppy.Project prj_cfg: project config parsed beforehand with
+        read_project_config; the config file is read if not provided
     :return argparse.Namespace: selected argument values
     """
-    cfg_args_all = \
-        _get_subcommand_args(parser_args) \
-            if os.path.exists(parser_args.config_file) else dict()
+    if prj_cfg is None and os.path.exists(parser_args.config_file):
+        prj_cfg = read_project_config(parser_args.config_file,
+                                      parser_args.amend)
+    cfg_args_all = _get_subcommand_args(parser_args, prj_cfg) \
+        if prj_cfg is not None else dict()
     result = argparse.Namespace()
     cli_args, _ = aux_parser.parse_known_args()
     for dest in vars(parser_args):
@@ -221,7 +244,7 @@ def enrich_args_via_cfg(parser_args, aux_parser):
     return result
 
 
-def _get_subcommand_args(parser_args):
+def _get_subcommand_args(parser_args, cfg):
     """
     Get the union of values for the subcommand arguments from
     Project.looper, Project.looper.cli.<subcommand> and Project.looper.cli.all.
@@ -232,18 +255,18 @@ def _get_subcommand_args(parser_args):
     destinations.
 
     :param argparser.Namespace parser_args: argument namespace
+    :param peppy.Project cfg: project with the parsed config; it's not
+        modified
     :return dict: mapping of argument destinations to their values
     """
+    from peppy.const import CONFIG_KEY
     args = dict()
-    cfg = peppyProject(parser_args.config_file,
-                       defer_samples_creation=True,
-                       amendments=parser_args.amend)
     if CONFIG_KEY in cfg and LOOPER_KEY in cfg[CONFIG_KEY] \
             and CLI_KEY in cfg[CONFIG_KEY][LOOPER_KEY]:
         try:
             cfg_args = cfg[CONFIG_KEY][LOOPER_KEY][CLI_KEY] or dict()
-            args = cfg_args[ALL_SUBCMD_KEY] or dict() \
-                if ALL_SUBCMD_KEY in cfg_args else dict()
+            args = dict(cfg_args[ALL_SUBCMD_KEY] or dict()
+                        if ALL_SUBCMD_KEY in cfg_args else dict())
             args.update(cfg_args[parser_args.command] or dict()
                         if parser_args.command in cfg_args else dict())
         except (TypeError, KeyError, AttributeError, ValueError) as e:
@@ -252,9 +275,8 @@ def _get_subcommand_args(parser_args):
                     format(LOOPER_KEY, CLI_KEY, getattr(e, 'message', repr(e))))
     if CONFIG_KEY in cfg and LOOPER_KEY in cfg[CONFIG_KEY]:
         try:
-            if CLI_KEY in cfg[CONFIG_KEY][LOOPER_KEY]:
-                del cfg[CONFIG_KEY][LOOPER_KEY][CLI_KEY]
-            args.update(cfg[CONFIG_KEY][LOOPER_KEY])
+            args.update({k: v for k, v in cfg[CONFIG_KEY][LOOPER_KEY].items()
+                         if k != CLI_KEY})
         except (TypeError, KeyError, AttributeError, ValueError) as e:
             raise MisconfigurationException(
                 "Invalid '{}' section in the config. Caught exception: {}".
@@ -282,6 +304,7 @@ def init_dotfile(path, cfg_path, force=False):
         OSError("Provided config path is invalid. You must provide path "
                 "that is either absolute or relative to: {}".
                 format(os.path.dirname(path)))
+    import yaml
     relpath = os.path.relpath(cfg_path, os.path.dirname(path))
     with open(path, 'w') as dotfile:
         yaml.dump({DOTFILE_CFG_PTH_KEY: relpath}, dotfile)
@@ -297,6 +320,7 @@ def read_cfg_from_dotfile():
     :raise MisconfigurationException: if the dotfile does not consist of the
         required key pointing to the PEP
     """
+    import yaml
     dp = dotfile_path(must_exist=True)
     with open(dp, 'r') as dotfile:
         dp_data = yaml.safe_load(dotfile)
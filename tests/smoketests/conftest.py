@@ -54,7 +54,9 @@ def subp_exec(pth=None, cmd=None, appendix=list(), dry=True):
     :param Iterable[str] appendix: other args to pass to the cmd
     :return:
     """
-    x = ["looper", cmd, "-d" if dry else ""]
+    x = ["looper", cmd]
+    if dry:
+        x.append("-d")
     if pth:
         x.append(pth)
     x.extend(appendix)
@@ -1,7 +1,13 @@
 import pytest
+import sys
 from tests.smoketests.conftest import *
 from looper.const import FLAGS
 from peppy import Project
+from looper.project import Project as LooperProject, fetch_samples
+from looper.retry import RetryPolicy, SubmissionFailure
+from looper.throttle import JobCap, QueueMonitor, SubmissionThrottle, \
+    TokenBucket
+from looper.utils import read_project_config
 
 
 def _make_flags(cfg, type, count):
@@ -49,3 +55,190 @@ class LooperCheckTests:
         print(stderr)
         for f in FLAGS:
             assert "{}: {}".format(f.upper(), "0") in stderr
+
+
+def _imported_modules(args):
+    """
+    Run looper under 'python -X importtime' and collect the imported modules
+
+    :param Iterable[str] args: looper command-line arguments
+    :return set[str]: names of the imported top-level modules and looper
+        submodules
+    """
+    proc = subprocess.Popen([sys.executable, "-X", "importtime", "-m",
+                             "looper"] + list(args),
+                            stderr=subprocess.PIPE, stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    _, stderr = proc.communicate()
+    assert proc.returncode == 0, stderr
+    mods = set()
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            name = line.split("|")[2].strip()
+            mods.add(name if name.startswith("looper.")
+                     else name.split(".")[0])
+    return mods
+
+
+class LooperStartupTests:
+    def test_version_imports(self):
+        """ Verify that the heavy dependencies are not imported at startup """
+        mods = _imported_modules(["--version"])
+        assert "looper.looper" in mods
+        assert not mods & {"pandas", "jinja2", "jsonschema", "colorama",
+                           "divvy", "eido", "peppy", "yaml",
+                           "looper.html_reports", "looper.conductor",
+                           "looper.project"}
+
+    def test_check_imports(self, prep_temp_pep):
+        """ Verify that check does not import the submission and reporting """
+        mods = _imported_modules(["check", prep_temp_pep])
+        assert "looper.project" in mods
+        assert not mods & {"jinja2", "looper.html_reports",
+                           "looper.conductor"}
+
+
+class LooperProjectConfigTests:
+    def test_project_from_parsed_config(self, prep_temp_pep):
+        """ Verify that the project built from a parsed config is the same """
+        tp = prep_temp_pep
+        cfg = read_project_config(tp)
+        p = LooperProject(tp, project_config=cfg)
+        assert p[CONFIG_KEY] is cfg[CONFIG_KEY]
+        ref = LooperProject(tp)
+        assert p[CONFIG_KEY].to_dict() == ref[CONFIG_KEY].to_dict()
+        assert [s.sample_name for s in p.samples] == \
+            [s.sample_name for s in ref.samples]
+
+
+class LooperSampleSelectionTests:
+    @pytest.mark.parametrize("include,exclude,expected", [
+        ("PROTO1", None, ["sample1", "sample2"]),
+        (["PROTO2", "bogus"], None, ["sample3"]),
+        (None, "PROTO1", ["sample3"]),
+        (None, ["bogus"], ["sample1", "sample2", "sample3"])])
+    def test_fetch_samples(self, prep_temp_pep, include, exclude, expected):
+        """ Verify the selection on an attribute with a columnar view """
+        p = LooperProject(prep_temp_pep)
+        samples = fetch_samples(p, selector_attribute="protocol",
+                                selector_include=include,
+                                selector_exclude=exclude)
+        assert [s.sample_name for s in samples] == expected
+
+    def test_fetch_samples_missing_attribute(self, prep_temp_pep):
+        """ Verify that selection on an attribute no sample has fails """
+        p = LooperProject(prep_temp_pep)
+        with pytest.raises(AttributeError):
+            fetch_samples(p, selector_attribute="bogus",
+                          selector_include="x")
+
+
+class LooperSampleRegistryTests:
+    def test_interfaces_shared_by_samples(self, prep_temp_pep):
+        """ Verify that samples get the same pipeline interface objects """
+        p = LooperProject(prep_temp_pep)
+        registry = p.sample_registry
+        assert registry.num_samples == len(p.samples)
+        assert registry.num_interfaces == len(p.pipeline_interfaces) == 2
+        assert registry.num_assignments == 2 * len(p.samples)
+        for s in p.samples:
+            pifaces = p.get_sample_piface(s.sample_name)
+            assert all(a is b for a, b in zip(pifaces, registry.interfaces))
+        assert list(registry.sample_ids(0)) == list(range(len(p.samples)))
+
+
+class LooperThrottleTests:
+    def test_burst_not_delayed(self):
+        """ Verify that a burst of submissions doesn't wait for the rate """
+        bucket = TokenBucket(rate=0.01, burst=3)
+        assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+
+    def test_queue_depth_counts_submissions(self):
+        """ Verify that submissions between polls add to the queue depth """
+        monitor = QueueMonitor("echo 3", high=5, interval=60)
+        assert monitor.wait() == 0
+        monitor.record_submission()
+        assert monitor.depth() == 4
+
+    def test_pipeline_cap_counts_unfinished_jobs(self):
+        """ Verify that only the unfinished jobs of a pipeline are counted """
+        cap = JobCap()
+        cap.set_limit("PIPELINE1", 2)
+        cap.add("PIPELINE1", "job1", finished=lambda: True)
+        cap.add("PIPELINE1", "job2", finished=lambda: False)
+        cap.add("PIPELINE2", "job3", finished=lambda: False)
+        assert cap.in_flight("PIPELINE1") == 2
+        assert cap.wait("PIPELINE1") == 0
+        assert cap.in_flight("PIPELINE1") == 1
+        assert len(cap) == 2
+
+    def test_queue_command_requires_high_mark(self):
+        """ Verify that the queue command is not used with no limit """
+        with pytest.raises(ValueError):
+            SubmissionThrottle.from_settings({"queue_command": "echo 0"})
+
+
+class LooperSubmissionRetryTests:
+    def test_transient_failure_retried(self, tmp_path):
+        """ Verify that a transient failure is retried until it succeeds """
+        marker = str(tmp_path / "tried")
+        cmd = "test -f {0} || {{ touch {0}; echo 'Socket timed out' >&2; " \
+              "exit 1; }}".format(marker)
+        policy = RetryPolicy(retries=2, backoff=0.01)
+        assert policy.submit(cmd + "; echo 'Submitted batch job 7'") == \
+            "Submitted batch job 7\n"
+        assert policy.num_retries == policy.recovered == 1
+
+    @pytest.mark.parametrize("message,retries", [
+        ("Socket timed out", 2), ("invalid partition", 0)])
+    def test_failure_retries(self, message, retries):
+        """ Verify that only the transient failures are retried """
+        policy = RetryPolicy(retries=2, backoff=0.01)
+        with pytest.raises(SubmissionFailure) as e:
+            policy.submit("echo '{}' >&2; exit 1".format(message))
+        assert e.value.retries == policy.num_retries == retries
+        assert e.value.transient == bool(retries)
+
+
+class LooperProjectCacheTests:
+    def test_snapshot_reused_and_invalidated(self, prep_temp_pep):
+        """ Verify that the snapshot is used until a project input changes """
+        tp = prep_temp_pep
+        cache_dir = os.path.join(os.path.dirname(tp), "cache")
+        appendix = ["--project-cache", cache_dir]
+        stdout, stderr, rc = subp_exec(tp, "check", appendix)
+        assert rc == 0
+        assert "Using project snapshot" not in stderr
+        assert len(os.listdir(cache_dir)) == 1
+        stdout, stderr, rc = subp_exec(tp, "check", appendix)
+        assert rc == 0
+        assert "Using project snapshot" in stderr
+        with open(os.path.join(os.path.dirname(tp), ST), "a") as f:
+            f.write("\n")
+        stdout, stderr, rc = subp_exec(tp, "check", appendix)
+        assert rc == 0
+        assert "snapshot is outdated" in stderr
+        assert "Using project snapshot" not in stderr
+
+    def test_snapshot_invalidated_by_environment(self, prep_temp_pep,
+                                                 monkeypatch):
+        """
+        Verify that the snapshot isn't used once an environment variable
+        referenced by the config changes
+        """
+        tp = prep_temp_pep
+        cache_dir = os.path.join(os.path.dirname(tp), "cache")
+        appendix = ["--project-cache", cache_dir]
+        with mod_yaml_data(tp) as config_data:
+            config_data[SAMPLE_MODS_KEY][DERIVED_KEY][DERIVED_SOURCES_KEY][
+                "IN"] = "$LOOPER_TEST_DATA/{sample_name}.in"
+        monkeypatch.setenv("LOOPER_TEST_DATA", "/data/a")
+        stdout, stderr, rc = subp_exec(tp, "check", appendix)
+        assert rc == 0
+        stdout, stderr, rc = subp_exec(tp, "check", appendix)
+        assert "Using project snapshot" in stderr
+        monkeypatch.setenv("LOOPER_TEST_DATA", "/data/b")
+        stdout, stderr, rc = subp_exec(tp, "check", appendix)
+        assert rc == 0
+        assert "Environment variable changed" in stderr
+        assert "Using project snapshot" not in stderr
@@ -1,3 +1,5 @@
+import json
+import re
 import pytest
 from tests.smoketests.conftest import *
 from peppy.const import *
@@ -8,6 +10,28 @@ from yaml import dump
 CMD_STRS = ["string", " --string", " --sjhsjd 212", "7867#$@#$cc@@"]
 
 
+def _stub_settings(td):
+    """
+    Write compute settings with a submission command that records its
+    arguments in the 'subs' file and reports consecutive job IDs
+    """
+    stub = os.path.join(td, "submit.sh")
+    subs = os.path.join(td, "subs")
+    with open(stub, "w") as f:
+        f.write("echo \"$@\" >> {0}\n".format(subs))
+        f.write("echo \"Submitted batch job $(wc -l < {0})\"\n".format(subs))
+    settings = os.path.join(td, "settings.yaml")
+    with open(settings, "w") as f:
+        f.write("submission_command: sh {}\n".format(stub))
+        f.write("dependency_template: '--dependency=afterok:{job_ids}'\n")
+    return settings
+
+
+def _read_subs(td):
+    with open(os.path.join(td, "subs")) as f:
+        return f.read().splitlines()
+
+
 class LooperBothRunsTests:
     @pytest.mark.parametrize("cmd", ["run", "runp"])
     def test_looper_cfg_invalid(self, cmd):
@@ -70,6 +94,49 @@ class LooperBothRunsTests:
         assert rc == 0
         os.remove(dotfile_path)
 
+    @pytest.mark.parametrize("cmd", ["run", "runp"])
+    def test_timings_file_written(self, prep_temp_pep, cmd):
+        tp = prep_temp_pep
+        timings_path = os.path.join(os.path.dirname(tp), "timings.json")
+        stdout, stderr, rc = subp_exec(tp, cmd, ["--timings", timings_path])
+        print(stderr)
+        assert rc == 0
+        with open(timings_path, "r") as f:
+            timings = json.load(f)
+        assert timings["project"]["count"] == 1
+        assert all(k in timings["write_script"]
+                   for k in ["count", "total", "p50", "p95"])
+
+    @pytest.mark.parametrize("cmd", ["run", "runp"])
+    def test_trace_file_written(self, prep_temp_pep, cmd):
+        tp = prep_temp_pep
+        trace_path = os.path.join(os.path.dirname(tp), "trace.json")
+        stdout, stderr, rc = subp_exec(tp, cmd, ["--trace", trace_path])
+        print(stderr)
+        assert rc == 0
+        with open(trace_path, "r") as f:
+            events = json.load(f)["traceEvents"]
+        assert all(e["ph"] == "X" for e in events)
+        assert any(e["name"] == "write_script" and "pipeline" in e["args"]
+                   for e in events)
+        if cmd == "run":
+            assert any(e["name"] == "write_script" and
+                       e["args"]["sample"] == "sample1" for e in events)
+
+    @pytest.mark.parametrize("cmd", ["run", "runp"])
+    def test_cpu_profile_written(self, prep_temp_pep, cmd):
+        tp = prep_temp_pep
+        stdout, stderr, rc = subp_exec(tp, cmd, ["--profile"])
+        print(stderr)
+        written = []
+        for ext in [".pstats", ".collapsed"]:
+            profile_path = os.path.join(os.getcwd(), "looper_" + cmd + ext)
+            if os.path.isfile(profile_path):
+                written.append(ext)
+                os.remove(profile_path)
+        assert rc == 0
+        assert written == [".pstats", ".collapsed"]
+
 
 class LooperRunBehaviorTests:
     def test_looper_run_basic(self, prep_temp_pep):
@@ -229,6 +296,243 @@ class LooperRunBehaviorTests:
             [os.path.join(sd, f) for f in os.listdir(sd) if f.endswith(".sub")]
         is_in_file(subs_list, arg, reverse=True)
 
+    def test_job_cap_stale_job(self, prep_temp_pep):
+        """
+        Verify that a job that never writes a flag stops counting towards
+        the cap on the jobs in flight after the maximum job wait
+        """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        stdout, stderr, rc = subp_exec(
+            tp, "run", ["-s", _stub_settings(td), "--max-concurrent-jobs", "1",
+                        "-c", "max_job_wait=0.2", "queue_poll_interval=0.1"],
+            dry=False)
+        print(stderr)
+        assert rc == 0
+        assert len(_read_subs(td)) == 6
+        assert stderr.count("no longer counted in flight") == 5
+
+    def test_pipeline_depends_on(self, prep_temp_pep):
+        """ Verify that a dependent pipeline is submitted after its upstream """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        with mod_yaml_data(os.path.join(td, PIS.format("1"))) as piface_data:
+            piface_data[DEPENDS_ON_KEY] = "OTHER_PIPELINE2"
+        stdout, stderr, rc = subp_exec(tp, "run", ["-s", _stub_settings(td)],
+                                       dry=False)
+        print(stderr)
+        assert rc == 0
+        subs = _read_subs(td)
+        assert len(subs) == 6
+        assert subs[0].endswith("OTHER_PIPELINE2_sample1.sub")
+        assert subs[1].startswith("--dependency=afterok:1 ")
+        assert subs[1].endswith("PIPELINE1_sample1.sub")
+
+    def test_pipeline_depends_on_no_template(self, prep_temp_pep):
+        """
+        Verify that with no dependency template, the dependent jobs are
+        submitted once all the upstream jobs are, as they finish
+        """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        with mod_yaml_data(os.path.join(td, PIS.format("1"))) as piface_data:
+            piface_data[DEPENDS_ON_KEY] = "OTHER_PIPELINE2"
+        results = os.path.join(get_outdir(tp), "results_pipeline")
+        stub = os.path.join(td, "submit.sh")
+        subs = os.path.join(td, "subs")
+        with open(stub, "w") as f:
+            # the job writes its completed flag a bit after the submission
+            f.write("echo \"$@\" >> {0}\n".format(subs))
+            f.write("n=$(basename \"$1\" .sub)\n")
+            f.write("(sleep 0.3; mkdir -p {0}/${{n##*_}}; "
+                    "touch {0}/${{n##*_}}/${{n%_*}}_completed.flag) "
+                    ">/dev/null 2>&1 &\n".format(results))
+            f.write("echo \"Submitted batch job $(wc -l < {0})\"\n".
+                    format(subs))
+        settings = os.path.join(td, "settings.yaml")
+        with open(settings, "w") as f:
+            f.write("submission_command: sh {}\n".format(stub))
+            f.write("dependency_poll_interval: 0.1\n")
+        stdout, stderr, rc = subp_exec(tp, "run", ["-s", settings], dry=False)
+        print(stderr)
+        assert rc == 0
+        subs = _read_subs(td)
+        assert len(subs) == 6
+        assert all("OTHER_PIPELINE2" in s for s in subs[:3])
+        assert subs[3].endswith("PIPELINE1_sample1.sub")
+
+    def test_pipeline_scatter(self, prep_temp_pep):
+        """ Verify that a sample is split into shards, followed by a gather """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        with mod_yaml_data(os.path.join(td, PIS.format("1"))) as piface_data:
+            piface_data["command_template"] += \
+                " --shard {looper.shard} --out {looper.sample_output_folder}"
+            piface_data[SCATTER_KEY] = {
+                SCATTER_SHARDS_KEY: 2,
+                GATHER_CMD_KEY: "gather --shards {looper.shards}"}
+        stdout, stderr, rc = subp_exec(tp, "run", ["-s", _stub_settings(td)],
+                                       dry=False)
+        print(stderr)
+        assert rc == 0
+        subs = _read_subs(td)
+        assert len(subs) == 12
+        assert subs[0].endswith("PIPELINE1_sample1_shard1.sub")
+        assert subs[2].startswith("--dependency=afterok:1:2 ")
+        assert subs[2].endswith("PIPELINE1_sample1_gather.sub")
+        sd = os.path.join(get_outdir(tp), "submission")
+        is_in_file(os.path.join(sd, "PIPELINE1_sample1_shard2.sub"),
+                   "--shard 1")
+        is_in_file(os.path.join(sd, "PIPELINE1_sample1_gather.sub"),
+                   "gather --shards 0 1")
+        is_in_file(os.path.join(sd, "PIPELINE1_sample1_shard2.sub"),
+                   os.path.join("sample1", "shard2"))
+
+    def test_pipeline_scatter_no_template(self, prep_temp_pep):
+        """ Verify that scattering requires a dependency template """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        with mod_yaml_data(os.path.join(td, PIS.format("1"))) as piface_data:
+            piface_data[SCATTER_KEY] = {SCATTER_SHARDS_KEY: 2}
+        stdout, stderr, rc = subp_exec(
+            tp, "run",
+            ["-s", _stub_settings(td), "-c", "dependency_template="],
+            dry=False)
+        print(stderr)
+        assert rc != 0
+        assert "dependency_template" in stderr
+        assert not os.path.exists(os.path.join(td, "subs"))
+
+    def test_resource_history(self, prep_temp_pep):
+        """
+        Verify that the resources of a sample job are derived from the
+        profile of its last successful run, and that the other samples get
+        the size-based ones
+        """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        with mod_yaml_data(os.path.join(td, PIS.format("1"))) as piface_data:
+            piface_data["command_template"] += " --mem {compute.mem}"
+            piface_data[COMPUTE_KEY] = {
+                SIZE_DEP_VARS_KEY: "resources-sample.tsv",
+                RESOURCE_HISTORY_KEY: {HEADROOM_KEY: 2}}
+        sample_dir = os.path.join(get_outdir(tp), "results_pipeline",
+                                  "sample1")
+        os.makedirs(sample_dir)
+        with open(os.path.join(sample_dir, "PIPELINE1_profile.tsv"), "w") as f:
+            f.write("# Pipeline started\n"
+                    "1\th1\t1\t0:10:00\t0.5\tcmd1\tlock.1\n"
+                    "1\th2\t2\t0:20:00\t1.25\tcmd2\tlock.2\n")
+        open(os.path.join(sample_dir, "PIPELINE1_completed.flag"), "w").close()
+        stdout, stderr, rc = subp_exec(tp, "run", ["-i"])
+        print(stderr)
+        assert rc == 0
+        sd = os.path.join(get_outdir(tp), "submission")
+        is_in_file(os.path.join(sd, "PIPELINE1_sample1.sub"), "--mem 2500")
+        is_in_file(os.path.join(sd, "PIPELINE1_sample2.sub"), "--mem 8000")
+        stdout, stderr, rc = subp_exec(tp, "resources")
+        print(stderr)
+        assert rc == 0
+        assert re.search(r"sample1 .* 2500 .* history", stderr)
+        with mod_yaml_data(tp) as config_data:
+            config_data[LOOPER_KEY][COMPUTE_KEY] = {
+                RESOURCES_KEY: {"mem": 1000}}
+        stdout, stderr, rc = subp_exec(tp, "resources")
+        print(stderr)
+        assert rc == 0
+        assert re.search(r"sample1 .* 1000 .* project", stderr)
+
+    def test_resource_model(self, prep_temp_pep):
+        """
+        Verify that the resources of a sample that has never run are
+        predicted from its input size by the model fitted on the runs of
+        the other samples
+        """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        with open(os.path.join(td, "input_schema.yaml"), "w") as f:
+            dump({"properties": {"samples": {"type": "array", "items": {
+                "type": "object", "properties": {"infile": {"type": "string"}},
+                "files": ["infile"]}}}, "required": ["samples"]}, f)
+        with mod_yaml_data(os.path.join(td, PIS.format("1"))) as piface_data:
+            piface_data["command_template"] += \
+                " --mem {compute.mem} --time {compute.time}"
+            piface_data["input_schema"] = "input_schema.yaml"
+            piface_data[COMPUTE_KEY] = {
+                SIZE_DEP_VARS_KEY: "resources-sample.tsv",
+                RESOURCE_MODEL_KEY: {HEADROOM_KEY: 2, MIN_SAMPLES_KEY: 2}}
+        with mod_yaml_data(tp) as config_data:
+            config_data[SAMPLE_MODS_KEY][CONSTANT_KEY]["infile"] = "IN"
+            config_data[SAMPLE_MODS_KEY][DERIVED_KEY][DERIVED_ATTRS_KEY].\
+                append("infile")
+            config_data[SAMPLE_MODS_KEY][DERIVED_KEY][DERIVED_SOURCES_KEY][
+                "IN"] = os.path.join(td, "{sample_name}.in")
+        # runtime and memory grow by 5 minutes and 0.5 GB per 1000 bytes
+        for i, size in enumerate([1000, 3000, 5000], 1):
+            with open(os.path.join(td, "sample{}.in".format(i)), "w") as f:
+                f.write("x" * size)
+        for i in [1, 2]:
+            sample_dir = os.path.join(get_outdir(tp), "results_pipeline",
+                                      "sample{}".format(i))
+            os.makedirs(sample_dir)
+            with open(os.path.join(sample_dir, "PIPELINE1_profile.tsv"),
+                      "w") as f:
+                f.write("1\th1\t1\t0:{}:00\t{}\tcmd1\tlock.1\n".format(
+                    5 + 10 * (i - 1), 0.5 + (i - 1)))
+            open(os.path.join(sample_dir, "PIPELINE1_completed.flag"),
+                 "w").close()
+        stdout, stderr, rc = subp_exec(tp, "run")
+        print(stderr)
+        assert rc == 0
+        sd = os.path.join(get_outdir(tp), "submission")
+        assert not os.path.isfile(os.path.join(sd, "PIPELINE1_sample1.sub"))
+        is_in_file(os.path.join(sd, "PIPELINE1_sample3.sub"),
+                   "--mem 5000 --time 00-00:50:00")
+        stdout, stderr, rc = subp_exec(tp, "resources", ["--explain"])
+        print(stderr)
+        assert rc == 0
+        assert "fitted on 2 runs" in stderr
+        assert "sample3  4.65661e-06" in stderr
+
+    def test_compute_packages_balanced(self, prep_temp_pep):
+        """
+        Verify that the jobs are spread across the compute packages by
+        weight, and that a dependent job follows its upstream job
+        """
+        import divvy
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        template = os.path.join(os.path.dirname(divvy.__file__),
+                                "default_config", "divvy_templates",
+                                "localhost_template.sub")
+        packages = {"default": {"submission_template": template,
+                                "submission_command": "sh"}}
+        for name in ["a", "b"]:
+            pkg_dir = os.path.join(td, name)
+            os.makedirs(pkg_dir)
+            _stub_settings(pkg_dir)
+            packages[name] = {
+                "submission_template": template,
+                "submission_command": "sh " + os.path.join(pkg_dir,
+                                                           "submit.sh"),
+                "dependency_template": "--dependency=afterok:{job_ids}"}
+        divcfg = os.path.join(td, "divvy_config.yaml")
+        with open(divcfg, "w") as f:
+            dump({"compute_packages": packages}, f)
+        with mod_yaml_data(os.path.join(td, PIS.format("1"))) as piface_data:
+            piface_data[DEPENDS_ON_KEY] = "OTHER_PIPELINE2"
+        stdout, stderr, rc = subp_exec(
+            tp, "run", ["--divvy", divcfg, "--compute-packages", "a:2,b"],
+            dry=False)
+        print(stderr)
+        assert rc == 0
+        subs_a = _read_subs(os.path.join(td, "a"))
+        subs_b = _read_subs(os.path.join(td, "b"))
+        assert len(subs_a) == 4 and len(subs_b) == 2
+        assert subs_b[0].endswith("OTHER_PIPELINE2_sample2.sub")
+        assert subs_b[1].startswith("--dependency=afterok:1 ")
+        assert subs_b[1].endswith("PIPELINE1_sample2.sub")
+
 
 class LooperRunpBehaviorTests:
     def test_looper_runp_basic(self, prep_temp_pep):
@@ -269,6 +573,104 @@ class LooperRunpBehaviorTests:
         is_in_file(subs_list, arg)
 
 
+    def test_collate_after_sample_jobs(self, prep_temp_pep):
+        """ Verify that run submits the project jobs dependent on the samples """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        stdout, stderr, rc = subp_exec(
+            tp, "run", ["--collate", "-s", _stub_settings(td),
+                        "--pipeline-interfaces",
+                        os.path.join(td, PIP.format("1"))], dry=False)
+        print(stderr)
+        assert rc == 0
+        subs = _read_subs(td)
+        assert len(subs) == 7
+        assert subs[-1].startswith("--dependency=afterok:1:3:5:2:4:6 ")
+
+    def test_collate_gives_up_on_sample_jobs(self, prep_temp_pep):
+        """
+        Verify that with no dependency template, the project job isn't
+        submitted if the sample jobs write no flags by the maximum wait
+        """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        stdout, stderr, rc = subp_exec(
+            tp, "run", ["--collate", "-s", _stub_settings(td),
+                        "--pipeline-interfaces",
+                        os.path.join(td, PIP.format("1")),
+                        "-c", "dependency_template=", "max_job_wait=0.2",
+                        "dependency_poll_interval=0.1"], dry=False)
+        print(stderr)
+        assert "Gave up waiting for 6 jobs" in stderr
+        assert len(_read_subs(td)) == 6
+
+    def test_collate_reduce(self, prep_temp_pep):
+        """ Verify that the samples are collated in chunks, then merged """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        with mod_yaml_data(os.path.join(td, PIP.format("1"))) as piface_data:
+            piface_data["command_template"] += \
+                " --chunk {looper.chunk_samples}"
+            piface_data[REDUCE_KEY] = {
+                REDUCE_CHUNKS_KEY: 2,
+                MERGE_CMD_KEY: "merge --parts {looper.num_chunks}"}
+        stdout, stderr, rc = subp_exec(tp, "runp", ["-s", _stub_settings(td)],
+                                       dry=False)
+        print(stderr)
+        assert rc == 0
+        subs = _read_subs(td)
+        assert len(subs) == 4
+        assert subs[2].startswith("--dependency=afterok:1:2 ")
+        assert subs[2].endswith("PIPELINE1_collate_merge.sub")
+        sd = os.path.join(get_outdir(tp), "submission")
+        is_in_file(os.path.join(sd, "PIPELINE1_collate_chunk2.sub"),
+                   "--chunk sample2 sample3")
+        is_in_file(os.path.join(sd, "PIPELINE1_collate_merge.sub"),
+                   "merge --parts 2")
+
+    def test_collate_reduce_no_template(self, prep_temp_pep):
+        """
+        Verify that the merge job isn't submitted if it can't be made to wait
+        for the partial jobs
+        """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        with mod_yaml_data(os.path.join(td, PIP.format("1"))) as piface_data:
+            piface_data[REDUCE_KEY] = {
+                REDUCE_CHUNKS_KEY: 2,
+                MERGE_CMD_KEY: "merge --parts {looper.num_chunks}"}
+        stdout, stderr, rc = subp_exec(
+            tp, "runp",
+            ["-s", _stub_settings(td), "-c", "dependency_template="],
+            dry=False)
+        print(stderr)
+        assert rc != 0
+        assert "job_status_command" in stderr
+        assert not any(s.endswith("PIPELINE1_collate_merge.sub")
+                       for s in _read_subs(td))
+
+    @pytest.mark.parametrize("fmt", ["tsv", "jsonl"])
+    def test_collate_samples_table(self, prep_temp_pep, fmt):
+        """ Verify that the samples of a project job are written to a table """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        with mod_yaml_data(os.path.join(td, PIP.format("1"))) as piface_data:
+            piface_data["command_template"] += \
+                " --table {looper.samples_table} --n {looper.num_samples}" \
+                " --first {samples[0].sample_name}"
+            piface_data[SAMPLES_TABLE_FORMAT_KEY] = fmt
+        stdout, stderr, rc = subp_exec(tp, "runp")
+        print(stderr)
+        assert rc == 0
+        sd = os.path.join(get_outdir(tp), "submission")
+        table = os.path.join(sd, "PIPELINE1_collate_samples." + fmt)
+        with open(table) as f:
+            lines = f.read().splitlines()
+        assert len(lines) == (4 if fmt == "tsv" else 3)
+        is_in_file(os.path.join(sd, "PIPELINE1_collate.sub"),
+                   "--table {} --n 3 --first sample1".format(table))
+
+
 class LooperRunPreSubmissionHooksTests:
     def test_looper_basic_plugin(self, prep_temp_pep):
         tp = prep_temp_pep
@@ -309,6 +711,50 @@ class LooperRunPreSubmissionHooksTests:
         assert rc == 0
         verify_filecount_in_dir(sd, "test.txt", 3)
 
+    def test_looper_server_command_template_hook(self, prep_temp_pep):
+        tp = prep_temp_pep
+        log = os.path.join(get_outdir(tp), "submission", "hook_server.txt")
+        cmd = "while read ns; do echo $$ >> " + log + \
+              "; {%raw%}echo {}{%endraw%}; done"
+        for path in {piface["pipe_iface_file"] for piface in
+                     Project(tp).pipeline_interfaces}:
+            with mod_yaml_data(path) as piface_data:
+                piface_data[PRE_SUBMIT_HOOK_KEY][PRE_SUBMIT_SERVER_KEY] = cmd
+        stdout, stderr, rc = subp_exec(tp, "run")
+        print(stderr)
+        assert rc == 0
+        with open(log, "r") as f:
+            pids = f.read().split()
+        # one request per submission, one server per pipeline interface
+        assert len(pids) == 6
+        assert len(set(pids)) == 2
+
+    def test_looper_server_stopped_on_failure(self, prep_temp_pep):
+        """
+        Verify that the pre-submission hook server is stopped before looper
+        exits, when the run fails
+        """
+        tp = prep_temp_pep
+        td = os.path.dirname(tp)
+        log = os.path.join(td, "hook_server.txt")
+        # the server takes a while to exit once its input is closed; it
+        # doesn't hold the looper error output open
+        cmd = "exec 2>/dev/null; " \
+              "while read ns; do {%raw%}echo {}{%endraw%}; done; " \
+              "sleep 1; echo exited >> " + log
+        with mod_yaml_data(os.path.join(td, PIS.format("1"))) as piface_data:
+            piface_data[PRE_SUBMIT_HOOK_KEY][PRE_SUBMIT_SERVER_KEY] = cmd
+            # scattering with no dependency template fails the run
+            piface_data[SCATTER_KEY] = {SCATTER_SHARDS_KEY: 2}
+        stdout, stderr, rc = subp_exec(
+            tp, "run",
+            ["-s", _stub_settings(td), "-c", "dependency_template="],
+            dry=False)
+        print(stderr)
+        assert rc != 0
+        assert "Starting pre-submit server" in stderr
+        is_in_file(log, "exited")
+
 
 class LooperRunSubmissionScriptTests:
     def test_looper_run_produces_submission_scripts(self, prep_temp_pep):
@@ -339,6 +785,95 @@ class LooperRunSubmissionScriptTests:
         verify_filecount_in_dir(sd, ".sub", 4)
 
 
+class LooperRerunTests:
+    def test_rerun_submits_failed_only(self, prep_temp_pep):
+        """ Verify that only the pipelines with failed flags are rerun """
+        tp = prep_temp_pep
+        sf = os.path.join(get_outdir(tp), "results_pipeline", "sample1")
+        os.makedirs(sf)
+        open(os.path.join(sf, "PIPELINE1_failed.flag"), 'a').close()
+        stdout, stderr, rc = subp_exec(tp, "rerun")
+        sd = os.path.join(get_outdir(tp), "submission")
+        print(stderr)
+        assert rc == 0
+        verify_filecount_in_dir(sd, ".sub", 1)
+        assert os.path.isfile(os.path.join(sd, "PIPELINE1_sample1.sub"))
+
+    def test_run_skips_flagged(self, prep_temp_pep):
+        """ Verify that run skips the pipelines with flags """
+        tp = prep_temp_pep
+        sf = os.path.join(get_outdir(tp), "results_pipeline", "sample1")
+        os.makedirs(sf)
+        open(os.path.join(sf, "PIPELINE1_completed.flag"), 'a').close()
+        stdout, stderr, rc = subp_exec(tp, "run")
+        sd = os.path.join(get_outdir(tp), "submission")
+        print(stderr)
+        assert rc == 0
+        verify_filecount_in_dir(sd, ".sub", 5)
+        assert not os.path.isfile(os.path.join(sd, "PIPELINE1_sample1.sub"))
+
+
+class LooperPlanApplyTests:
+    def test_plan_lists_jobs(self, prep_temp_pep):
+        """ Verify that plan writes the jobs to the plan file """
+        tp = prep_temp_pep
+        stdout, stderr, rc = subp_exec(tp, "plan", dry=False)
+        sd = os.path.join(get_outdir(tp), "submission")
+        print(stderr)
+        assert rc == 0
+        verify_filecount_in_dir(sd, ".sub", 6)
+        with open(os.path.join(sd, "looper_plan.jsonl")) as f:
+            jobs = [json.loads(line) for line in f][1:]
+        assert len(jobs) == 6
+        assert all(os.path.isfile(j["script"]) for j in jobs)
+
+    def test_plan_shard(self, prep_temp_pep):
+        """ Verify that a shard of the samples is planned """
+        tp = prep_temp_pep
+        stdout, stderr, rc = subp_exec(tp, "plan", ["--shard", "2/2"],
+                                       dry=False)
+        sd = os.path.join(get_outdir(tp), "submission")
+        print(stderr)
+        assert rc == 0
+        with open(os.path.join(sd, "looper_plan_2of2.jsonl")) as f:
+            assert len(f.readlines()) == 3
+
+    def test_apply_dry_run(self, prep_temp_pep):
+        """ Verify that a dry run of apply lists the planned jobs """
+        tp = prep_temp_pep
+        subp_exec(tp, "plan", dry=False)
+        plan = os.path.join(get_outdir(tp), "submission", "looper_plan.jsonl")
+        stdout, stderr, rc = subp_exec(plan, "apply")
+        print(stderr)
+        assert rc == 0
+        assert stderr.count("Dry run, not submitted") == 6
+
+
+class LooperStatusTests:
+    def test_job_ids_recorded_and_queried(self, prep_temp_pep):
+        """ Verify that the job IDs are recorded and their states queried """
+        tp = prep_temp_pep
+        stub = os.path.join(os.path.dirname(tp), "submit.sh")
+        with open(stub, "w") as f:
+            f.write("echo 'Submitted batch job 1'\n")
+        stdout, stderr, rc = subp_exec(
+            tp, "run", ["-c", "submission_command=sh " + stub], dry=False)
+        print(stderr)
+        assert rc == 0
+        journal = os.path.join(get_outdir(tp), "submission",
+                               "looper_jobs.jsonl")
+        with open(journal) as f:
+            jobs = [json.loads(line) for line in f]
+        assert len(jobs) == 6
+        assert all(j["job_id"] == "1" for j in jobs)
+        stdout, stderr, rc = subp_exec(
+            tp, "status", ["-c", "job_status_command=echo 1 PENDING"],
+            dry=False)
+        print(stderr)
+        assert rc == 0
+        assert "QUEUED: 6" in stderr
+
+
 class LooperComputeTests:
     @pytest.mark.parametrize("cmd", ["run", "runp"])
     def test_looper_respects_pkg_selection(self, prep_temp_pep, cmd):